@@ -0,0 +1,150 @@
+"""
+图片处理基准测试
+对比旧路径（事件循环内全尺寸解码 + resize）与 draft/reduce + 进程池路径的吞吐、延迟和事件循环阻塞，
+以及重复图片命中处理结果缓存时的开销
+
+Examples:
+    python scripts/bench_image.py
+    python scripts/bench_image.py --size 4000x3000 --count 24 --concurrency 6 --workers 2
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+
+def legacy_data_url(path: str, max_px: int = 1024, quality: int = 85) -> str:
+    """The pre-pool implementation: full decode + default resample, inline."""
+    img = Image.open(path)
+    img = img.convert("RGB")
+    w, h = img.size
+    scale = min(1.0, float(max_px) / float(max(w, h)))
+    if scale < 1.0:
+        img = img.resize((int(w * scale), int(h * scale)))
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True)
+    return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def make_photo(path: Path, width: int, height: int):
+    """A photo-like JPEG: gradients + shapes so the encoder has real work to do."""
+    img = Image.radial_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    step = max(8, width // 40)
+    for i in range(0, width, step):
+        draw.line([(i, 0), (width - i, height)], fill=(i % 255, (i * 3) % 255, (i * 7) % 255), width=3)
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    Image.blend(img, noise, 0.3).save(path, format="JPEG", quality=92)
+
+
+def _pct(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else 0.0
+
+
+async def _measure(name: str, count: int, concurrency: int, job: Callable[[], Awaitable[str]]) -> Dict[str, float]:
+    """Run `count` jobs with bounded concurrency while a ticker measures event-loop lag."""
+    lags: List[float] = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        interval = 0.005
+        while not stop.is_set():
+            t = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - t - interval)
+
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one():
+        async with sem:
+            t = time.perf_counter()
+            await job()
+            latencies.append(time.perf_counter() - t)
+
+    tick = asyncio.create_task(ticker())
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(count)))
+    wall = time.perf_counter() - t0
+    stop.set()
+    await tick
+
+    return {
+        "name": name,
+        "throughput": count / wall,
+        "p50_ms": _pct(latencies, 0.5) * 1000,
+        "p95_ms": _pct(latencies, 0.95) * 1000,
+        "loop_lag_max_ms": max(lags, default=0.0) * 1000,
+        "loop_lag_p99_ms": _pct(lags, 0.99) * 1000,
+    }
+
+
+async def amain(args):
+    from src.utils import image_utils
+
+    width, height = (int(x) for x in args.size.lower().split("x"))
+    workdir = Path(tempfile.mkdtemp(prefix="bench-image-"))
+    photo = workdir / "photo.jpg"
+    make_photo(photo, width, height)
+    print(f"input: {width}x{height} JPEG, {photo.stat().st_size / 1024:.0f} KB; "
+          f"count={args.count} concurrency={args.concurrency} max_px={args.max_px}")
+
+    async def legacy_inline():
+        return legacy_data_url(str(photo), args.max_px)
+
+    async def legacy_thread():
+        return await asyncio.to_thread(legacy_data_url, str(photo), args.max_px)
+
+    async def draft_pool():
+        return await image_utils.image_file_to_data_url_async(photo, max_px=args.max_px)
+
+    async def draft_pool_cached():
+        # same image re-posted: served from the (content hash, max_px, quality) cache
+        return await image_utils.image_file_to_data_url_async(photo, max_px=args.max_px, content_hash="bench")
+
+    # fork the workers up front, as the bot does at startup
+    image_utils.start_pool()
+    await draft_pool()
+    await draft_pool_cached()
+
+    rows = [
+        await _measure("legacy (on loop)", args.count, args.concurrency, legacy_inline),
+        await _measure("legacy (to_thread)", args.count, args.concurrency, legacy_thread),
+        await _measure("draft + process pool", args.count, args.concurrency, draft_pool),
+        await _measure("repeat (cache hit)", args.count, args.concurrency, draft_pool_cached),
+    ]
+    image_utils.shutdown_pool()
+
+    print(f"{'path':<22}{'img/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'loop lag max':>14}{'lag p99':>9}")
+    for r in rows:
+        print(f"{r['name']:<22}{r['throughput']:>8.1f}{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}"
+              f"{r['loop_lag_max_ms']:>14.0f}{r['loop_lag_p99_ms']:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image decode/resize/encode paths")
+    parser.add_argument("--size", default="4000x3000")
+    parser.add_argument("--count", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-px", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=0, help="IMAGE_WORKERS (0 = min(4, cpu count))")
+    args = parser.parse_args()
+    if args.workers:
+        os.environ["IMAGE_WORKERS"] = str(args.workers)
+    asyncio.run(amain(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+聊天链路压测工具
+以目标 RPS 驱动 OpenAIClient 或 handle_chat，统计吞吐、延迟分位数和拒绝率
+
+By default an in-process mock backend (scripts/mock_openai_server.py) is started,
+so no real backend quota is used. Everything runs in a throwaway working
+directory so the SQLite DB / media cache of the real bot are not touched.
+
+Examples:
+    python scripts/loadtest.py --target client --rps 20 --duration 30
+    python scripts/loadtest.py --target chat --rps 5 --duration 20 --rate-429 0.05
+    python scripts/loadtest.py --target client --base-url http://127.0.0.1:8045/v1   # external backend
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "scripts"))
+
+from mock_openai_server import add_mock_args, config_from_args, start_server  # noqa: E402
+
+_PROMPTS = [
+    "你好，今天天气怎么样？",
+    "帮我写一个 Python 快速排序",
+    "解释一下什么是 TCP 三次握手",
+    "推荐几本科幻小说",
+    "这段报错是什么意思：KeyError: 'choices'",
+    "用一句话总结一下相对论",
+]
+
+
+def _classify(reply: str) -> str:
+    """Map a reply to an outcome bucket."""
+    if not reply:
+        return "empty"
+    if "系统繁忙" in reply:
+        return "rejected_busy"
+    if "429" in reply:
+        return "rejected_429"
+    if reply.startswith("[Error]") or "出现错误" in reply or "未知错误" in reply:
+        return "error"
+    return "ok"
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+@dataclass
+class Result:
+    latencies: Dict[str, List[float]] = field(default_factory=dict)
+    outcomes: Dict[str, int] = field(default_factory=dict)
+    scheduled: int = 0
+    late_starts: int = 0
+
+    def add(self, outcome: str, latency: float):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.latencies.setdefault(outcome, []).append(latency)
+
+    def report(self, wall_sec: float) -> str:
+        total = sum(self.outcomes.values())
+        ok = self.outcomes.get("ok", 0)
+        all_lat = sorted(x for v in self.latencies.values() for x in v)
+        ok_lat = sorted(self.latencies.get("ok", []))
+        lines = [
+            f"requests      : {total} (scheduled {self.scheduled}, late starts {self.late_starts})",
+            f"wall time     : {wall_sec:.1f}s",
+            f"throughput    : {total / wall_sec:.2f} req/s, {ok / wall_sec:.2f} ok/s",
+        ]
+        for name in sorted(self.outcomes):
+            n = self.outcomes[name]
+            lines.append(f"  {name:<14}: {n:>6}  ({n / total:.1%})" if total else f"  {name}: {n}")
+        for label, lat in (("latency(all)", all_lat), ("latency(ok) ", ok_lat)):
+            if lat:
+                lines.append(
+                    f"{label}  : p50={_percentile(lat, .5) * 1000:.0f}ms "
+                    f"p90={_percentile(lat, .9) * 1000:.0f}ms "
+                    f"p99={_percentile(lat, .99) * 1000:.0f}ms "
+                    f"max={lat[-1] * 1000:.0f}ms"
+                )
+        return "\n".join(lines)
+
+
+async def run_open_loop(rps: float, duration: float, one: Callable[[int], Awaitable[str]]) -> Result:
+    """Open-loop load: requests are started on a fixed schedule regardless of completions,
+    so backend slowness shows up as latency/rejections instead of silently lowering RPS."""
+    res = Result()
+    interval = 1.0 / rps
+    tasks = []
+    start = time.monotonic()
+    i = 0
+
+    async def _timed(idx: int):
+        t0 = time.monotonic()
+        try:
+            reply = await one(idx)
+            outcome = _classify(reply)
+        except Exception as e:
+            outcome = f"exc:{type(e).__name__}"
+        res.add(outcome, time.monotonic() - t0)
+
+    while True:
+        due = start + i * interval
+        if due - start >= duration:
+            break
+        now = time.monotonic()
+        if due > now:
+            await asyncio.sleep(due - now)
+        elif now - due > interval:
+            res.late_starts += 1
+        tasks.append(asyncio.create_task(_timed(i)))
+        res.scheduled += 1
+        i += 1
+
+    await asyncio.gather(*tasks)
+    return res
+
+
+def _client_driver(vision_ratio: float) -> Callable[[int], Awaitable[str]]:
+    from src.utils.openai_client import openai_client
+
+    tiny = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4//8/AAX+Av4N70a4AAAAAElFTkSuQmCC"
+
+    async def one(idx: int) -> str:
+        prompt = random.choice(_PROMPTS)
+        if random.random() < vision_ratio:
+            return await openai_client.chat_completions_vision(prompt, [tiny], model="mock")
+        return await openai_client.generate_content("auto", prompt, user_key=f"user_{idx % 50}")
+
+    return one
+
+
+def _chat_driver(n_users: int) -> Callable[[int], Awaitable[str]]:
+    """Drive handle_chat with synthetic group events and a fake OneBot bot."""
+    import nonebot
+    from nonebot.adapters.onebot.v11 import Adapter, Bot, GroupMessageEvent, Message, MessageSegment
+    from nonebot.exception import FinishedException
+
+    nonebot.init(log_level=os.getenv("LOADTEST_LOG_LEVEL", "WARNING"))
+    driver = nonebot.get_driver()
+    adapter = Adapter(driver)
+    sent: Dict[int, str] = {}
+
+    class LoadTestBot(Bot):
+        async def call_api(self, api: str, **data):
+            # record the last outbound text per group; pretend NapCat accepted it
+            gid = data.get("group_id")
+            if api == "send_group_forward_msg":
+                sent[gid] = "".join(str(n["data"]["content"]) for n in data.get("messages") or [])
+            elif api in ("send_group_msg", "send_msg"):
+                sent[gid] = str(data.get("message"))
+            return {"message_id": random.randint(1, 1 << 30)}
+
+    bot = LoadTestBot(adapter, "10000")
+    driver._bots[bot.self_id] = bot  # type: ignore[attr-defined]
+
+    from src.plugins.chat import handle_chat
+
+    async def one(idx: int) -> str:
+        group_id = 900000 + idx  # one target per request so replies can be matched
+        user_id = 20000 + idx % n_users
+        msg = Message([MessageSegment.at(bot.self_id), MessageSegment.text(random.choice(_PROMPTS))])
+        event = GroupMessageEvent.model_validate({
+            "time": int(time.time()),
+            "self_id": int(bot.self_id),
+            "post_type": "message",
+            "sub_type": "normal",
+            "user_id": user_id,
+            "message_type": "group",
+            "message_id": idx + 1,
+            "message": msg,
+            "original_message": msg,
+            "raw_message": str(msg),
+            "font": 0,
+            "sender": {"user_id": user_id, "nickname": f"u{user_id}", "card": ""},
+            "to_me": True,
+            "group_id": group_id,
+        })
+        try:
+            await handle_chat(event)
+        except FinishedException:
+            pass
+        return sent.pop(group_id, "")
+
+    return one
+
+
+async def amain(args: argparse.Namespace):
+    runner = None
+    base_url = args.base_url
+    if not base_url:
+        runner, port = await start_server(config_from_args(args))
+        base_url = f"http://127.0.0.1:{port}/v1"
+        print(f"mock backend on {base_url} (latency={args.latency}, 429={args.rate_429}, 5xx={args.rate_5xx})")
+
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ.setdefault("MAX_CONCURRENT_REQUESTS", str(args.concurrency))
+    os.environ["LOADTEST_LOG_LEVEL"] = args.log_level.upper()
+
+    one = _client_driver(args.vision_ratio) if args.target == "client" else _chat_driver(args.users)
+
+    print(f"target={args.target} rps={args.rps} duration={args.duration}s "
+          f"MAX_CONCURRENT_REQUESTS={os.environ['MAX_CONCURRENT_REQUESTS']}")
+    t0 = time.monotonic()
+    res = await run_open_loop(args.rps, args.duration, one)
+    print(res.report(time.monotonic() - t0))
+
+    if runner is not None:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the chat pipeline")
+    parser.add_argument("--target", choices=("client", "chat"), default="client",
+                        help="client: OpenAIClient directly; chat: full handle_chat pipeline")
+    parser.add_argument("--rps", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--users", type=int, default=50, help="distinct users for --target chat")
+    parser.add_argument("--vision-ratio", type=float, default=0.0, help="share of vision requests for --target client")
+    parser.add_argument("--concurrency", type=int, default=4, help="MAX_CONCURRENT_REQUESTS if not set in env")
+    parser.add_argument("--base-url", default="", help="use an external backend instead of the in-process mock")
+    parser.add_argument("--workdir", default="", help="working directory for data/ (default: a temp dir)")
+    parser.add_argument("--log-level", default="WARNING", help="bot log level during the run")
+    add_mock_args(parser)
+    args = parser.parse_args()
+
+    # src.utils.* create data/ files relative to cwd at import time
+    workdir = args.workdir or tempfile.mkdtemp(prefix="qqbot-loadtest-")
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    os.chdir(workdir)
+
+    from nonebot.log import logger
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level.upper())
+
+    asyncio.run(amain(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+本地 OpenAI-compatible 模拟后端
+用于压测聊天链路，不消耗真实后端额度
+
+Endpoints:
+- POST /v1/chat/completions   (text / vision payloads, stream=true supported)
+- POST /v1/images/generations (returns a tiny PNG as b64_json)
+- GET  /v1/models
+- GET  /mock/stats             (served / injected error counters)
+
+Usage:
+    python scripts/mock_openai_server.py --port 8045 --latency lognormal:800,0.5 --rate-429 0.05 --rate-5xx 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8045/v1 OPENAI_API_KEY=mock python bot.py
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+from aiohttp import web
+
+# 1x1 white PNG
+_TINY_PNG_B64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4//8/AAX+Av4N70a4AAAAAElFTkSuQmCC"
+)
+
+# rough per-image prompt cost, in line with OpenAI's low-detail vision pricing
+_IMAGE_TOKENS = 85
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Build a latency sampler (seconds) from a spec string.
+
+    - fixed:MS
+    - uniform:LO_MS,HI_MS
+    - normal:MEAN_MS,STD_MS
+    - lognormal:MEDIAN_MS,SIGMA   (heavy tail, closest to real LLM backends)
+    """
+    kind, _, args = (spec or "fixed:0").partition(":")
+    vals = [float(x) for x in args.split(",") if x.strip()] if args else []
+    kind = kind.strip().lower()
+
+    if kind == "fixed":
+        ms = vals[0] if vals else 0.0
+        return lambda: ms / 1000
+    if kind == "uniform":
+        lo, hi = vals
+        return lambda: random.uniform(lo, hi) / 1000
+    if kind == "normal":
+        mean, std = vals
+        return lambda: max(0.0, random.gauss(mean, std)) / 1000
+    if kind == "lognormal":
+        median, sigma = vals
+        mu = math.log(max(median, 1e-3))
+        return lambda: random.lognormvariate(mu, sigma) / 1000
+    raise ValueError(f"unknown latency spec: {spec!r}")
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 chars per token for latin, ~1.5 for CJK; a blended estimate is good enough here
+    return max(1, int(len(text or "") / 2.5))
+
+
+@dataclass
+class MockConfig:
+    latency: Callable[[], float]
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    reply_chars: int = 80
+    stream_chunk_chars: int = 8
+    stream_chunk_delay_ms: float = 20.0
+
+
+@dataclass
+class MockStats:
+    started_at: float = field(default_factory=time.time)
+    requests: Dict[str, int] = field(default_factory=dict)
+    injected_429: int = 0
+    injected_5xx: int = 0
+    images_seen: int = 0
+    audios_seen: int = 0
+
+    def bump(self, route: str):
+        self.requests[route] = self.requests.get(route, 0) + 1
+
+
+def _count_prompt(messages: List[Dict[str, Any]], stats: MockStats) -> int:
+    tokens = 0
+    for m in messages or []:
+        content = m.get("content")
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+            continue
+        for part in content or []:
+            ptype = part.get("type")
+            if ptype == "text":
+                tokens += estimate_tokens(part.get("text", ""))
+            elif ptype == "image_url":
+                stats.images_seen += 1
+                tokens += _IMAGE_TOKENS
+            elif ptype == "input_audio":
+                stats.audios_seen += 1
+                # ~1 token per 32 bytes of base64 audio; only used for usage accounting
+                tokens += len((part.get("input_audio") or {}).get("data", "")) // 32
+    return tokens
+
+
+def _make_reply(messages: List[Dict[str, Any]], n_chars: int) -> str:
+    last = ""
+    for m in reversed(messages or []):
+        if m.get("role") == "user":
+            c = m.get("content")
+            last = c if isinstance(c, str) else " ".join(
+                p.get("text", "") for p in (c or []) if p.get("type") == "text"
+            )
+            break
+    seed = f"[mock] 收到：{last[:20]} "
+    filler = "这是模拟后端的回复。"
+    text = seed
+    while len(text) < n_chars:
+        text += filler
+    return text[:n_chars]
+
+
+def create_app(cfg: MockConfig) -> web.Application:
+    stats = MockStats()
+
+    def _maybe_inject() -> web.Response | None:
+        r = random.random()
+        if r < cfg.rate_429:
+            stats.injected_429 += 1
+            return web.json_response(
+                {"error": {"message": "mock rate limited", "type": "rate_limit_error"}}, status=429
+            )
+        if r < cfg.rate_429 + cfg.rate_5xx:
+            stats.injected_5xx += 1
+            status = random.choice((500, 502, 503))
+            return web.json_response({"error": {"message": "mock upstream error"}}, status=status)
+        return None
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        stats.bump("chat")
+        body = await request.json()
+        await asyncio.sleep(cfg.latency())
+
+        injected = _maybe_inject()
+        if injected is not None:
+            return injected
+
+        messages = body.get("messages") or []
+        model = body.get("model") or "mock"
+        prompt_tokens = _count_prompt(messages, stats)
+        reply = _make_reply(messages, cfg.reply_chars)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(reply),
+            "total_tokens": prompt_tokens + estimate_tokens(reply),
+        }
+        created = int(time.time())
+        rid = f"chatcmpl-mock-{created}-{random.randint(0, 1 << 30)}"
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": rid,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await resp.prepare(request)
+
+        def _chunk(delta: Dict[str, Any], finish: str | None = None, with_usage: bool = False) -> bytes:
+            data = {
+                "id": rid,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            if with_usage:
+                data["usage"] = usage
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        await resp.write(_chunk({"role": "assistant", "content": ""}))
+        step = max(1, cfg.stream_chunk_chars)
+        for i in range(0, len(reply), step):
+            await asyncio.sleep(cfg.stream_chunk_delay_ms / 1000)
+            await resp.write(_chunk({"content": reply[i:i + step]}))
+        await resp.write(_chunk({}, finish="stop", with_usage=True))
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    async def images_generations(request: web.Request) -> web.Response:
+        stats.bump("images")
+        body = await request.json()
+        await asyncio.sleep(cfg.latency())
+
+        injected = _maybe_inject()
+        if injected is not None:
+            return injected
+
+        n = int(body.get("n") or 1)
+        if body.get("response_format", "b64_json") == "url":
+            data = [{"url": f"data:image/png;base64,{_TINY_PNG_B64}"} for _ in range(n)]
+        else:
+            data = [{"b64_json": _TINY_PNG_B64} for _ in range(n)]
+        return web.json_response({"created": int(time.time()), "data": data})
+
+    async def models(request: web.Request) -> web.Response:
+        stats.bump("models")
+        ids = ["gemini-3-flash", "gemini-3-pro-high", "gemini-3-pro-image", "mock"]
+        return web.json_response({"object": "list", "data": [{"id": i, "object": "model"} for i in ids]})
+
+    async def mock_stats(request: web.Request) -> web.Response:
+        return web.json_response({
+            "uptime_sec": round(time.time() - stats.started_at, 1),
+            "requests": stats.requests,
+            "injected_429": stats.injected_429,
+            "injected_5xx": stats.injected_5xx,
+            "images_seen": stats.images_seen,
+            "audios_seen": stats.audios_seen,
+        })
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/v1/images/generations", images_generations)
+    app.router.add_get("/v1/models", models)
+    app.router.add_get("/mock/stats", mock_stats)
+    app["stats"] = stats
+    return app
+
+
+async def start_server(cfg: MockConfig, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, int]:
+    """Start the mock server in the current loop; returns (runner, bound_port)."""
+    runner = web.AppRunner(create_app(cfg))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+    return runner, bound
+
+
+def add_mock_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", default="lognormal:800,0.5", help="fixed:MS | uniform:LO,HI | normal:MEAN,STD | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="fraction of requests answered with 500/502/503")
+    parser.add_argument("--reply-chars", type=int, default=80)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency=parse_latency(args.latency),
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        reply_chars=args.reply_chars,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8045)
+    add_mock_args(parser)
+    args = parser.parse_args()
+
+    web.run_app(create_app(config_from_args(args)), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -611,6 +611,76 @@ else:
                 data["db_error"] = str(e)
             return JSONResponse(data)
 
+        @router.get("/admin/api/experiments")
+        async def admin_experiments(request: Request):
+            if not _require_token(request):
+                raise HTTPException(status_code=401, detail="unauthorized")
+
+            from src.utils.model_experiment import model_experiment
+
+            return JSONResponse({"ts": _now_iso(), **model_experiment.report()})
+
+        @router.post("/admin/api/experiments/reset")
+        async def admin_experiments_reset(request: Request):
+            if not _require_token(request):
+                raise HTTPException(status_code=401, detail="unauthorized")
+
+            from src.utils.model_experiment import model_experiment
+
+            conn = db._get_connection()  # type: ignore
+            _audit(conn, request, action="reset_experiment", target=model_experiment.name)
+
+            model_experiment.reset()
+            return JSONResponse({"ok": True})
+
+        @router.get("/admin/api/outbound")
+        async def admin_outbound(request: Request):
+            if not _require_token(request):
+                raise HTTPException(status_code=401, detail="unauthorized")
+
+            from src.utils.message_forwarder import outbound
+
+            return JSONResponse({"ts": _now_iso(), **outbound.stats()})
+
+        @router.get("/admin/api/ingest")
+        async def admin_ingest(request: Request):
+            if not _require_token(request):
+                raise HTTPException(status_code=401, detail="unauthorized")
+
+            from src.utils.chat_coalescer import chat_coalescer
+            from src.utils.conversation_actor import conversation_actors
+            from src.utils.message_ingest import message_ingest
+
+            return JSONResponse({
+                "ts": _now_iso(),
+                **message_ingest.stats(),
+                "coalescing": chat_coalescer.stats(),
+                "conversations": conversation_actors.stats(),
+            })
+
+        @router.get("/admin/api/latency")
+        async def admin_latency(request: Request):
+            if not _require_token(request):
+                raise HTTPException(status_code=401, detail="unauthorized")
+
+            from src.utils.deadline import latency_budget
+
+            return JSONResponse({"ts": _now_iso(), **latency_budget.stats()})
+
+        @router.get("/admin/api/vision_cache")
+        async def admin_vision_cache(request: Request):
+            if not _require_token(request):
+                raise HTTPException(status_code=401, detail="unauthorized")
+
+            from src.utils.image_utils import prepared_cache
+            from src.utils.vision_cache import vision_cache
+
+            return JSONResponse({
+                "ts": _now_iso(),
+                "answers": vision_cache.stats(),
+                "prepared_images": prepared_cache.stats(),
+            })
+
         @router.get("/admin/api/users")
         async def admin_users(request: Request, query: str = "", limit: int = 200):
             if not _require_token(request):
@@ -1,4 +1,4 @@
-from nonebot import on_message, on_command, get_bot
+from nonebot import on_command, get_bot
 from src.utils.safe_bot import safe_get_bot
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, Bot
 from nonebot.log import logger
@@ -8,6 +8,9 @@ import os
 import aiohttp
 import json
 
+from src.utils.message_ingest import message_ingest
+from src.utils.message_parser import ParsedMessage
+
 from nonebot import get_driver
 
 # Initialize Scheduler
@@ -71,19 +74,17 @@ async def handle_manual_summary(event: GroupMessageEvent):
 
     await manual_summary_cmd.finish()
 
-# Message Recorder
-recorder = on_message(priority=10, block=False)
-
-@recorder.handle()
-async def record_message(event: GroupMessageEvent):
+# Message Recorder (consumer of the shared message ingest)
+async def record_message(event: GroupMessageEvent, parsed: ParsedMessage):
     group_id = event.group_id
     # 优先使用群名片(card)，其次是QQ昵称(nickname)，最后是QQ号
     sender = event.sender.card or event.sender.nickname or str(event.user_id)
-    content = event.get_plaintext()
-    
+
     # Save to database
     from src.utils.database import db
-    db.add_group_message(group_id, sender, content)
+    db.add_group_message(group_id, sender, parsed.plain_text)
+
+message_ingest.register("group_archive", record_message)
 
 # Gemini API Summarization
 async def generate_summary(messages):
@@ -137,17 +138,12 @@ async def push_summary(period_name):
             from src.utils.conversation_memory import conversation_memory
             conversation_memory.add_group_summary(str(group_id), f"{period_name}: {summary}")
             
-            # Check length for smart forwarding
-            threshold = int(os.getenv("FORWARD_THRESHOLD", "100"))
-            
-            if len(msg) > threshold:
-                from src.utils.message_forwarder import send_group_forward_message, split_text_into_paragraphs
-                paragraphs = split_text_into_paragraphs(msg)
-                await send_group_forward_message(bot, group_id, paragraphs)
-            else:
-                await bot.send_group_msg(group_id=group_id, message=msg)
+            # Long messages are sent as forward messages (plain fallback handled by the queue);
+            # don't wait for delivery so one slow group doesn't delay the next summary
+            from src.utils.message_forwarder import push_text
+            await push_text(bot, "group", group_id, msg, wait=False)
                 
-            logger.info(f"Sent summary to group {group_id} and saved to long-term memory")
+            logger.info(f"Queued summary for group {group_id} and saved to long-term memory")
         except Exception as e:
             logger.error(f"Failed to generate/send summary for group {group_id}: {e}")
 
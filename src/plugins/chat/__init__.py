@@ -1,14 +1,57 @@
-from nonebot import on_message, on_command, get_bot
+from nonebot import on_message, on_command, get_bot, get_driver
 from nonebot.rule import to_me
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, PrivateMessageEvent, Bot
 from nonebot.log import logger
+import asyncio
+import dataclasses
 import os
+import sys
 import json
 from typing import Union
 
+from src.utils.message_ingest import message_ingest
+
+driver = get_driver()
+
 # Chat Handler
 chat = on_message(priority=99, block=False)
 
+
+@driver.on_startup
+async def start_image_pool():
+    # fork the Pillow workers first, while the process is still single-threaded
+    from src.utils.image_utils import start_pool
+    start_pool()
+
+
+@driver.on_startup
+async def build_command_matcher():
+    # all plugins are loaded by now
+    from src.utils.command_matcher import command_matcher
+    command_matcher.build()
+
+
+@driver.on_shutdown
+async def close_media_session():
+    from src.utils.media_downloader import media_downloader
+    from src.utils.image_utils import shutdown_pool
+    await media_downloader.close()
+    shutdown_pool()
+
+
+@driver.on_shutdown
+async def close_outbound_queue():
+    from src.utils.message_forwarder import outbound
+    await outbound.close()
+
+
+@driver.on_shutdown
+async def close_key_pool():
+    # only if something actually loaded the Gemini client; importing it here would create one
+    module = sys.modules.get("src.utils.gemini_client")
+    if module is not None:
+        await module.gemini_client.key_pool.close()
+
 # Clear command
 clear_cmd = on_command("clear", aliases={"清空记忆"}, priority=5)
 
@@ -51,8 +94,59 @@ async def handle_clear(event: Union[GroupMessageEvent, PrivateMessageEvent]):
 
     await clear_cmd.finish("✅ 记忆已清空，我们可以开始新的对话了！")
 
+async def _record_recent_images(event: GroupMessageEvent, parsed):
+    """记下图片 URL（不下载），供之后“@bot 这张图什么意思”按需识别"""
+    from src.utils.recent_images import recent_images
+    recent_images.record(event.group_id, event.user_id, event.message_id, parsed.images)
+
+
+message_ingest.register("recent_images", _record_recent_images)
+
+def _find_referenced_images(event: Union[GroupMessageEvent, PrivateMessageEvent], text: str):
+    """被回复的图片消息，或群里最近的图片（文本像是在追问图片时）"""
+    from src.utils.message_parser import message_parser
+    from src.utils.recent_images import is_image_follow_up, recent_images
+
+    limit = int(os.getenv("MAX_IMAGE_COUNT", "3"))
+    reply = getattr(event, "reply", None)
+    if reply is not None:
+        images = message_parser.extract_images(reply.message)
+        if not images and isinstance(event, GroupMessageEvent):
+            images = recent_images.find(str(event.group_id), message_id=reply.message_id, limit=limit)
+        if images:
+            return images[:limit]
+
+    if isinstance(event, GroupMessageEvent) and is_image_follow_up(text):
+        return recent_images.find(str(event.group_id), user_id=str(event.user_id), limit=limit)
+    return []
+
+async def _await_with_ack(coro, deadline, event: Union[GroupMessageEvent, PrivateMessageEvent]) -> str:
+    """等待 LLM 回复：超过 CHAT_ACK_AFTER_SEC 先发一句“思考中”，预算用完则放弃"""
+    from src.utils.deadline import latency_budget
+
+    task = asyncio.ensure_future(coro)
+    ack_after = min(latency_budget.ack_after_sec, deadline.remaining())
+    if latency_budget.ack_after_sec > 0 and ack_after > 0:
+        done, _ = await asyncio.wait({task}, timeout=ack_after)
+        if not done:
+            deadline.degrade("ack")
+            try:
+                from src.utils.message_forwarder import send_message_smart
+                await send_message_smart(get_bot(), "稍等，我再想想…", event)
+            except Exception as e:
+                logger.warning(f"Failed to send thinking ack: {e}")
+    try:
+        return await asyncio.wait_for(task, timeout=max(0.1, deadline.remaining()))
+    except asyncio.TimeoutError:
+        deadline.degrade("timeout")
+        logger.warning(f"LLM reply exceeded the {deadline.budget_sec:.0f}s budget")
+        return "[Error] 回复超时，请稍后再试"
+
 @chat.handle()
 async def handle_chat(event: Union[GroupMessageEvent, PrivateMessageEvent]):
+    from src.utils.deadline import latency_budget
+    deadline = latency_budget.start()
+    turn = None
     try:
         # Check if message is to me
         if not event.is_tome():
@@ -76,93 +170,44 @@ async def handle_chat(event: Union[GroupMessageEvent, PrivateMessageEvent]):
         # Import utilities
         from src.utils.conversation_memory import conversation_memory
         from src.utils.openai_client import openai_client
-        from src.utils.image_utils import image_file_to_data_url
-        from src.utils.message_parser import message_parser
-        from src.utils.media_downloader import media_downloader
         
-        # Parse message
+        # Parse message (reuses the ingest stage's parse; copied because the handler edits it)
         try:
-            parsed = message_parser.parse_message(event)
+            parsed = dataclasses.replace(message_ingest.parse(event))
         except Exception as e:
             logger.error(f"Message parsing failed: {e}")
             await chat.finish("消息解析失败，请重试。")
-        # Media handling (OpenAI-compatible):
-        # - Images: use vision endpoint
-        # - Audio/Video: not supported yet
-        if getattr(parsed, "has_media", False):
-            if getattr(parsed, "audios", None) or getattr(parsed, "videos", None):
-                await chat.finish("⚠️ 暂不支持语音/视频输入（后续可加本地 Whisper/TTS）。")
-                return
-            if getattr(parsed, "images", None):
-                # Build vision prompt
-                max_images = int(os.getenv("MAX_IMAGE_COUNT", "3"))
-                max_px = int(os.getenv("IMAGE_MAX_PX", "1024"))
-                quality = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
-
-                image_urls = []
-                for img in parsed.images[:max_images]:
-                    if not img.url:
-                        continue
-                    file_path = await media_downloader.download_image(img.url, filename_hint=img.file)
-                    image_urls.append(image_file_to_data_url(file_path, max_px=max_px, quality=quality))
-
-                model_for_vision = os.getenv("MODEL_CHAT_LONG", os.getenv("MODEL_CHAT_SHORT", "auto"))
-                reply = await openai_client.chat_completions_vision(
-                    text_prompt=parsed.text or "请描述这张图片",
-                    image_data_urls=image_urls,
-                    model=model_for_vision,
-                )
-
-                from src.utils.text_formatter import markdown_to_plain_text
-                reply = markdown_to_plain_text(reply)
-
-                from src.utils.message_forwarder import send_message_smart
-                threshold = int(os.getenv("FORWARD_THRESHOLD", "100"))
 
-                try:
-                    bot = get_bot()
-                    await send_message_smart(bot=bot, message=reply, event=event, threshold=threshold)
-                except Exception:
-                    await chat.send(reply)
-
-                await chat.finish()
-
-            return
-
-        # 检查是否为命令消息（避免与命令处理器冲突）
+        # 检查是否为命令消息（避免与命令处理器冲突）：正则由已注册的命令自动生成
         if parsed.text:
-            text_lower = parsed.text.strip().lower()
-            # 定义所有命令关键词
-            command_keywords = [
-                'ping', '在吗',
-                'help', '帮助', '菜单',
-                'weather', '天气',
-                'add_rss', '订阅',
-                'rss', '订阅列表', '取消订阅',
-                'rss_digest', '今日摘要', 'rss摘要',
-                'remind', '提醒',
-                'summary', '总结',
-                '水群榜', '聊天榜', '发言榜',
-                'clear', '清空记忆',
-                'memory', '记忆统计',
-                'db', '数据库'
-            ]
-            
-            # 检查消息是否以命令前缀开始或包含命令关键词
-            # 去除@机器人后的内容进行检查
-            text_to_check = text_lower.strip()
-            
-            # 如果消息以/开头，直接判定为命令
-            if text_to_check.startswith('/'):
-                logger.info(f"Skipping AI response for command: {text_to_check[:20]}")
+            from src.utils.command_matcher import command_matcher
+            command = command_matcher.match(parsed.text)
+            if command:
+                logger.info(f"Skipping AI response for command: {command}")
                 return
-            
-            # 检查是否完全匹配命令关键词或以命令关键词开头
-            for keyword in command_keywords:
-                keyword_lower = keyword.lower()
-                if text_to_check == keyword_lower or text_to_check.startswith(keyword_lower + ' '):
-                    logger.info(f"Skipping AI response for command keyword: {keyword}")
-                    return
+        
+        # 追问之前发过的图片（回复图片消息，或“这张图什么意思”）：此时才下载识别
+        if not parsed.has_media:
+            referenced = _find_referenced_images(event, parsed.text)
+            if referenced:
+                logger.info(f"Follow-up question refers to {len(referenced)} earlier image(s)")
+                parsed.images = referenced
+                parsed.has_media = True
+        
+        # 连发合并（CHAT_COALESCE_MS）：窗口内后到的消息并入第一条的批次，由第一条统一回复
+        from src.utils.chat_coalescer import chat_coalescer, merge_parsed
+        coalesce_key = (f"group_{event.group_id}_user_{event.user_id}"
+                        if isinstance(event, GroupMessageEvent) else f"user_{event.user_id}")
+        batch = await chat_coalescer.submit(coalesce_key, (event.message_id, parsed))
+        if batch is None:
+            logger.info(f"Message merged into pending burst of {coalesce_key}")
+            return
+        deadline.lap("coalesce")
+        reply_to = None
+        if len(batch) > 1:
+            logger.info(f"Coalesced {len(batch)} rapid messages from {coalesce_key}")
+            parsed = merge_parsed([p for _, p in batch])
+            reply_to = batch[-1][0]  # quote the last message so the reply visibly covers the burst
         
         # 检查是否有内容
         if not parsed.text and not parsed.has_media:
@@ -187,18 +232,13 @@ async def handle_chat(event: Union[GroupMessageEvent, PrivateMessageEvent]):
             group_id = None
             user_name = None
         
-        logger.info(f"Building context for {user_id}...")
-        
-        # Build full context (Tier 1 + Tier 2 + Tier 3)
+        # 同一会话按顺序逐条处理（回复不乱序），排队中的轮次复用上一轮的上下文快照
+        from src.utils.conversation_actor import MailboxFull, conversation_actors
         try:
-            personal_history, system_context = conversation_memory.build_full_context(user_id, group_id)
-        except Exception as e:
-            logger.error(f"Failed to build context: {e}")
-            personal_history = []
-            system_context = None
-        
-        # 处理多模态内容
-        uploaded_files = []
+            turn = await conversation_actors.enter(user_id)
+        except MailboxFull:
+            await chat.finish("消息太多啦，等我先回完前面的～")
+        deadline.lap("queue")
         
         if parsed.has_media:
             # 检查用户配额
@@ -219,102 +259,53 @@ async def handle_chat(event: Union[GroupMessageEvent, PrivateMessageEvent]):
             logger.info(f"Processing multimodal message: {len(parsed.images)} images, "
                        f"{len(parsed.audios)} audios, {len(parsed.videos)} videos "
                        f"(quota: {used+1}/{quota_manager.daily_limit})")
-            
+        
+        # Tier 3 is dropped when the deadline is close
+        include_summaries = not deadline.should("drop_summaries")
+        
+        async def load_context(_deps):
+            # Build full context (Tier 1 + Tier 2 + Tier 3) in a worker thread: the SQLite reads don't block the loop
+            logger.info(f"Building context for {user_id}...")
             try:
-                # 下载并上传图片
-                from src.utils.image_compressor import image_compressor
-                
-                for idx, img in enumerate(parsed.images):
-                    try:
-                        logger.info(f"Processing image {idx+1}/{len(parsed.images)}: url={img.url[:80] if img.url else 'None'}, file={img.file[:50] if img.file else 'None'}")
-                        
-                        # 检查URL是否有效
-                        if not img.url:
-                            logger.error(f"Image {idx+1} has no URL")
-                            continue
-                        
-                        #下载图片
-                        try:
-                            file_path = await media_downloader.download_image(img.url, filename_hint=img.file)
-                            logger.info(f"Image {idx+1} downloaded successfully: {file_path}")
-                        except Exception as download_err:
-                            logger.error(f"Failed to download image {idx+1}: {download_err}")
-                            raise
-                        
-                        # 压缩图片
-                        try:
-                            compressed_path, was_compressed = image_compressor.compress_image(file_path)
-                            if was_compressed:
-                                logger.info(f"Image {idx+1} compressed: {compressed_path.name}")
-                            else:
-                                logger.info(f"Image {idx+1} kept original size: {compressed_path.name}")
-                        except Exception as compress_err:
-                            logger.error(f"Failed to compress image {idx+1}: {compress_err}")
-                            raise
-                        
-                        # 上传到 Gemini
-                        try:
-                            mime_type = media_downloader.get_mime_type(compressed_path)
-                            logger.info(f"Uploading image {idx+1} to Gemini (mime_type={mime_type})...")
-                            uploaded = await openai_client.upload_file(compressed_path, mime_type)
-                            uploaded_files.append(uploaded)
-                            logger.info(f"Image {idx+1} uploaded successfully: {uploaded.name}")
-                        except Exception as upload_err:
-                            logger.error(f"Failed to upload image {idx+1} to Gemini: {upload_err}")
-                            raise
-                            
-                    except Exception as e:
-                        logger.error(f"Failed to process image {idx+1}: {type(e).__name__}: {str(e)}")
-                        import traceback
-                        logger.error(f"Traceback: {traceback.format_exc()}")
-                
-                # 下载并上传语音
-                for audio in parsed.audios:
-                    try:
-                        if not audio.url:
-                            logger.warning(f"Audio has no URL: {audio.file}")
-                            continue
-                        
-                        # 下载音频
-                        file_path = await media_downloader.download_audio(audio.url)
-                        
-                        # 转换格式（如果需要）
-                        from src.utils.audio_converter import audio_converter
-                        
-                        # QQ 语音通常是 amr 或其他格式，转换为 MP3
-                        try:
-                            converted_path = audio_converter.convert_to_mp3(file_path)
-                            logger.info(f"Audio converted: {converted_path.name}")
-                        except Exception as conv_err:
-                            logger.warning(f"Audio conversion failed, using original: {conv_err}")
-                            converted_path = file_path
-                        
-                        # 上传到 Gemini
-                        mime_type = media_downloader.get_mime_type(converted_path)
-                        uploaded = await openai_client.upload_file(converted_path, mime_type)
-                        uploaded_files.append(uploaded)
-                        logger.info(f"Audio uploaded: {uploaded.name}")
-                    except Exception as e:
-                        logger.error(f"Failed to process audio: {e}")
-                
-                # 下载并上传视频
-                for video in parsed.videos:
-                    try:
-                        if not video.url:
-                            logger.warning(f"Video has no URL: {video.file}")
-                            continue
-                        
-                        file_path = await media_downloader.download_video(video.url)
-                        mime_type = media_downloader.get_mime_type(file_path)
-                        uploaded = await openai_client.upload_file(file_path, mime_type)
-                        uploaded_files.append(uploaded)
-                        logger.info(f"Video uploaded: {uploaded.name}")
-                    except Exception as e:
-                        logger.error(f"Failed to process video: {e}")
-                        
+                return await asyncio.to_thread(
+                    turn.context,
+                    lambda: conversation_memory.build_full_context(user_id, group_id, include_summaries=include_summaries)
+                )
+            except Exception as e:
+                logger.error(f"Failed to build context: {e}")
+                return [], None
+        
+        async def process_media(_deps):
+            # 下载 / 转码 / 编码并发进行，产出 image_url / input_audio parts
+            from src.utils.media_pipeline import media_pipeline
+            try:
+                media_batch = await asyncio.wait_for(media_pipeline.process(parsed), timeout=max(1.0, deadline.remaining()))
+            except asyncio.TimeoutError:
+                logger.warning(f"Media processing ran out of time budget ({deadline.elapsed():.1f}s)")
+                deadline.degrade("media_timeout")
+                return [], []
             except Exception as e:
                 logger.error(f"Error processing media: {e}")
                 # 继续处理，降级为纯文本
+                return [], []
+            # 纯图片消息才走识图缓存（语音内容无法按感知哈希判断是否相同）
+            image_only = all(r.kind == "image" for r in media_batch.results if r.part is not None)
+            return media_batch.parts, (media_batch.image_hashes if image_only else [])
+        
+        # 上下文加载与媒体处理互不依赖，并发执行（智能路由依赖历史，仍在 LLM 调用内）
+        from src.utils.stage_graph import StageGraph
+        graph = StageGraph(deadline).add("context", load_context)
+        if parsed.has_media:
+            graph.add("media", process_media)
+        stage_results = await graph.run()
+        deadline.lap("prepare")
+        
+        personal_history, system_context = stage_results["context"]
+        media_parts, image_hashes = stage_results.get("media", ([], []))
+        
+        short_history = latency_budget.short_history
+        if len(personal_history) > short_history and deadline.should("shrink_history"):
+            personal_history = personal_history[-short_history:]
         
         # Construct System Prompt
         base_instruction = "请注意：单条回复内容尽量控制在100个中文字符以内。"
@@ -334,11 +325,24 @@ async def handle_chat(event: Union[GroupMessageEvent, PrivateMessageEvent]):
         
         logger.info(f"Chat from {user_id[:30]}... | history: {len(full_history)} | "
                    f"context: {'YES' if system_context else 'NO'} | "
-                   f"media: {len(uploaded_files)}")
+                   f"media: {len(media_parts)}")
+        
+        # If user sent media but we failed to process ANY of it
+        if parsed.has_media and not media_parts:
+            if parsed.videos and not (parsed.images or parsed.audios):
+                from src.utils.video_frames import video_frames
+                if not video_frames.enabled:
+                    await chat.finish("⚠️ 暂不支持视频输入。")
+                await chat.finish(
+                    f"⚠️ 视频无法处理，仅支持 {video_frames.max_duration:.0f} 秒、"
+                    f"{video_frames.max_size_mb}MB 以内的视频。"
+                )
+            await chat.finish("⚠️ 抱歉，我无法下载或处理您发送的图片/媒体文件。可能是网络原因或链接失效。")
         
         # 调用 OpenAI-compatible API
+        vision_cache_hit = False
         try:
-            if uploaded_files:
+            if media_parts:
                 # 多模态调用
                 # 根据媒体类型生成合适的默认提示
                 if not parsed.text:
@@ -347,38 +351,52 @@ async def handle_chat(event: Union[GroupMessageEvent, PrivateMessageEvent]):
                     elif parsed.images:
                         text_prompt = "请描述并分析这张图片"
                     elif parsed.videos:
-                        text_prompt = "请总结这个视频的内容"
+                        text_prompt = "请根据这些画面描述这段视频的内容"
                     else:
                         text_prompt = "请分析这个内容"
                 else:
                     text_prompt = parsed.text
                 
-                # Force Flash or Pro for multimodal, Lite might not support it well or at all
-                reply = await openai_client.generate_multimodal_content(
-                    model='auto', 
-                    text=text_prompt,
-                    files=uploaded_files,
-                    history=full_history,
-                    task_type='chat'
-                )
+                from src.utils.vision_cache import vision_cache
+
+                # the reply also depends on the conversation so far: only cache fresh
+                # conversations, scoped to this group (or private chat) so answers
+                # never cross into another group. Recent group chatter in the system
+                # prompt is shared by everyone in the group and only colours the reply.
+                cache_scope = f"group_{group_id}" if group_id else user_id
+                use_vision_cache = bool(image_hashes) and not personal_history
+                cached_reply = vision_cache.get(cache_scope, text_prompt, image_hashes) if use_vision_cache else None
+                if cached_reply is not None:
+                    logger.info(f"Vision cache hit for {len(image_hashes)} image(s)")
+                    reply = cached_reply
+                    vision_cache_hit = True
+                else:
+                    reply = await _await_with_ack(openai_client.generate_multimodal(
+                        text=text_prompt,
+                        parts=media_parts,
+                        history=full_history,
+                        user_key=user_id,
+                        deadline=deadline
+                    ), deadline, event)
+                    if use_vision_cache and not reply.startswith("[Error]"):
+                        vision_cache.put(cache_scope, text_prompt, image_hashes, reply)
             else:
-                # If user sent media but we failed to upload ANY of it
-                if parsed.has_media:
-                    await chat.finish("⚠️ 抱歉，我无法下载或处理您发送的图片/媒体文件。可能是网络原因或链接失效。")
-    
                 # 纯文本调用
-                reply = await openai_client.generate_content(
+                reply = await _await_with_ack(openai_client.generate_content(
                     'auto', 
                     parsed.text, 
                     task_type='chat',
-                    history=full_history
-                )
+                    history=full_history,
+                    user_key=user_id,
+                    deadline=deadline
+                ), deadline, event)
         except Exception as e:
             logger.error(f"LLM API error: {e}")
             reply = "抱歉，处理您的消息时出现错误。"
+        deadline.lap("llm")
         
-        # 记录配额使用（成功调用后）
-        if uploaded_files:
+        # 记录配额使用（成功调用后；缓存命中不消耗配额）
+        if media_parts and not vision_cache_hit:
             from src.utils.quota_manager import quota_manager
             quota_manager.use_quota(user_id, is_multimodal=True)
         
@@ -392,11 +410,12 @@ async def handle_chat(event: Union[GroupMessageEvent, PrivateMessageEvent]):
             conversation_memory.add_personal_message(user_id, "model", reply)
         except Exception as e:
             logger.error(f"Failed to save conversation memory: {e}")
+        turn.record(parsed.text or "[多媒体内容]", reply)
         
         logger.info(f"Reply: {reply[:80]}...")
         
         # 使用智能发送：自动判断是否需要合并转发
-        from src.utils.message_forwarder import send_message_smart
+        from src.utils.message_forwarder import outbound, send_message_smart
         
         try:
             # 获取 Bot 实例
@@ -404,18 +423,32 @@ async def handle_chat(event: Union[GroupMessageEvent, PrivateMessageEvent]):
             
             # 获取转发阈值配置
             threshold = int(os.getenv("FORWARD_THRESHOLD", "100"))
-            
-            # 智能发送消息
-            await send_message_smart(
-                bot=bot,
-                message=reply,
-                event=event,
-                threshold=threshold
-            )
         except Exception as e:
-            logger.error(f"Failed to send message with smart forwarding: {e}")
-            # 降级为普通发送
+            logger.error(f"Failed to prepare smart forwarding: {e}")
+            bot = None
+        
+        if bot is None:
+            # nothing was queued yet: plain send is safe
             await chat.send(reply)
+        else:
+            try:
+                # 智能发送消息
+                await send_message_smart(
+                    bot=bot,
+                    message=reply,
+                    event=event,
+                    threshold=threshold,
+                    reply_to=reply_to
+                )
+            except Exception as e:
+                if outbound.nothing_sent(e):
+                    logger.warning(f"Smart forwarding rejected ({e}), sending plain message")
+                    # 降级为普通发送（确定上一次没有发出）
+                    await chat.send(reply)
+                else:
+                    # timeout / unknown outcome: the reply may already be in the chat
+                    logger.error(f"Failed to send message with smart forwarding, not resending: {e}")
+        deadline.lap("send")
         
         # 结束对话
         await chat.finish()
@@ -430,4 +463,8 @@ async def handle_chat(event: Union[GroupMessageEvent, PrivateMessageEvent]):
         import traceback
         logger.error(traceback.format_exc())
         await chat.finish("系统发生未知错误，请联系管理员。")
+    finally:
+        if turn is not None:
+            turn.release()
+        deadline.finish()
 
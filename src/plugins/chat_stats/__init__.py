@@ -2,7 +2,7 @@
 水群榜插件
 统计群成员发言数量并生成排行榜
 """
-from nonebot import on_message, on_command, get_bot, require
+from nonebot import on_command, get_bot, require
 from nonebot.adapters.onebot.v11 import Bot, GroupMessageEvent, Message
 from nonebot.typing import T_State
 from nonebot.log import logger
@@ -10,6 +10,8 @@ from datetime import datetime
 
 # 导入统计管理器
 from .stats_manager import chat_stats_manager
+from src.utils.message_ingest import message_ingest
+from src.utils.message_parser import ParsedMessage
 
 # 导入调度器
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -23,36 +25,29 @@ async def start_scheduler():
     if not scheduler.running:
         scheduler.start()
 
-# 消息监听器（优先级较低，不拦截消息）
-message_recorder = on_message(priority=99, block=False)
-
-# 命令处理器
-ranking_cmd = on_command("水群榜", aliases={"聊天榜", "发言榜"}, priority=5)
 
+@driver.on_shutdown
+async def flush_stats():
+    # final snapshot so a restart doesn't need to replay the event log
+    chat_stats_manager.close()
 
-@message_recorder.handle()
-async def record_group_message(bot: Bot, event: GroupMessageEvent):
+async def record_group_message(event: GroupMessageEvent, parsed: ParsedMessage):
     """
-    记录群消息
+    记录群消息（消息接入的消费者）
     """
-    try:
-        # 只记录群消息
-        if not isinstance(event, GroupMessageEvent):
-            return
-        
-        # 提取消息文本
-        message_text = event.get_plaintext().strip()
-        
-        # 记录消息
-        chat_stats_manager.record_message(
-            group_id=event.group_id,
-            user_id=event.user_id,
-            nickname=event.sender.nickname or event.sender.card or str(event.user_id),
-            message_text=message_text  # 传入消息文本
-        )
-        
-    except Exception as e:
-        logger.error(f"Failed to record message: {e}")
+    chat_stats_manager.record_message(
+        group_id=event.group_id,
+        user_id=event.user_id,
+        nickname=event.sender.nickname or event.sender.card or str(event.user_id),
+        message_text=parsed.plain_text.strip()  # 传入消息文本
+    )
+
+
+message_ingest.register("chat_stats", record_group_message)
+
+# 命令处理器
+ranking_cmd = on_command("水群榜", aliases={"聊天榜", "发言榜"}, priority=5)
+
 
 
 @ranking_cmd.handle()
@@ -299,20 +294,14 @@ async def daily_ranking_push():
                         )
                         message += f"\n\n💬 AI锐评：{ai_comment}"
                 
-                # 发送消息
-                await bot.send_group_msg(
-                    group_id=int(group_id),
-                    message=message
-                )
+                # 交给发送队列（按群/全局限速，失败由队列记录），不等待送达再处理下一个群
+                from src.utils.message_forwarder import outbound
+                await outbound.send(bot, "group", group_id, message, wait=False)
                 
                 # 更新推送时间
                 chat_stats_manager.update_push_time(group_id)
                 
-                logger.info(f"Sent daily ranking to group {group_id}")
-                
-                # 短暂延迟，避免发送过快
-                import asyncio
-                await asyncio.sleep(1)
+                logger.info(f"Queued daily ranking for group {group_id}")
                 
             except Exception as e:
                 logger.error(f"Failed to push ranking to group {group_id}: {e}")
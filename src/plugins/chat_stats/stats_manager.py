@@ -1,14 +1,121 @@
 """
 聊天统计管理器
 记录和管理群成员的发言统计数据
+
+持久化：每条消息追加一行到 chat_stats.log.jsonl，定期（及跨天、关闭时）把完整状态原子写入
+chat_stats.json 快照并清空日志；启动时加载快照并重放日志
 """
 import os
-import json
+from collections import deque
 from pathlib import Path
 from datetime import datetime, time as dt_time, timedelta
-from typing import Dict, List, Tuple, Optional
+from typing import Deque, Dict, Iterable, List, Tuple, Optional
 from nonebot.log import logger
 
+from src.utils.event_log import EventLog
+
+# 每人保留的最近消息条数（用于AI点评）
+RECENT_MESSAGES_KEEP = 5
+
+
+class UserStats:
+    """单个成员当天的发言统计"""
+    __slots__ = ("user_id", "nickname", "count", "last_msg_time", "recent_messages", "top_pos")
+    
+    def __init__(self, user_id: str, nickname: str, count: int = 0, last_msg_time: Optional[str] = None,
+                 recent_messages: Iterable[Dict] = ()):
+        self.user_id = user_id
+        self.nickname = nickname
+        self.count = count
+        self.last_msg_time = last_msg_time
+        self.recent_messages: Deque[Dict] = deque(recent_messages, maxlen=RECENT_MESSAGES_KEEP)
+        self.top_pos = -1  # index in GroupStats.top, -1 when not in it
+    
+    def to_dict(self) -> Dict:
+        return {
+            "nickname": self.nickname,
+            "count": self.count,
+            "last_msg_time": self.last_msg_time,
+            "recent_messages": list(self.recent_messages),
+        }
+    
+    def ranking_entry(self) -> Dict:
+        return {
+            "user_id": self.user_id,
+            "nickname": self.nickname,
+            "count": self.count,
+            "last_msg_time": self.last_msg_time,
+        }
+
+
+class GroupStats:
+    """
+    单个群的统计：成员表 + 消息总数 + 增量维护的前 K 名
+    
+    每条消息只给一个人的计数 +1，所以前 K 名只需把这个人在列表里往前挪（或挤掉末位），
+    记录是 O(1)（最坏 O(K)），取排行是 O(K)
+    """
+    __slots__ = ("users", "total", "last_push_time", "top", "top_size")
+    
+    def __init__(self, top_size: int, last_push_time: Optional[str] = None):
+        self.users: Dict[str, UserStats] = {}
+        self.total = 0
+        self.last_push_time = last_push_time
+        self.top: List[UserStats] = []  # count descending; ties keep who got there first
+        self.top_size = top_size
+    
+    def bump(self, user: UserStats):
+        """计数 +1 并维护前 K 名"""
+        user.count += 1
+        self.total += 1
+        top = self.top
+        
+        if user.top_pos < 0:
+            if len(top) < self.top_size:
+                user.top_pos = len(top)
+                top.append(user)
+            elif top and user.count > top[-1].count:
+                top[-1].top_pos = -1
+                user.top_pos = len(top) - 1
+                top[-1] = user
+            else:
+                return
+        
+        # move up past members it has just overtaken
+        i = user.top_pos
+        while i > 0 and top[i - 1].count < user.count:
+            top[i] = top[i - 1]
+            top[i].top_pos = i
+            i -= 1
+        top[i] = user
+        user.top_pos = i
+    
+    def rebuild_top(self):
+        """从成员表重建前 K 名（加载数据或调整 K 时用）"""
+        for user in self.top:
+            user.top_pos = -1
+        ranked = sorted((u for u in self.users.values() if u.count > 0), key=lambda u: u.count, reverse=True)
+        self.top = ranked[:self.top_size]
+        for i, user in enumerate(self.top):
+            user.top_pos = i
+    
+    def to_dict(self) -> Dict:
+        return {
+            "users": {uid: u.to_dict() for uid, u in self.users.items()},
+            "last_push_time": self.last_push_time,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict, top_size: int) -> "GroupStats":
+        group = cls(top_size, data.get("last_push_time"))
+        for uid, u in (data.get("users") or {}).items():
+            user = UserStats(uid, u.get("nickname", uid), int(u.get("count", 0)),
+                             u.get("last_msg_time"), u.get("recent_messages") or ())
+            group.users[uid] = user
+            group.total += user.count
+        group.rebuild_top()
+        return group
+
 
 class ChatStatsManager:
     """聊天统计管理器"""
@@ -22,46 +129,100 @@ class ChatStatsManager:
         # 创建目录
         self.stats_file.parent.mkdir(parents=True, exist_ok=True)
         
-        # 加载数据
-        self.stats = self._load_stats()
+        # 加载数据（快照 + 事件日志）
+        self._log = EventLog(
+            self.stats_file,
+            self.stats_file.with_suffix(".log.jsonl"),
+            compact_every=int(os.getenv("STATS_COMPACT_EVERY", "1000")),
+        )
+        self.date: str = ""
+        self.groups: Dict[str, GroupStats] = {}
+        self._load_stats()
         
         logger.info(f"ChatStatsManager initialized: push_hour={self.push_hour}, top_count={self.top_count}")
     
-    def _load_stats(self) -> dict:
-        """加载统计数据"""
-        if not self.stats_file.exists():
-            return self._create_empty_stats()
-        
+    def _load_stats(self):
+        """加载快照并重放其后的事件（快照 JSON 格式与旧版一致）"""
+        self._reset_stats()
         try:
-            with open(self.stats_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            state, events = self._log.load()
+            if state:
+                self.date = state.get("date") or self.date
+                self.groups = {
+                    gid: GroupStats.from_dict(g, self.top_count)
+                    for gid, g in (state.get("groups") or {}).items()
+                }
+            replayed = 0
+            for event in events:
+                self._apply(event)
+                replayed += 1
+            if replayed:
+                logger.info(f"Replayed {replayed} chat stats events from {self._log.log_path}")
         except Exception as e:
             logger.error(f"Failed to load stats: {e}")
-            return self._create_empty_stats()
+            self._reset_stats()
     
-    def _create_empty_stats(self) -> dict:
-        """创建空统计数据"""
+    def _reset_stats(self):
+        """清空为当天的空统计"""
+        self.date = datetime.now().strftime("%Y-%m-%d")
+        self.groups = {}
+    
+    def to_dict(self) -> dict:
         return {
-            "date": datetime.now().strftime("%Y-%m-%d"),
-            "groups": {}
+            "date": self.date,
+            "groups": {gid: g.to_dict() for gid, g in self.groups.items()},
         }
     
     def _save_stats(self):
-        """保存统计数据"""
+        """写入快照（原子替换）并清空事件日志"""
         try:
-            with open(self.stats_file, 'w', encoding='utf-8') as f:
-                json.dump(self.stats, f, indent=2, ensure_ascii=False)
+            self._log.compact(self.to_dict())
         except Exception as e:
             logger.error(f"Failed to save stats: {e}")
     
+    def _append(self, event: Dict):
+        """记录一条事件；日志够长时压缩成快照"""
+        try:
+            self._log.append(event)
+        except Exception as e:
+            logger.error(f"Failed to append stats event: {e}")
+            return
+        if self._log.needs_compaction:
+            self._save_stats()
+    
+    def _apply(self, event: Dict):
+        """把一条事件应用到内存状态（记录消息和重放日志共用）"""
+        group = self._group(event["g"])
+        if "p" in event:
+            group.last_push_time = event["p"]
+            return
+        
+        user_id = event["u"]
+        user = group.users.get(user_id)
+        if user is None:
+            user = group.users[user_id] = UserStats(user_id, event["n"])
+        user.nickname = event["n"]  # 更新昵称
+        user.last_msg_time = event["t"]
+        group.bump(user)
+        
+        # 记录最近的消息内容（保留最近5条，用于AI点评）
+        if event.get("m"):
+            user.recent_messages.append({"text": event["m"], "time": event["t"][11:]})
+    
     def _reset_if_new_day(self):
         """如果是新的一天，重置统计"""
         today = datetime.now().strftime("%Y-%m-%d")
-        if self.stats.get("date") != today:
-            logger.info(f"New day detected, resetting stats (was {self.stats.get('date')}, now {today})")
-            self.stats = self._create_empty_stats()
+        if self.date != today:
+            logger.info(f"New day detected, resetting stats (was {self.date}, now {today})")
+            self._reset_stats()
             self._save_stats()
     
+    def _group(self, group_id: str) -> GroupStats:
+        group = self.groups.get(group_id)
+        if group is None:
+            group = self.groups[group_id] = GroupStats(self.top_count)
+        return group
+    
     def record_message(self, group_id: str, user_id: str, nickname: str, message_text: str = ""):
         """
         记录群消息
@@ -74,46 +235,16 @@ class ChatStatsManager:
         """
         self._reset_if_new_day()
         
-        group_id = str(group_id)
-        user_id = str(user_id)
-        
-        # 初始化群数据
-        if group_id not in self.stats["groups"]:
-            self.stats["groups"][group_id] = {
-                "users": {},
-                "last_push_time": None
-            }
-        
-        # 初始化用户数据
-        if user_id not in self.stats["groups"][group_id]["users"]:
-            self.stats["groups"][group_id]["users"][user_id] = {
-                "nickname": nickname,
-                "count": 0,
-                "last_msg_time": None,
-                "recent_messages": []  # 存储最近的消息
-            }
-        
-        # 更新数据
-        self.stats["groups"][group_id]["users"][user_id]["count"] += 1
-        self.stats["groups"][group_id]["users"][user_id]["nickname"] = nickname  # 更新昵称
-        self.stats["groups"][group_id]["users"][user_id]["last_msg_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # 记录最近的消息内容（保留最近5条，用于AI点评）
+        event = {
+            "g": str(group_id),
+            "u": str(user_id),
+            "n": nickname,
+            "t": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
         if message_text:
-            recent_msgs = self.stats["groups"][group_id]["users"][user_id].get("recent_messages", [])
-            recent_msgs.append({
-                "text": message_text[:200],  # 限制长度
-                "time": datetime.now().strftime("%H:%M:%S")
-            })
-            # 只保留最近5条
-            self.stats["groups"][group_id]["users"][user_id]["recent_messages"] = recent_msgs[-5:]
-        
-        # 保存（每10条消息保存一次，避免频繁IO）
-        total_count = sum(
-            u["count"] for u in self.stats["groups"][group_id]["users"].values()
-        )
-        if total_count % 10 == 0:
-            self._save_stats()
+            event["m"] = message_text[:200]  # 限制长度
+        self._apply(event)
+        self._append(event)
     
     def get_ranking(
         self, 
@@ -134,32 +265,20 @@ class ChatStatsManager:
         """
         self._reset_if_new_day()
         
-        group_id = str(group_id)
-        
-        if group_id not in self.stats["groups"]:
+        group = self.groups.get(str(group_id))
+        if group is None:
             return []
         
-        users = self.stats["groups"][group_id]["users"]
-        
-        # 转换为列表并排序
-        ranking = []
-        for user_id, data in users.items():
-            if data["count"] > 0:  # 只包含有发言的用户
-                ranking.append({
-                    "user_id": user_id,
-                    "nickname": data["nickname"],
-                    "count": data["count"],
-                    "last_msg_time": data["last_msg_time"]
-                })
-        
-        # 按消息数降序排序
-        ranking.sort(key=lambda x: x["count"], reverse=True)
-        
         # 限制返回数量
         if limit is None:
             limit = self.top_count
         
-        return ranking[:limit]
+        if limit <= group.top_size:
+            ranked = group.top[:limit]
+        else:
+            # more than the maintained top-K: fall back to a full sort
+            ranked = sorted(group.users.values(), key=lambda u: u.count, reverse=True)[:limit]
+        return [u.ranking_entry() for u in ranked if u.count > 0]
     
     def get_user_recent_messages(self, group_id: str, user_id: str) -> List[Dict]:
         """
@@ -172,16 +291,15 @@ class ChatStatsManager:
         Returns:
             List[Dict]: 最近的消息列表
         """
-        group_id = str(group_id)
-        user_id = str(user_id)
-        
-        if group_id not in self.stats["groups"]:
+        group = self.groups.get(str(group_id))
+        if group is None:
             return []
         
-        if user_id not in self.stats["groups"][group_id]["users"]:
+        user = group.users.get(str(user_id))
+        if user is None:
             return []
         
-        return self.stats["groups"][group_id]["users"][user_id].get("recent_messages", [])
+        return list(user.recent_messages)
     
     def get_group_stats(self, group_id: str) -> Dict:
         """
@@ -195,24 +313,18 @@ class ChatStatsManager:
         """
         self._reset_if_new_day()
         
-        group_id = str(group_id)
-        
-        if group_id not in self.stats["groups"]:
+        group = self.groups.get(str(group_id))
+        if group is None:
             return {
                 "total_messages": 0,
                 "active_users": 0,
                 "last_push_time": None
             }
         
-        users = self.stats["groups"][group_id]["users"]
-        
-        total_messages = sum(u["count"] for u in users.values())
-        active_users = len([u for u in users.values() if u["count"] > 0])
-        
         return {
-            "total_messages": total_messages,
-            "active_users": active_users,
-            "last_push_time": self.stats["groups"][group_id].get("last_push_time")
+            "total_messages": group.total,
+            "active_users": len(group.users),  # members are only added when they speak
+            "last_push_time": group.last_push_time
         }
     
     def get_last_push_time(self, group_id: str) -> Optional[str]:
@@ -225,12 +337,8 @@ class ChatStatsManager:
         Returns:
             Optional[str]: 上次推送时间
         """
-        group_id = str(group_id)
-        
-        if group_id not in self.stats["groups"]:
-            return None
-        
-        return self.stats["groups"][group_id].get("last_push_time")
+        group = self.groups.get(str(group_id))
+        return group.last_push_time if group else None
     
     def update_push_time(self, group_id: str):
         """
@@ -239,16 +347,9 @@ class ChatStatsManager:
         Args:
             group_id: 群号
         """
-        group_id = str(group_id)
-        
-        if group_id not in self.stats["groups"]:
-            self.stats["groups"][group_id] = {
-                "users": {},
-                "last_push_time": None
-            }
-        
-        self.stats["groups"][group_id]["last_push_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self._save_stats()
+        event = {"g": str(group_id), "p": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        self._apply(event)
+        self._append(event)
         logger.info(f"Updated push time for group {group_id}")
     
     def get_all_active_groups(self) -> List[str]:
@@ -259,11 +360,16 @@ class ChatStatsManager:
             List[str]: 群号列表
         """
         self._reset_if_new_day()
-        return list(self.stats.get("groups", {}).keys())
+        return list(self.groups.keys())
     
     def force_save(self):
         """强制保存数据"""
         self._save_stats()
+    
+    def close(self):
+        """关闭时调用：写最终快照并关闭日志文件"""
+        self._save_stats()
+        self._log.close()
 
 
 # 全局单例
@@ -18,6 +18,11 @@ async def start_scheduler():
     from src.utils.database import db
     scheduler.add_job(db.cleanup_old_data, "cron", hour=3)
     logger.info("Database cleanup scheduled for 3 AM daily")
+    
+    # Media cache maintenance (expired / orphaned files) every hour
+    from src.utils.media_downloader import media_downloader
+    scheduler.add_job(media_downloader.cleanup_old_files, "interval", hours=1)
+    logger.info("Media cache cleanup scheduled hourly")
 
 # Database stats command
 db_stats_cmd = on_command("db", aliases={"数据库"}, priority=5)
@@ -0,0 +1,16 @@
+"""
+消息接入插件
+所有消息只在这里解析一次，再分发给各插件注册的消费者（见 src/utils/message_ingest.py）
+"""
+from nonebot import on_message
+from nonebot.adapters.onebot.v11 import MessageEvent
+
+from src.utils.message_ingest import message_ingest
+
+# 与原群消息记录器同一优先级：命令（priority=5）仍会拦截，命令消息不计入统计/存档
+ingest = on_message(priority=10, block=False)
+
+
+@ingest.handle()
+async def handle_ingest(event: MessageEvent):
+    await message_ingest.dispatch(event)
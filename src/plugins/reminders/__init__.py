@@ -135,10 +135,8 @@ async def check_reminders():
             if item["time"] == now:
                 msg = f"⏰ 提醒：{item['content']}"
                 try:
-                    if target_type == "group":
-                        await bot.send_group_msg(group_id=int(target_id), message=msg)
-                    else:
-                        await bot.send_private_msg(user_id=int(target_id), message=msg)
+                    from src.utils.message_forwarder import outbound
+                    await outbound.send(bot, "group" if target_type == "group" else "private", target_id, msg)
                     logger.info(f"Sent reminder to {target_id}: {item['content']}")
                 except Exception as e:
                     logger.error(f"Failed to send reminder to {target_id}: {e}")
@@ -24,6 +24,9 @@ async def start_scheduler():
 # File to store subscriptions
 SUBS_FILE = "data/rss_subs.json"  # Store in data directory for persistence
 
+# subscribers pushed to at the same time for one feed update
+RSS_PUSH_CONCURRENCY = int(os.getenv("RSS_PUSH_CONCURRENCY", "8"))
+
 def load_subs():
     if not os.path.exists(SUBS_FILE):
         return {}
@@ -136,30 +139,19 @@ async def check_rss():
                 
                 msg = "\n".join(msg_lines)
                 
-                # Push the combined message to all subscribers
-                subscribers = data.get("subscribers", [])
-                for sub in subscribers:
-                    try:
-                        # Check length for smart forwarding
-                        threshold = int(os.getenv("FORWARD_THRESHOLD", "100"))
-                        
-                        if len(msg) > threshold:
-                            from src.utils.message_forwarder import send_group_forward_message, send_private_forward_message, split_text_into_paragraphs
-                            paragraphs = split_text_into_paragraphs(msg)
-                            
-                            if sub["type"] == "group":
-                                await send_group_forward_message(bot, int(sub["id"]), paragraphs)
-                            elif sub["type"] == "private":
-                                await send_private_forward_message(bot, int(sub["id"]), paragraphs)
-                        else:
-                            if sub["type"] == "group":
-                                await bot.send_group_msg(group_id=int(sub["id"]), message=msg)
-                            elif sub["type"] == "private":
-                                await bot.send_private_msg(user_id=int(sub["id"]), message=msg)
-                    except Exception as e:
-                        logger.error(f"Failed to send RSS to {sub}: {e}")
+                # Push the combined message to all subscribers: rendered (forward nodes) once,
+                # sent concurrently; per-group pacing is done by the outbound queue
+                from src.utils.message_forwarder import broadcast
+                targets = [
+                    (sub["type"], sub["id"]) for sub in data.get("subscribers", [])
+                    if sub["type"] in ("group", "private")
+                ]
+                result = await broadcast(bot, targets, msg, concurrency=RSS_PUSH_CONCURRENCY)
                         
-                logger.info(f"Pushed {entry_count} RSS items from {data['title']}")
+                logger.info(
+                    f"Pushed {entry_count} RSS items from {data['title']} "
+                    f"to {result['sent']}/{len(targets)} subscribers"
+                )
                     
         except Exception as e:
             logger.error(f"Error checking RSS {url}: {e}")
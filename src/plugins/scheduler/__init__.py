@@ -135,21 +135,10 @@ async def send_daily_weather():
     bot = safe_get_bot()
     if not bot:
         return
-    for group_id in target_groups:
-        try:
-            # Check length for smart forwarding
-            threshold = int(os.getenv("FORWARD_THRESHOLD", "100"))
-            
-            if len(msg) > threshold:
-                from src.utils.message_forwarder import send_group_forward_message, split_text_into_paragraphs
-                paragraphs = split_text_into_paragraphs(msg)
-                await send_group_forward_message(bot, int(group_id), paragraphs)
-            else:
-                await bot.send_group_msg(group_id=int(group_id), message=msg)
-                
-            logger.info(f"Sent weather to group {group_id}")
-        except Exception as e:
-            logger.error(f"Failed to send weather to group {group_id}: {e}")
+    # Same message for every group: rendered once, pushed concurrently (paced by the outbound queue)
+    from src.utils.message_forwarder import broadcast
+    result = await broadcast(bot, [("group", gid) for gid in target_groups], msg)
+    logger.info(f"Sent weather to {result['sent']}/{len(target_groups)} groups")
 
 # Schedule weather at 8:00 AM
 scheduler.add_job(send_daily_weather, "cron", hour=8, minute=0)
@@ -12,7 +12,7 @@ from apscheduler.triggers.cron import CronTrigger
 
 from src.utils.auth import admin_user_ids
 from src.utils.safe_bot import safe_get_bot
-from src.utils.message_forwarder import send_group_forward_message, split_text_into_paragraphs
+from src.utils.message_forwarder import push_text
 
 
 driver = get_driver()
@@ -100,23 +100,15 @@ def _schedule_to_trigger(schedule_type: str, schedule_value: str) -> CronTrigger
     raise ValueError("schedule_type must be daily/hourly/cron")
 
 
-def _smart_send(target_type: str, target_id: str, text: str):
+async def _smart_send(target_type: str, target_id: str, text: str):
     bot = safe_get_bot()
     if not bot:
         return
-    threshold = int(os.getenv("FORWARD_THRESHOLD", "100"))
     if target_type == "group":
-        gid = int(target_id)
-        if len(text) > threshold:
-            paragraphs = split_text_into_paragraphs(text)
-            return bot.call_api("send_group_forward_msg", group_id=gid, messages=[
-                {"type": "node", "data": {"name": os.getenv("BOT_NICKNAME", "AI 助手"), "uin": str(bot.self_id), "content": p}} for p in paragraphs
-            ])
-        return bot.send_group_msg(group_id=gid, message=text)
+        await push_text(bot, "group", target_id, text)
     else:
-        uid = int(target_id)
         # private forwarding also exists; keep simple
-        return bot.send_private_msg(user_id=uid, message=text)
+        await push_text(bot, "private", target_id, text, threshold=len(text))
 
 
 async def _run_task(task: Dict[str, Any]):
@@ -1,209 +1,247 @@
 """
 音频格式转换工具
-将 QQ 语音格式（amr/silk）转换为 Gemini 支持的格式（mp3/wav）
+将 QQ 语音格式（amr/silk 等）转换为后端支持的格式（mp3/wav）
+
+ffmpeg 通过 asyncio 子进程运行（见 ffmpeg_runner），数据经 stdin/stdout 管道传递，
+结果按 内容哈希 + 转换配置 缓存
 """
 import os
-import subprocess
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
 from nonebot.log import logger
-from typing import Optional
+
+from src.utils.ffmpeg_runner import FFmpegError, ffmpeg_runner
+
+
+@dataclass(frozen=True)
+class AudioProfile:
+    """一种输出格式：ffmpeg 编码参数 + 容器格式"""
+    format: str  # mp3 / wav (also the input_audio "format" field)
+    codec_args: Tuple[str, ...]
+
+
+# speech: 16 kHz mono is what speech models consume anyway; ~8x smaller than 44.1 kHz stereo 192k
+PROFILES: Dict[str, AudioProfile] = {
+    "speech": AudioProfile("mp3", ("-acodec", "libmp3lame", "-ar", "16000", "-ac", "1", "-b:a", "32k")),
+    "speech_wav": AudioProfile("wav", ("-acodec", "pcm_s16le", "-ar", "16000", "-ac", "1")),
+    "mp3": AudioProfile("mp3", ("-acodec", "libmp3lame", "-ar", "44100", "-ac", "2", "-b:a", "192k")),
+    "wav": AudioProfile("wav", ("-acodec", "pcm_s16le", "-ar", "44100", "-ac", "2")),
+}
+
+# formats backends accept as-is (input_audio), usable when ffmpeg is missing
+_PASSTHROUGH_FORMATS = ("mp3", "wav")
+
+
+@dataclass(frozen=True)
+class ConvertedAudio:
+    data: bytes
+    format: str
 
 
 class AudioConverter:
     """音频格式转换器"""
-    
+
     def __init__(self):
-        # 检查 ffmpeg 是否可用
-        self.ffmpeg_available = self._check_ffmpeg()
-        
+        self.default_profile = os.getenv("AUDIO_PROFILE", "speech")
+        if self.default_profile not in PROFILES:
+            logger.warning(f"Unknown AUDIO_PROFILE={self.default_profile!r}, using 'speech'")
+            self.default_profile = "speech"
+
+        # (content_hash, profile) -> converted audio, least recently used first
+        self._cache: "OrderedDict[Tuple[str, str], ConvertedAudio]" = OrderedDict()
+        self._cache_bytes = 0
+        self.cache_max_bytes = int(os.getenv("AUDIO_CONVERT_CACHE_MB", "32")) * 1024 * 1024
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def ffmpeg_available(self) -> bool:
+        return ffmpeg_runner.available
+
+    def _cache_get(self, key: Tuple[str, str]) -> Optional[ConvertedAudio]:
+        value = self._cache.get(key)
+        if value is None:
+            self.cache_misses += 1
+            return None
+        self._cache.move_to_end(key)
+        self.cache_hits += 1
+        return value
+
+    def _cache_put(self, key: Tuple[str, str], value: ConvertedAudio):
+        if len(value.data) > self.cache_max_bytes:
+            return
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._cache_bytes -= len(old.data)
+        self._cache[key] = value
+        self._cache_bytes += len(value.data)
+        while self._cache_bytes > self.cache_max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted.data)
+
+    async def convert(
+        self,
+        source: Union[Path, bytes],
+        profile: Optional[str] = None,
+        content_hash: Optional[str] = None,
+    ) -> ConvertedAudio:
+        """
+        转换音频（输入经 stdin、输出经 stdout，不写中间文件）
+
+        Args:
+            source: 输入文件路径或音频数据
+            profile: PROFILES 中的配置名（默认 AUDIO_PROFILE）
+            content_hash: 输入内容哈希（用于缓存；不传则按数据计算）
+
+        Returns:
+            ConvertedAudio: 转换后的数据和格式
+
+        Raises:
+            FFmpegError: ffmpeg 不可用且输入不是目标格式，或转换失败
+        """
+        name = profile or self.default_profile
+        prof = PROFILES[name]
+        path = source if isinstance(source, Path) else None
+        data = await asyncio.to_thread(path.read_bytes) if path is not None else source
+
         if not self.ffmpeg_available:
-            logger.warning("FFmpeg not found. Audio conversion may not work properly.")
-            logger.warning("Install FFmpeg: apt-get install ffmpeg")
-    
-    def _check_ffmpeg(self) -> bool:
-        """检查 ffmpeg 是否安装"""
+            raw_format = path.suffix.lower().lstrip(".") if path is not None else ""
+            if raw_format in _PASSTHROUGH_FORMATS:
+                logger.warning("FFmpeg not available, sending audio unconverted")
+                return ConvertedAudio(data, raw_format)
+            raise FFmpegError("ffmpeg not available")
+
+        key = (content_hash or hashlib.sha256(data).hexdigest(), name)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        out_args: List[str] = [*prof.codec_args, "-f", prof.format, "pipe:1"]
         try:
-            result = subprocess.run(
-                ['ffmpeg', '-version'],
-                capture_output=True,
-                timeout=5
-            )
-            return result.returncode == 0
-        except (FileNotFoundError, subprocess.TimeoutExpired):
-            return False
-    
-    def convert_to_mp3(
-        self, 
-        input_path: Path, 
-        output_path: Optional[Path] = None
+            out = await ffmpeg_runner.run(["-i", "pipe:0", *out_args], input_data=data)
+        except FFmpegError as e:
+            if path is None:
+                raise
+            # containers that need seeking (e.g. mp4/m4a with moov at the end) cannot be read from a pipe
+            logger.debug(f"Piped conversion failed ({e}), retrying with file input")
+            out = await ffmpeg_runner.run(["-i", str(path), *out_args])
+
+        result = ConvertedAudio(out, prof.format)
+        self._cache_put(key, result)
+        logger.info(f"Converted audio ({name}): {len(data) / 1024:.0f}KB -> {len(out) / 1024:.0f}KB {prof.format}")
+        return result
+
+    async def _convert_file(
+        self,
+        input_path: Path,
+        output_path: Optional[Path],
+        profile: str,
+        keep_input: bool,
+    ) -> Path:
+        fmt = PROFILES[profile].format
+        if output_path is None:
+            output_path = input_path.with_suffix(f".{fmt}")
+
+        if input_path.suffix.lower() == f".{fmt}":
+            logger.debug(f"File is already {fmt.upper()}: {input_path}")
+            return input_path
+        if not self.ffmpeg_available:
+            logger.warning("FFmpeg not available, skipping conversion")
+            return input_path
+
+        converted = await self.convert(input_path, profile=profile)
+        await asyncio.to_thread(output_path.write_bytes, converted.data)
+        logger.info(f"Converted to {fmt.upper()}: {output_path}")
+
+        # 删除原始文件以节省空间（可选）
+        if not keep_input and input_path != output_path and input_path.exists():
+            try:
+                input_path.unlink()
+                logger.debug(f"Removed original file: {input_path}")
+            except Exception as e:
+                logger.warning(f"Failed to remove original file: {e}")
+        return output_path
+
+    async def convert_to_mp3(
+        self,
+        input_path: Path,
+        output_path: Optional[Path] = None,
+        keep_input: bool = False,
+        profile: str = "mp3",
     ) -> Path:
         """
         转换音频文件为 MP3 格式
-        
+
         Args:
             input_path: 输入文件路径
             output_path: 输出文件路径（可选）
-            
+            keep_input: 保留原始文件（输入来自媒体缓存时必须保留）
+            profile: 编码配置（mp3 / speech）
+
         Returns:
             Path: 转换后的文件路径
-            
+
         Raises:
-            Exception: 转换失败
+            FFmpegError: 转换失败
         """
-        if not self.ffmpeg_available:
-            logger.warning("FFmpeg not available, skipping conversion")
-            return input_path
-        
-        # 生成输出路径
-        if output_path is None:
-            output_path = input_path.with_suffix('.mp3')
-        
-        # 如果已经是 mp3，直接返回
-        if input_path.suffix.lower() == '.mp3':
-            logger.debug(f"File is already MP3: {input_path}")
-            return input_path
-        
-        logger.info(f"Converting {input_path.name} to MP3...")
-        
-        try:
-            # 使用 ffmpeg 转换
-            result = subprocess.run([
-                'ffmpeg',
-                '-i', str(input_path),      # 输入文件
-                '-acodec', 'libmp3lame',    # MP3 编码器
-                '-ar', '44100',              # 采样率 44.1kHz
-                '-ab', '192k',               # 比特率 192kbps
-                '-ac', '2',                  # 双声道
-                '-y',                        # 覆盖输出文件
-                str(output_path)             # 输出文件
-            ], 
-            capture_output=True,
-            timeout=30,
-            text=True
-            )
-            
-            if result.returncode != 0:
-                logger.error(f"FFmpeg conversion failed: {result.stderr}")
-                raise Exception(f"Audio conversion failed: {result.stderr}")
-            
-            logger.info(f"Converted to MP3: {output_path}")
-            
-            # 删除原始文件以节省空间（可选）
-            if input_path != output_path and input_path.exists():
-                try:
-                    input_path.unlink()
-                    logger.debug(f"Removed original file: {input_path}")
-                except Exception as e:
-                    logger.warning(f"Failed to remove original file: {e}")
-            
-            return output_path
-            
-        except subprocess.TimeoutExpired:
-            raise Exception("Audio conversion timeout")
-        except Exception as e:
-            raise Exception(f"Audio conversion error: {e}")
-    
-    def convert_to_wav(
-        self, 
-        input_path: Path, 
-        output_path: Optional[Path] = None
+        return await self._convert_file(input_path, output_path, profile, keep_input)
+
+    async def convert_to_wav(
+        self,
+        input_path: Path,
+        output_path: Optional[Path] = None,
+        keep_input: bool = False,
+        profile: str = "wav",
     ) -> Path:
         """
         转换音频文件为 WAV 格式
-        
+
         Args:
             input_path: 输入文件路径
             output_path: 输出文件路径（可选）
-            
+            keep_input: 保留原始文件
+            profile: 编码配置（wav / speech_wav）
+
         Returns:
             Path: 转换后的文件路径
         """
-        if not self.ffmpeg_available:
-            logger.warning("FFmpeg not available, skipping conversion")
-            return input_path
-        
-        if output_path is None:
-            output_path = input_path.with_suffix('.wav')
-        
-        if input_path.suffix.lower() == '.wav':
-            logger.debug(f"File is already WAV: {input_path}")
-            return input_path
-        
-        logger.info(f"Converting {input_path.name} to WAV...")
-        
-        try:
-            result = subprocess.run([
-                'ffmpeg',
-                '-i', str(input_path),
-                '-acodec', 'pcm_s16le',   # PCM 16-bit
-                '-ar', '44100',            # 采样率
-                '-ac', '2',                # 双声道
-                '-y',
-                str(output_path)
-            ],
-            capture_output=True,
-            timeout=30,
-            text=True
-            )
-            
-            if result.returncode != 0:
-                logger.error(f"FFmpeg conversion failed: {result.stderr}")
-                raise Exception(f"Audio conversion failed: {result.stderr}")
-            
-            logger.info(f"Converted to WAV: {output_path}")
-            
-            # 删除原始文件
-            if input_path != output_path and input_path.exists():
-                try:
-                    input_path.unlink()
-                except Exception as e:
-                    logger.warning(f"Failed to remove original file: {e}")
-            
-            return output_path
-            
-        except subprocess.TimeoutExpired:
-            raise Exception("Audio conversion timeout")
-        except Exception as e:
-            raise Exception(f"Audio conversion error: {e}")
-    
-    def get_audio_info(self, file_path: Path) -> dict:
+        return await self._convert_file(input_path, output_path, profile, keep_input)
+
+    async def get_audio_info(self, file_path: Path) -> dict:
         """
         获取音频文件信息
-        
+
         Args:
             file_path: 音频文件路径
-            
+
         Returns:
             dict: 音频信息（时长、比特率等）
         """
         if not self.ffmpeg_available:
             return {}
-        
         try:
-            result = subprocess.run([
-                'ffprobe',
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_format',
-                '-show_streams',
-                str(file_path)
-            ],
-            capture_output=True,
-            timeout=10,
-            text=True
-            )
-            
-            if result.returncode == 0:
-                import json
-                info = json.loads(result.stdout)
-                return info
-            
-            return {}
-            
+            return await ffmpeg_runner.probe(str(file_path))
         except Exception as e:
             logger.error(f"Failed to get audio info: {e}")
             return {}
 
+    def stats(self) -> dict:
+        total = self.cache_hits + self.cache_misses
+        return {
+            "ffmpeg_available": self.ffmpeg_available,
+            "ffmpeg_running": ffmpeg_runner.running,
+            "cache_entries": len(self._cache),
+            "cache_bytes": self._cache_bytes,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_rate": round(self.cache_hits / total, 4) if total else 0.0,
+        }
+
 
 # 全局单例
 audio_converter = AudioConverter()
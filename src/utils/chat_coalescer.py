@@ -0,0 +1,106 @@
+"""
+连发消息合并
+同一用户在短时间内连续 @bot 的几条消息（一句话拆成几条发）合并成一个提问，只调用一次 LLM、回复一次。
+CHAT_COALESCE_MS=0（默认）时关闭
+"""
+import asyncio
+import dataclasses
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from src.utils.message_parser import ParsedMessage
+
+
+@dataclass
+class _Burst:
+    items: List[Any] = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+    last: float = field(default_factory=time.monotonic)
+    full: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class ChatCoalescer:
+    """
+    按 user_key 的去抖窗口
+
+    第一条消息的处理协程成为“领头者”：一直等到窗口内没有新消息（或达到条数/总等待上限），
+    拿走整批消息继续处理；窗口内后到的消息只并入批次，由调用方直接结束处理
+    """
+
+    def __init__(self):
+        self.window_sec = int(os.getenv("CHAT_COALESCE_MS", "0")) / 1000
+        self.max_messages = int(os.getenv("CHAT_COALESCE_MAX_MESSAGES", "5"))
+        # the window slides with each new message; cap the total wait so a chatty user still gets a reply
+        self.max_wait_sec = int(os.getenv("CHAT_COALESCE_MAX_WAIT_MS", "0")) / 1000 or self.window_sec * 3
+        self._bursts: Dict[str, _Burst] = {}
+        self.batches = 0
+        self.merged = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_sec > 0
+
+    async def submit(self, user_key: str, item: Any) -> Optional[List[Any]]:
+        """
+        提交一条消息
+
+        Returns:
+            Optional[List[Any]]: 领头者拿到按到达顺序排列的整批消息；并入别人批次的调用返回 None
+        """
+        if not self.enabled:
+            return [item]
+
+        burst = self._bursts.get(user_key)
+        if burst is not None:
+            burst.items.append(item)
+            burst.last = time.monotonic()
+            self.merged += 1
+            if len(burst.items) >= self.max_messages:
+                burst.full.set()
+            return None
+
+        burst = self._bursts[user_key] = _Burst(items=[item])
+        try:
+            while len(burst.items) < self.max_messages:
+                now = time.monotonic()
+                remaining = min(burst.last + self.window_sec, burst.started + self.max_wait_sec) - now
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(burst.full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._bursts.pop(user_key, None)
+        self.batches += 1
+        return burst.items
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "window_ms": int(self.window_sec * 1000),
+            "pending": len(self._bursts),
+            "batches": self.batches,
+            "merged": self.merged,
+        }
+
+
+def merge_parsed(messages: List[ParsedMessage]) -> ParsedMessage:
+    """把一批连发消息合并成一条：文本按行拼接，媒体依次排列"""
+    if len(messages) == 1:
+        return messages[0]
+    return dataclasses.replace(
+        messages[-1],
+        text="\n".join(m.text for m in messages if m.text),
+        images=[img for m in messages for img in m.images],
+        audios=[a for m in messages for a in m.audios],
+        videos=[v for m in messages for v in m.videos],
+        has_media=any(m.has_media for m in messages),
+        plain_text="\n".join(m.plain_text for m in messages if m.plain_text),
+    )
+
+
+# 全局单例
+chat_coalescer = ChatCoalescer()
@@ -0,0 +1,111 @@
+"""
+命令前缀匹配
+从 NoneBot 已注册的 matcher（on_command 的 CommandRule）自动生成一个正则，
+聊天处理器用它一次判断消息是不是命令，命中则不调用 AI；新插件注册的命令自动生效
+"""
+import re
+from typing import Iterable, List, Optional, Pattern, Set
+
+from nonebot.log import logger
+from nonebot.rule import CommandRule, ShellCommandRule
+
+
+def _command_starts() -> Set[str]:
+    try:
+        from nonebot import get_driver
+        starts = set(get_driver().config.command_start)
+    except Exception:
+        starts = {"/"}
+    return {s for s in starts if s}
+
+
+def _command_sep() -> str:
+    try:
+        from nonebot import get_driver
+        return next(iter(get_driver().config.command_sep), ".")
+    except Exception:
+        return "."
+
+
+def _all_matchers() -> List[type]:
+    from nonebot.matcher import matchers
+    return [m for group in matchers.values() for m in group]
+
+
+def collect_commands(matchers: Iterable, sep: str = ".") -> Set[str]:
+    """收集 matcher 规则中的命令名（含别名），多段命令用 sep 连接"""
+    commands: Set[str] = set()
+    for matcher in matchers:
+        rule = getattr(matcher, "rule", None)
+        for dependent in getattr(rule, "checkers", ()):
+            checker = getattr(dependent, "call", None)
+            if isinstance(checker, (CommandRule, ShellCommandRule)):
+                for cmd in checker.cmds:
+                    name = sep.join(cmd).strip()
+                    if name:
+                        commands.add(name)
+    return commands
+
+
+class CommandMatcher:
+    """命令前缀正则：以命令起始符开头，或以命令名开头且其后为空白/结尾"""
+
+    def __init__(self):
+        self._pattern: Optional[Pattern[str]] = None
+        self._commands: Set[str] = set()
+        self._matcher_count = -1
+        self._from_registry = True
+
+    def build(self, matchers: Optional[Iterable] = None, starts: Optional[Set[str]] = None) -> int:
+        """
+        重新生成正则
+
+        Args:
+            matchers: matcher 列表，默认取 NoneBot 全部已注册 matcher
+            starts: 命令起始符，默认取配置 COMMAND_START（空字符串忽略）
+
+        Returns:
+            int: 命令名数量
+        """
+        self._from_registry = matchers is None
+        matchers = list(_all_matchers() if matchers is None else matchers)
+        self._matcher_count = len(matchers)
+        self._commands = collect_commands(matchers, _command_sep())
+        starts = _command_starts() if starts is None else {s for s in starts if s}
+
+        alternatives = []
+        if starts:
+            alternatives.append("(?:" + "|".join(re.escape(s) for s in sorted(starts, key=len, reverse=True)) + ")")
+        if self._commands:
+            # longest first so "rss_digest" wins over "rss"
+            names = "|".join(re.escape(c) for c in sorted(self._commands, key=len, reverse=True))
+            alternatives.append(f"(?P<cmd>{names})(?:\\s|$)")
+        self._pattern = re.compile("^(?:" + "|".join(alternatives) + ")", re.IGNORECASE) if alternatives else None
+
+        logger.info(f"Command matcher built: {len(self._commands)} commands from {self._matcher_count} matchers")
+        return len(self._commands)
+
+    @property
+    def commands(self) -> Set[str]:
+        return set(self._commands)
+
+    def match(self, text: str) -> Optional[str]:
+        """
+        判断文本是否为命令
+
+        Returns:
+            Optional[str]: 命中的命令名（以命令起始符开头时返回起始符本身），不是命令时为 None
+        """
+        if self._matcher_count < 0 or (self._from_registry and self._matcher_count != len(_all_matchers())):
+            # plugins loaded after the last build are picked up here
+            self.build()
+        if self._pattern is None:
+            return None
+        m = self._pattern.match(text.strip())
+        if m is None:
+            return None
+        return m.groupdict().get("cmd") or m.group(0)
+
+
+# 全局单例
+command_matcher = CommandMatcher()
@@ -0,0 +1,131 @@
+"""
+按会话串行处理
+同一个 user_key 的多条消息按到达顺序逐条处理（回复不会乱序，后一条能看到前一条写入的历史），
+排队期间复用上一轮构建的上下文快照，避免重复查询；每个会话的信箱有上限，防止单个用户刷屏占满后端
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from nonebot.log import logger
+
+Context = Tuple[List[Dict], Optional[str]]
+
+
+class MailboxFull(RuntimeError):
+    """该会话排队的消息已达上限"""
+
+
+@dataclass
+class _Snapshot:
+    personal_history: List[Dict]
+    system_context: Optional[str]
+    built_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _Actor:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    pending: int = 0  # running + queued turns
+    snapshot: Optional[_Snapshot] = None
+
+
+class Turn:
+    """一轮对话（持有该会话的锁，处理完必须 release）"""
+
+    def __init__(self, owner: "ConversationActors", user_key: str, actor: _Actor):
+        self._owner = owner
+        self._user_key = user_key
+        self._actor = actor
+        self._released = False
+
+    def context(self, build: Callable[[], Context]) -> Context:
+        """取上下文：排队中的后续轮次复用上一轮的快照（已追加上一轮的问答），否则调用 build 重新构建"""
+        snap = self._actor.snapshot
+        if snap is not None and time.monotonic() - snap.built_at <= self._owner.reuse_sec:
+            self._owner.reused += 1
+            return list(snap.personal_history), snap.system_context
+
+        personal_history, system_context = build()
+        self._owner.builds += 1
+        self._actor.snapshot = _Snapshot(list(personal_history), system_context)
+        return personal_history, system_context
+
+    def record(self, user_text: str, reply: str):
+        """本轮问答写入快照，供排在后面的轮次直接使用"""
+        snap = self._actor.snapshot
+        if snap is None:
+            return
+        snap.personal_history.append({"role": "user", "parts": [{"text": user_text}]})
+        snap.personal_history.append({"role": "model", "parts": [{"text": reply}]})
+        del snap.personal_history[:-self._owner.history_keep]
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._actor.lock.release()
+        self._owner._leave(self._user_key, self._actor)
+
+
+class ConversationActors:
+    """每个 user_key 一把锁 + 有界信箱"""
+
+    def __init__(self):
+        # turns allowed to wait behind the running one
+        self.mailbox_max = int(os.getenv("CHAT_MAILBOX_MAX", "3"))
+        self.reuse_sec = float(os.getenv("CHAT_CONTEXT_REUSE_SEC", "60"))
+        # same bound as ConversationMemory.get_personal_history (10 rounds)
+        self.history_keep = int(os.getenv("CHAT_CONTEXT_HISTORY_KEEP", "20"))
+        self._actors: Dict[str, _Actor] = {}
+        self.builds = 0
+        self.reused = 0
+        self.rejected = 0
+        self.max_wait_ms = 0.0
+
+    async def enter(self, user_key: str) -> Turn:
+        """
+        排队等待该会话的上一轮处理完
+
+        Raises:
+            MailboxFull: 排队的消息超过 CHAT_MAILBOX_MAX
+        """
+        actor = self._actors.get(user_key)
+        if actor is None:
+            actor = self._actors[user_key] = _Actor()
+        if actor.pending > self.mailbox_max:
+            self.rejected += 1
+            logger.warning(f"Mailbox full for {user_key} ({actor.pending} turns pending)")
+            raise MailboxFull(user_key)
+
+        actor.pending += 1
+        start = time.monotonic()
+        try:
+            await actor.lock.acquire()
+        except BaseException:
+            self._leave(user_key, actor)
+            raise
+        self.max_wait_ms = max(self.max_wait_ms, (time.monotonic() - start) * 1000)
+        return Turn(self, user_key, actor)
+
+    def _leave(self, user_key: str, actor: _Actor):
+        actor.pending -= 1
+        if actor.pending <= 0 and self._actors.get(user_key) is actor:
+            # idle: drop the actor and its snapshot so the next message reads fresh context
+            del self._actors[user_key]
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._actors),
+            "queued": sum(max(0, a.pending - 1) for a in self._actors.values()),
+            "context_builds": self.builds,
+            "context_reused": self.reused,
+            "rejected": self.rejected,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
+
+
+# 全局单例
+conversation_actors = ConversationActors()
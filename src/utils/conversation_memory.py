@@ -57,11 +57,13 @@ class ConversationMemory:
         
         return "历史总结：\n" + "\n".join(summary_texts)
     
-    def build_full_context(self, user_id: str, group_id: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    def build_full_context(self, user_id: str, group_id: Optional[str] = None,
+                           include_summaries: bool = True) -> Tuple[List[Dict], Optional[str]]:
         """
         Build complete context for AI:
         - Returns: (personal_history, system_context)
         - system_context includes group context + summaries
+        - include_summaries=False skips Tier 3 (used when the request deadline is close)
         """
         personal_history = self.get_personal_history(user_id)
         
@@ -75,7 +77,7 @@ class ConversationMemory:
         if group_ctx:
             context_parts.append(group_ctx)
         
-        summaries = self.get_group_summaries_text(group_id)
+        summaries = self.get_group_summaries_text(group_id) if include_summaries else None
         if summaries:
             context_parts.append(summaries)
         
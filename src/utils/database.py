@@ -268,7 +268,7 @@ class Database:
         # Keep only recent messages
         self._clean_old_group_context(group_id)
     
-    def get_group_context(self, group_id: str, limit: int = 10) -> List[Tuple[datetime, str, str]]:
+    def get_group_context(self, group_id: str, limit: int = 10) -> List[Tuple[datetime, Optional[str], str, str]]:
         """Get recent group context messages"""
         conn = self._get_connection()
         cursor = conn.cursor()
@@ -285,11 +285,12 @@ class Database:
         
         context = []
         for row in reversed(rows):
+            # sqlite3.Row has no .get(); index by column name
             context.append((
                 datetime.fromisoformat(row['timestamp']),
-                row.get('user_id') if hasattr(row,'keys') else row[1],
-                row['user_name'] if hasattr(row,'keys') else row[2],
-                row['content'] if hasattr(row,'keys') else row[3]
+                row['user_id'],
+                row['user_name'],
+                row['content']
             ))
         
         return context
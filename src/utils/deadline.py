@@ -0,0 +1,151 @@
+"""
+聊天请求的端到端时间预算
+每条 @bot 消息带一个 Deadline 走完整条链路（合并等待 → 排队 → 上下文 → 媒体 → LLM → 发送），
+各阶段检查剩余时间并逐级降级：去掉长期总结、缩短历史、跳过智能路由、换快速模型、先发“思考中”。
+各阶段耗时计入直方图，可在管理面板查看预算花在了哪里
+"""
+import os
+import time
+from typing import Dict, List, Optional
+
+# 剩余时间低于该值（秒）时执行对应降级；按链路先后排列
+_DEFAULT_THRESHOLDS = {
+    "drop_summaries": 35.0,  # 不加载 Tier 3 长期总结
+    "shrink_history": 30.0,  # 个人历史只保留最近几条
+    "skip_router": 30.0,  # 不调用智能路由（它本身就是一次 LLM 请求）
+    "flash_model": 20.0,  # 改用 chat_short 快速模型
+    "no_retry": 8.0,  # LLM 失败后不再重试
+}
+
+# 直方图桶上界（毫秒），最后一个桶收纳更长的耗时
+_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Deadline:
+    """一次请求的截止时间；lap() 记录阶段耗时，should() 判断并记录降级"""
+
+    def __init__(self, budget_sec: float, thresholds: Dict[str, float], owner: Optional["LatencyBudget"] = None):
+        self.budget_sec = budget_sec
+        self.thresholds = thresholds
+        self._owner = owner
+        self._start = time.monotonic()
+        self._last_lap = self._start
+        self.stages: Dict[str, float] = {}
+        self.degraded: List[str] = []
+        self._finished = False
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    def remaining(self) -> float:
+        return self.budget_sec - self.elapsed()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def should(self, step: str) -> bool:
+        """剩余时间是否已低于该降级步骤的阈值（是则记下这次降级）"""
+        threshold = self.thresholds.get(step)
+        if threshold is None or self.remaining() >= threshold:
+            return False
+        self.degrade(step)
+        return True
+
+    def degrade(self, step: str):
+        if step not in self.degraded:
+            self.degraded.append(step)
+
+    def lap(self, stage: str) -> float:
+        """记录从上一次 lap（或开始）到现在的阶段耗时，返回秒数"""
+        now = time.monotonic()
+        spent = now - self._last_lap
+        self._last_lap = now
+        self.add_stage(stage, spent)
+        return spent
+
+    def add_stage(self, stage: str, seconds: float):
+        """直接记一段阶段耗时（并发执行的阶段各自计时，见 stage_graph）"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def finish(self):
+        """请求结束时调用一次，把阶段耗时和降级计入全局统计"""
+        if self._finished:
+            return
+        self._finished = True
+        if self._owner is not None:
+            self._owner.record(self)
+
+
+class _Histogram:
+    __slots__ = ("counts", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        i = 0
+        while i < len(_BUCKETS_MS) and ms > _BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def to_dict(self) -> dict:
+        n = sum(self.counts)
+        labels = [f"<={b}ms" for b in _BUCKETS_MS] + [f">{_BUCKETS_MS[-1]}ms"]
+        return {
+            "count": n,
+            "avg_ms": round(self.total_ms / n, 1) if n else 0.0,
+            "max_ms": round(self.max_ms, 1),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class LatencyBudget:
+    """预算配置 + 各阶段耗时直方图"""
+
+    def __init__(self):
+        self.budget_sec = float(os.getenv("CHAT_DEADLINE_SEC", "45"))
+        self.ack_after_sec = float(os.getenv("CHAT_ACK_AFTER_SEC", "15"))
+        self.short_history = int(os.getenv("DEADLINE_SHORT_HISTORY", "6"))
+        self.thresholds = {
+            step: float(os.getenv(f"DEADLINE_{step.upper()}_SEC", str(default)))
+            for step, default in _DEFAULT_THRESHOLDS.items()
+        }
+        self._stages: Dict[str, _Histogram] = {}
+        self._total = _Histogram()
+        self._degraded: Dict[str, int] = {}
+        self.requests = 0
+        self.over_budget = 0
+
+    def start(self) -> Deadline:
+        return Deadline(self.budget_sec, self.thresholds, owner=self)
+
+    def record(self, deadline: Deadline):
+        self.requests += 1
+        elapsed = deadline.elapsed()
+        self._total.observe(elapsed * 1000)
+        if elapsed > deadline.budget_sec:
+            self.over_budget += 1
+        for stage, sec in deadline.stages.items():
+            self._stages.setdefault(stage, _Histogram()).observe(sec * 1000)
+        for step in deadline.degraded:
+            self._degraded[step] = self._degraded.get(step, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "budget_sec": self.budget_sec,
+            "requests": self.requests,
+            "over_budget": self.over_budget,
+            "total": self._total.to_dict(),
+            "stages": {name: h.to_dict() for name, h in self._stages.items()},
+            "degraded": dict(self._degraded),
+            "thresholds_sec": dict(self.thresholds),
+        }
+
+
+# 全局单例
+latency_budget = LatencyBudget()
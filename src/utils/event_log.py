@@ -0,0 +1,126 @@
+"""
+追加写事件日志 + 快照
+状态变化以紧凑 JSON 行追加到日志（写入量与新数据成正比），定期把完整状态原子写成快照并清空日志。
+每行带递增序号，快照记录已包含的序号：即使快照写完、日志还没清空就崩溃，重放时也不会重复计数
+"""
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, IO, Iterator, Optional, Tuple, Union
+
+from nonebot.log import logger
+
+
+def atomic_write_json(path: Union[str, Path], data: Any):
+    """先写临时文件并 fsync，再 os.replace 覆盖，写到一半崩溃也不会留下损坏的文件"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class EventLog:
+    """
+    快照文件 {"seq": N, "state": ...} + 日志文件（每行 {"s": 序号, ...事件字段}）
+
+    用法：load() 取快照状态并重放其后的事件 → append() 记录新事件 →
+    needs_compaction 时 compact(当前完整状态) → 退出时 close()
+    """
+
+    def __init__(self, snapshot_path: Union[str, Path], log_path: Union[str, Path], compact_every: int = 1000):
+        self.snapshot_path = Path(snapshot_path)
+        self.log_path = Path(log_path)
+        self.compact_every = compact_every
+        self.seq = 0  # last sequence number written
+        self._since_compact = 0
+        self._fh: Optional[IO[str]] = None
+
+    def load(self) -> Tuple[Optional[Any], Iterator[Dict]]:
+        """
+        读取快照和待重放的事件（快照文件是旧版直接保存的状态 JSON 时原样返回）
+
+        Returns:
+            (快照状态或 None, 快照之后的事件迭代器)
+        """
+        state, snap_seq = None, 0
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict) and "state" in data:
+                state, snap_seq = data["state"], int(data.get("seq", 0))
+            else:
+                state = data  # plain JSON state written before the event log existed
+        self.seq = snap_seq
+        return state, self._replay(snap_seq)
+
+    def _replay(self, after_seq: int) -> Iterator[Dict]:
+        if not self.log_path.exists():
+            return
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line torn by a crash mid-write; later appends start on a fresh line
+                    logger.warning(f"Event log {self.log_path}: skipping unreadable line {line_no}")
+                    continue
+                seq = int(event.pop("s", 0))
+                if seq <= after_seq:
+                    continue  # already in the snapshot
+                self.seq = max(self.seq, seq)
+                self._since_compact += 1
+                yield event
+
+    def append(self, event: Dict):
+        """追加一条事件（行缓冲，每条立即写入文件）"""
+        if self._fh is None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            self._fh = open(self.log_path, "a", encoding="utf-8", buffering=1)
+            if self._ends_mid_line():
+                self._fh.write("\n")
+        self.seq += 1
+        self._since_compact += 1
+        self._fh.write(json.dumps({"s": self.seq, **event}, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def _ends_mid_line(self) -> bool:
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return False
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) != b"\n"
+        except OSError:
+            return False
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self._since_compact >= self.compact_every
+
+    def compact(self, state: Any):
+        """写入包含全部事件的快照，然后清空日志"""
+        atomic_write_json(self.snapshot_path, {"seq": self.seq, "state": state})
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        # a crash before this truncate is harmless: replay skips seq <= snapshot seq
+        open(self.log_path, "w", encoding="utf-8").close()
+        self._since_compact = 0
+
+    def flush(self):
+        if self._fh is not None:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def close(self):
+        if self._fh is not None:
+            self.flush()
+            self._fh.close()
+            self._fh = None
@@ -0,0 +1,122 @@
+"""
+ffmpeg 异步执行器
+用 asyncio 子进程运行 ffmpeg/ffprobe（stdin/stdout 管道，不落中间文件），全局并发上限 + 超时强杀，
+不会阻塞事件循环
+"""
+import os
+import json
+import shutil
+import asyncio
+from typing import Dict, List, Optional, Sequence
+
+from nonebot.log import logger
+
+
+class FFmpegError(RuntimeError):
+    """ffmpeg 不可用、超时或返回非 0"""
+
+
+class FFmpegRunner:
+    """ffmpeg 子进程池（并发上限由信号量控制）"""
+
+    def __init__(self, binary: str = "ffmpeg", probe_binary: str = "ffprobe"):
+        self.binary = binary
+        self.probe_binary = probe_binary
+        self.max_parallel = int(os.getenv("FFMPEG_CONCURRENCY", "2"))
+        self.timeout = float(os.getenv("FFMPEG_TIMEOUT_SEC", "30"))
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._available: Optional[bool] = None
+        self.running = 0
+
+    @property
+    def available(self) -> bool:
+        """ffmpeg 是否在 PATH 中（首次使用时检查，不在导入时启动子进程）"""
+        if self._available is None:
+            self._available = shutil.which(self.binary) is not None
+            if not self._available:
+                logger.warning("FFmpeg not found. Audio/video conversion is disabled.")
+                logger.warning("Install FFmpeg: apt-get install ffmpeg")
+        return self._available
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # created lazily so it binds to the running loop
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(max(1, self.max_parallel))
+        return self._sem
+
+    async def _exec(
+        self,
+        argv: List[str],
+        input_data: Optional[bytes],
+        timeout: Optional[float],
+    ) -> bytes:
+        async with self._semaphore():
+            self.running += 1
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *argv,
+                    stdin=asyncio.subprocess.PIPE if input_data is not None else asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                try:
+                    stdout, stderr = await asyncio.wait_for(
+                        proc.communicate(input_data), timeout or self.timeout
+                    )
+                except (asyncio.TimeoutError, asyncio.CancelledError):
+                    if proc.returncode is None:
+                        proc.kill()
+                        await proc.wait()
+                    raise
+            except asyncio.TimeoutError as e:
+                name = os.path.basename(argv[0])
+                raise FFmpegError(f"{name} timeout after {timeout or self.timeout:.0f}s") from e
+            except OSError as e:
+                raise FFmpegError(f"failed to start {argv[0]}: {e}") from e
+            finally:
+                self.running -= 1
+
+        if proc.returncode != 0:
+            err = stderr.decode("utf-8", "replace").strip().splitlines()
+            raise FFmpegError(f"{os.path.basename(argv[0])} exited {proc.returncode}: {err[-1] if err else ''}")
+        return stdout
+
+    async def run(
+        self,
+        args: Sequence[str],
+        input_data: Optional[bytes] = None,
+        timeout: Optional[float] = None,
+    ) -> bytes:
+        """
+        运行一次 ffmpeg
+
+        Args:
+            args: ffmpeg 参数（不含可执行文件名），输入/输出通常为 pipe:0 / pipe:1
+            input_data: 写入 stdin 的数据
+            timeout: 超时秒数（默认 FFMPEG_TIMEOUT_SEC）
+
+        Returns:
+            bytes: stdout 内容
+
+        Raises:
+            FFmpegError: 不可用、超时或转换失败
+        """
+        if not self.available:
+            raise FFmpegError("ffmpeg not available")
+        return await self._exec([self.binary, "-hide_banner", "-loglevel", "error", *args], input_data, timeout)
+
+    async def probe(
+        self, path: str, timeout: float = 10, headers: Optional[Dict[str, str]] = None
+    ) -> dict:
+        """ffprobe 读取容器/流信息（JSON）；headers 为读取 HTTP 源时附带的请求头"""
+        if not self.available:
+            raise FFmpegError("ffmpeg not available")
+        argv = [self.probe_binary, "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams"]
+        if headers:
+            argv += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in headers.items())]
+        out = await self._exec([*argv, str(path)], None, timeout)
+        return json.loads(out or b"{}")
+
+
+# 全局单例
+ffmpeg_runner = FFmpegRunner()
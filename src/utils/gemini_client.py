@@ -1,12 +1,21 @@
 import os
 import json
 import time
-from datetime import datetime
+import asyncio
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
 from nonebot.log import logger
 from google import genai
 
+from .key_pool import KeyPool
+
 USAGE_FILE = "data/usage.json"  # Store in data directory for persistence
 
+# Files API keeps uploads for 48h; stop reusing them a bit earlier
+UPLOAD_TTL_SEC = 47 * 3600
+
 # Model Limits Configuration
 # Tier 1 (Free / Key 1)
 LIMITS_TIER_1 = {
@@ -41,99 +50,52 @@ class GeminiClient:
             if single_key:
                 self.api_keys.append(single_key)
         
-        # Remove duplicates and empty strings
-        self.api_keys = list(set([k for k in self.api_keys if k]))
+        # Remove duplicates and empty strings (order matters: key 1 is the free tier)
+        self.api_keys = list(dict.fromkeys(k for k in self.api_keys if k))
         
         logger.info(f"DEBUG: Loaded {len(self.api_keys)} Gemini API keys.")
         
-        self.usage_data = self._load_usage()
-        self._clean_old_usage()
-
-    def _load_usage(self):
-        if not os.path.exists(USAGE_FILE):
-            return {}
-        try:
-            with open(USAGE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return {}
+        self.key_pool = KeyPool(
+            self.api_keys,
+            self._get_limits,
+            snapshot_file=USAGE_FILE,
+            flush_interval=float(os.getenv("GEMINI_USAGE_FLUSH_SEC", "30")),
+        )
 
-    def _save_usage(self):
-        with open(USAGE_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.usage_data, f, indent=4)
+        # The google-genai SDK is synchronous: run it in a bounded pool so slow
+        # uploads/generations never block the event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("GEMINI_SDK_WORKERS", "4")),
+            thread_name_prefix="genai",
+        )
+        self._clients: Dict[str, genai.Client] = {}
+        # (api key, sha256(content)) -> (uploaded file, expires_at); files are only visible to that key
+        self._upload_cache: Dict[Tuple[str, str], Tuple[object, float]] = {}
+        # uploaded file name -> api key that uploaded it
+        self._file_keys: Dict[str, str] = {}
 
-    def _clean_old_usage(self):
-        # Reset daily counters if day changed
-        today = datetime.now().strftime("%Y-%m-%d")
-        if self.usage_data.get("date") != today:
-            self.usage_data = {"date": today, "keys": {}}
-            self._save_usage()
+    def _client(self, key):
+        """每个 key 复用同一个 genai.Client"""
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = genai.Client(api_key=key)
+        return client
 
-    def _get_usage(self, key, model):
-        if key not in self.usage_data["keys"]:
-            self.usage_data["keys"][key] = {}
-        if model not in self.usage_data["keys"][key]:
-            self.usage_data["keys"][key][model] = {
-                "rpd": 0,
-                "minute_requests": [], # List of timestamps
-                "minute_tokens": []    # List of (timestamp, count)
-            }
-        return self.usage_data["keys"][key][model]
+    async def _run_sdk(self, func, *args, **kwargs):
+        """在线程池中执行同步 SDK 调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
 
-    def _get_limits(self, key):
+    def _get_limits(self, index):
         # Determine limits based on key index
-        try:
-            index = self.api_keys.index(key)
-        except ValueError:
-            index = 0
-        
         if index == 0:
             return LIMITS_TIER_1
         else:
             return LIMITS_TIER_2
 
-    def _check_limits(self, key, model):
-        limits_config = self._get_limits(key)
-        limits = limits_config.get(model)
-        
-        if not limits:
-            logger.info(f"DEBUG: No limits found for model {model}, allowing.")
-            return True # No limits defined, allow
-
-        usage = self._get_usage(key, model)
-        now = time.time()
-
-        # Check RPD
-        if usage["rpd"] >= limits["rpd"]:
-            logger.warning(f"Key {key[:4]}... hit RPD limit for {model}")
-            return False
-
-        # Clean old minute data
-        usage["minute_requests"] = [t for t in usage["minute_requests"] if now - t < 60]
-        usage["minute_tokens"] = [(t, c) for t, c in usage["minute_tokens"] if now - t < 60]
-
-        # Check RPM
-        if len(usage["minute_requests"]) >= limits["rpm"]:
-            logger.warning(f"Key {key[:4]}... hit RPM limit for {model}")
-            return False
-
-        # Check TPM
-        current_tpm = sum(c for t, c in usage["minute_tokens"])
-        if current_tpm >= limits["tpm"]:
-            logger.warning(f"Key {key[:4]}... hit TPM limit for {model}")
-            return False
-
-        return True
-
-    def _record_usage(self, key, model, tokens=0):
-        usage = self._get_usage(key, model)
-        now = time.time()
-        
-        usage["rpd"] += 1
-        usage["minute_requests"].append(now)
-        usage["minute_tokens"].append((now, tokens))
-        
-        self._save_usage()
+    def headroom(self):
+        """各 key 的剩余额度（rpm/tpm/rpd）"""
+        return self.key_pool.headroom()
 
     def select_model(self, prompt, task_type='chat', prefer_tier='flash'):
         """
@@ -189,21 +151,22 @@ class GeminiClient:
             model = self.select_model(prompt, task_type)
             logger.info(f"Auto-selected model: {model} for task_type={task_type}, prompt_len={len(prompt)}")
         
-        # Try keys in order
-        for key in self.api_keys:
-            if self._check_limits(key, model):
-                try:
-                    logger.info(f"Attempting API call with key {key[:4]}... (history: {len(history) if history else 0} messages)")
-                    return await self._call_api(key, model, prompt, history)
-                except Exception as e:
-                    logger.error(f"API call failed with key {key[:4]}...: {e}")
-                    continue # Try next key
+        # Least-loaded key first; on failure move on to the next one
+        tried = set()
+        while (lease := self.key_pool.acquire(model, exclude=tried)) is not None:
+            key = lease.key
+            tried.add(key)
+            try:
+                logger.info(f"Attempting API call with key {key[:4]}... (history: {len(history) if history else 0} messages)")
+                return await self._call_api(lease, model, prompt, history)
+            except Exception as e:
+                logger.error(f"API call failed with key {key[:4]}...: {e}")
+                continue # Try next key
         
         return "[Error] All API keys exhausted or failed."
 
-    async def _call_api(self, key, model, prompt, history=None):
-        # Initialize client with API key
-        client = genai.Client(api_key=key)
+    async def _call_api(self, lease, model, prompt, history=None):
+        client = self._client(lease.key)
         
         # Build contents with history
         if history:
@@ -213,7 +176,8 @@ class GeminiClient:
             contents = prompt
         
         # Call the API
-        response = client.models.generate_content(
+        response = await self._run_sdk(
+            client.models.generate_content,
             model=model,
             contents=contents
         )
@@ -261,7 +225,7 @@ class GeminiClient:
         else:
             total_tokens = len(prompt) // 4  # Fallback estimate
         
-        self._record_usage(key, model, total_tokens)
+        self.key_pool.commit(lease, total_tokens)
         
         # Validate response text
         try:
@@ -276,13 +240,18 @@ class GeminiClient:
         # Return text response
         return response_text
     
-    async def upload_file(self, file_path, mime_type: str = None):
+    async def upload_file(self, file_path, mime_type: str = None, model: str = None, key: str = None):
         """
         上传文件到 Gemini Files API
         
+        上传的文件只属于上传它的 key 所在的项目，生成时必须用同一个 key（见 generate_multimodal_content）；
+        同一次请求的多个文件应传入第一个文件的 key_for_file(...)，保证落在同一个 key 上
+        
         Args:
             file_path: 本地文件路径 (Path 或 str)
             mime_type: MIME 类型，如果为 None 则自动检测
+            model: 之后要用的模型，按该模型的负载选择 key
+            key: 指定上传用的 key
             
         Returns:
             上传后的文件对象（包含 uri 等信息）
@@ -304,28 +273,61 @@ class GeminiClient:
             if not mime_type:
                 mime_type = 'application/octet-stream'
         
+        keys = [key] if key else self.key_pool.ranked(model)
+        if not keys:
+            raise Exception("All API keys exhausted, cannot upload file")
+        
+        # 相同内容（例如反复转发的表情包）在过期前直接复用该 key 已上传的文件
+        content_hash = await asyncio.to_thread(_file_sha256, file_path)
+        now = time.time()
+        for k in keys:
+            cached = self._upload_cache.get((k, content_hash))
+            if cached and cached[1] > now:
+                logger.info(f"Upload cache hit: {file_path.name} -> {cached[0].uri} (key {k[:4]}...)")
+                return cached[0]
+        
         logger.info(f"Uploading file: {file_path.name} ({mime_type})")
         
-        # 尝试所有可用的 API key
-        for key in self.api_keys:
+        # 按负载从低到高尝试 API key
+        for k in keys:
             try:
-                client = genai.Client(api_key=key)
+                client = self._client(k)
                 
                 # 使用新版SDK的上传方法
                 # 直接传入文件路径，SDK会自动处理
-                uploaded_file = client.files.upload(file=str(file_path))
+                uploaded_file = await self._run_sdk(client.files.upload, file=str(file_path))
                 
                 logger.info(f"File uploaded successfully: {uploaded_file.name}, URI: {uploaded_file.uri}, MIME: {uploaded_file.mime_type}")
+                self._remember_upload(k, content_hash, uploaded_file)
                 return uploaded_file
                 
             except Exception as e:
-                logger.error(f"File upload failed with key {key[:4]}...: {e}")
+                logger.error(f"File upload failed with key {k[:4]}...: {e}")
                 import traceback
                 logger.error(f"Upload traceback: {traceback.format_exc()}")
                 continue
         
         raise Exception("All API keys failed to upload file")
     
+    def _remember_upload(self, key, content_hash, uploaded_file):
+        now = time.time()
+        expires_at = now + UPLOAD_TTL_SEC
+        expiration = getattr(uploaded_file, 'expiration_time', None)
+        if expiration is not None and hasattr(expiration, 'timestamp'):
+            # leave a margin so a reused URI does not expire mid-request
+            expires_at = min(expires_at, expiration.timestamp() - 3600)
+        
+        if len(self._upload_cache) > 1024:
+            self._upload_cache = {h: v for h, v in self._upload_cache.items() if v[1] > now}
+            live = {v[0].name for v in self._upload_cache.values()}
+            self._file_keys = {n: k for n, k in self._file_keys.items() if n in live}
+        self._upload_cache[(key, content_hash)] = (uploaded_file, expires_at)
+        self._file_keys[uploaded_file.name] = key
+    
+    def key_for_file(self, uploaded_file):
+        """上传该文件的 key（不是经 upload_file 上传的返回 None）"""
+        return self._file_keys.get(getattr(uploaded_file, 'name', None))
+    
     async def generate_multimodal_content(
         self,
         model: str,
@@ -340,7 +342,7 @@ class GeminiClient:
         Args:
             model: 模型名称或 'auto'
             text: 文本提示
-            files: 上传的文件对象列表
+            files: 上传的文件对象列表（须由同一个 key 上传）
             history: 对话历史
             task_type: 任务类型
             
@@ -352,26 +354,34 @@ class GeminiClient:
             model = self.select_model(text, task_type)
             logger.info(f"Auto-selected model: {model}")
         
-        # 尝试所有 API key
-        for key in self.api_keys:
-            if self._check_limits(key, model):
-                try:
-                    logger.info(
-                        f"Multimodal API call: model={model}, files={len(files) if files else 0}, "
-                        f"history={len(history) if history else 0}"
-                    )
-                    return await self._call_multimodal_api(
-                        key, model, text, files, history
-                    )
-                except Exception as e:
-                    logger.error(f"Multimodal API call failed with key {key[:4]}...: {e}")
-                    continue
+        # 按负载从低到高尝试 API key；带文件时只能用上传这些文件的 key
+        tried = set()
+        owners = {self.key_for_file(f) for f in files or []} - {None}
+        if len(owners) > 1:
+            logger.error(f"Multimodal files were uploaded with {len(owners)} different API keys")
+            return "[Error] Files were uploaded with different API keys."
+        if owners:
+            tried = set(self.api_keys) - owners
+        while (lease := self.key_pool.acquire(model, exclude=tried)) is not None:
+            key = lease.key
+            tried.add(key)
+            try:
+                logger.info(
+                    f"Multimodal API call: model={model}, files={len(files) if files else 0}, "
+                    f"history={len(history) if history else 0}"
+                )
+                return await self._call_multimodal_api(
+                    lease, model, text, files, history
+                )
+            except Exception as e:
+                logger.error(f"Multimodal API call failed with key {key[:4]}...: {e}")
+                continue
         
         return "[Error] All API keys exhausted or failed."
     
     async def _call_multimodal_api(
         self,
-        key: str,
+        lease,
         model: str,
         text: str,
         files: list = None,
@@ -381,7 +391,7 @@ class GeminiClient:
         调用 Gemini 多模态 API
         
         Args:
-            key: API key
+            lease: key_pool.acquire 返回的 KeyLease
             model: 模型名称
             text: 文本提示
             files: 上传的文件对象列表
@@ -390,7 +400,7 @@ class GeminiClient:
         Returns:
             str: 生成的文本
         """
-        client = genai.Client(api_key=key)
+        client = self._client(lease.key)
         
         # 构建当前消息的 parts
         current_parts = []
@@ -426,7 +436,8 @@ class GeminiClient:
         logger.debug(f"Multimodal contents: {len(contents)} messages, current parts: {len(current_parts)}")
         
         # 调用 API
-        response = client.models.generate_content(
+        response = await self._run_sdk(
+            client.models.generate_content,
             model=model,
             contents=contents
         )
@@ -470,7 +481,7 @@ class GeminiClient:
         else:
             total_tokens = len(text) // 4
         
-        self._record_usage(key, model, total_tokens)
+        self.key_pool.commit(lease, total_tokens)
         
         # 验证响应
         try:
@@ -484,5 +495,13 @@ class GeminiClient:
         
         return response_text
 
+def _file_sha256(path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 gemini_client = GeminiClient()
 
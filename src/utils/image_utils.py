@@ -1,10 +1,165 @@
+import os
 import base64
+import asyncio
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 from io import BytesIO
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple, Union
 
 from PIL import Image
 
+# Pillow work (decode / resample / encode) runs in worker processes so a large
+# photo never stalls the event loop. The process pool is forked once at startup
+# (start_pool, from a driver.on_startup hook) before the bot has other threads:
+# forking later would copy a multi-threaded process and can deadlock a child on
+# a lock held by another thread. Without start_pool a thread pool is used.
+_pool: Optional[Executor] = None
+
+
+def _noop() -> None:
+    return None
+
+
+def _worker_count() -> int:
+    return int(os.getenv("IMAGE_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+
+
+def _thread_pool() -> Executor:
+    return ThreadPoolExecutor(max_workers=_worker_count(), thread_name_prefix="image")
+
+
+def start_pool():
+    """Fork all image worker processes now (call at startup, before other threads exist)."""
+    global _pool
+    if _pool is not None:
+        return
+    if "fork" not in multiprocessing.get_all_start_methods():
+        _pool = _thread_pool()
+        return
+    # fork: workers must not re-import bot.py (spawn would re-run nonebot.init)
+    workers = _worker_count()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+    # with fork every worker is launched on the first submit; one no-op per
+    # worker makes sure all of them exist before this returns
+    for future in [pool.submit(_noop) for _ in range(workers)]:
+        future.result()
+    _pool = pool
+
+
+def _get_pool() -> Executor:
+    global _pool
+    if _pool is None:
+        _pool = _thread_pool()
+    return _pool
+
+
+def shutdown_pool():
+    """Stop the image worker pool (bot shutdown)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def run_in_image_pool(func, *args):
+    """Run a picklable, module-level image function in the worker pool."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), func, *args)
+    except BrokenExecutor:
+        # a worker died (e.g. killed on a decompression bomb); re-forking now would
+        # copy a multi-threaded process, so carry on with threads
+        shutdown_pool()
+        raise
+
+
+def open_downscaled(src: Union[str, Path, bytes], max_px: int) -> Image.Image:
+    """Open an image (path or in-memory bytes) and shrink it so the longest side <= max_px.
+
+    JPEGs are decoded in draft mode (DCT scaling at decode time), then
+    thumbnail() applies Image.reduce() before the final LANCZOS pass, so a
+    4000x3000 photo is never fully decoded/resampled at full resolution.
+    """
+    img = Image.open(BytesIO(src) if isinstance(src, (bytes, bytearray)) else src)
+    if img.format == "JPEG":
+        # decode straight at 1/2, 1/4 or 1/8 scale while staying >= max_px
+        img.draft("RGB", (max_px, max_px))
+    img.thumbnail((max_px, max_px), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return img
+
+
+def _flatten_to_rgb(img: Image.Image) -> Image.Image:
+    """Drop alpha onto a white background (transparent stickers would turn black otherwise)."""
+    if img.mode in ("RGBA", "LA", "P"):
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def dhash(img: Image.Image) -> int:
+    """64-bit difference hash: 9x8 grayscale, one bit per horizontal neighbour comparison.
+
+    Survives recompression and rescaling, so a re-posted meme hashes within a
+    few bits of the original. Pure Pillow (the image is already tiny here).
+    """
+    small = img.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    px = small.tobytes()  # one byte per pixel in "L" mode
+    bits = 0
+    for row in range(8):
+        base = row * 9
+        for col in range(8):
+            bits = (bits << 1) | (px[base + col] > px[base + col + 1])
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _encode(img: Image.Image, quality: int, force_format: str) -> bytes:
+    if force_format.upper() == "JPEG":
+        img = _flatten_to_rgb(img)
+    buf = BytesIO()
+    img.save(buf, format=force_format, quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def encode_image(
+    src: Union[str, Path, bytes],
+    max_px: int = 1024,
+    quality: int = 85,
+    force_format: str = "JPEG",
+) -> bytes:
+    """The single image path: decode once (downscaled), flatten, encode once.
+
+    Module-level so it can run in the image worker pool.
+    """
+    return _encode(open_downscaled(src, max_px), quality, force_format)
+
+
+def encode_image_with_dhash(
+    src: Union[str, Path, bytes],
+    max_px: int = 1024,
+    quality: int = 85,
+    force_format: str = "JPEG",
+) -> Tuple[bytes, int]:
+    """encode_image plus the dHash of the same decoded image (no second decode)."""
+    img = open_downscaled(src, max_px)
+    return _encode(img, quality, force_format), dhash(img)
+
+
+def to_data_url(data: bytes, force_format: str = "JPEG") -> str:
+    mime = "image/jpeg" if force_format.upper() == "JPEG" else "image/png"
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
 
 def image_file_to_data_url(
     path: str | Path,
@@ -19,21 +174,99 @@ def image_file_to_data_url(
 
     Returns: data:image/jpeg;base64,...
     """
-    p = Path(path)
-    img = Image.open(p)
-    img = img.convert("RGB")
+    return to_data_url(encode_image(path, max_px, quality, force_format), force_format)
 
-    w, h = img.size
-    scale = min(1.0, float(max_px) / float(max(w, h)))
-    if scale < 1.0:
-        img = img.resize((int(w * scale), int(h * scale)))
 
-    buf = BytesIO()
-    img.save(buf, format=force_format, quality=quality, optimize=True)
-    b64 = base64.b64encode(buf.getvalue()).decode("ascii")
+@dataclass(frozen=True)
+class PreparedImage:
+    """A vision-ready image: data URL plus perceptual hash."""
+    data_url: str
+    dhash: int
 
-    mime = "image/jpeg" if force_format.upper() == "JPEG" else "image/png"
-    return f"data:{mime};base64,{b64}"
+    def __len__(self) -> int:
+        # size counted against the PreparedImageCache budget
+        return len(self.data_url)
+
+
+class PreparedImageCache:
+    """LRU of finished images keyed by (content_hash, max_px, quality), bounded by total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Tuple[str, int, int], PreparedImage]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, int, int]) -> Optional[PreparedImage]:
+        value = self._items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Tuple[str, int, int], value: PreparedImage):
+        if len(value) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._items[key] = value
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+prepared_cache = PreparedImageCache(int(os.getenv("IMAGE_PREPARED_CACHE_MB", "64")) * 1024 * 1024)
+
+
+async def prepare_image_async(
+    path: str | Path,
+    max_px: int = 1024,
+    quality: int = 85,
+    force_format: str = "JPEG",
+    content_hash: Optional[str] = None,
+) -> PreparedImage:
+    """Decode/resize/encode + dHash in the image worker pool.
+
+    With content_hash, the result is cached, so a repeated image (same bytes,
+    same max_px/quality) skips decode/resize/encode entirely.
+    """
+    key = (content_hash, max_px, quality) if content_hash and force_format.upper() == "JPEG" else None
+    if key is not None:
+        cached = prepared_cache.get(key)
+        if cached is not None:
+            return cached
+
+    data, phash = await run_in_image_pool(encode_image_with_dhash, str(path), max_px, quality, force_format)
+    prepared = PreparedImage(to_data_url(data, force_format), phash)
+    if key is not None:
+        prepared_cache.put(key, prepared)
+    return prepared
+
+
+async def image_file_to_data_url_async(
+    path: str | Path,
+    max_px: int = 1024,
+    quality: int = 85,
+    force_format: str = "JPEG",
+    content_hash: Optional[str] = None,
+) -> str:
+    """image_file_to_data_url in the image worker pool (cached by content_hash, see prepare_image_async)."""
+    return (await prepare_image_async(path, max_px, quality, force_format, content_hash)).data_url
 
 
 def strip_data_url_prefix(data_url: str) -> str:
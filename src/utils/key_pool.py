@@ -0,0 +1,315 @@
+"""
+API Key 池
+按 (key, model) 维护内存滑动窗口，选择负载最低的 key，定期后台落盘
+"""
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from nonebot.log import logger
+
+WINDOW_SEC = 60.0
+
+
+class _Event:
+    """窗口中的一次请求"""
+
+    __slots__ = ("ts", "tokens", "live")
+
+    def __init__(self, ts: float, tokens: int):
+        self.ts = ts
+        self.tokens = tokens
+        self.live = True  # False once pruned out of the window
+
+
+class UsageWindow:
+    """单个 (key, model) 的用量窗口：最近 60 秒的请求/token 以及当日请求数"""
+
+    __slots__ = ("events", "tokens", "rpd")
+
+    def __init__(self):
+        self.events: Deque[_Event] = deque()
+        self.tokens = 0  # running sum of tokens inside the window
+        self.rpd = 0
+
+    def prune(self, now: float):
+        # amortized O(1): every event is appended and popped exactly once
+        cutoff = now - WINDOW_SEC
+        events = self.events
+        while events and events[0].ts <= cutoff:
+            event = events.popleft()
+            event.live = False
+            self.tokens -= event.tokens
+
+    def add(self, now: float, tokens: int) -> _Event:
+        event = _Event(now, tokens)
+        self.events.append(event)
+        self.tokens += tokens
+        self.rpd += 1
+        return event
+
+    def add_tokens(self, event: _Event, tokens: int):
+        """Attribute tokens to the request's own event (usage is only known after the response)."""
+        if tokens <= 0:
+            return
+        event.tokens += tokens
+        if event.live:
+            # an event already pruned no longer counts toward the window sum
+            self.tokens += tokens
+
+
+class KeyLease:
+    """acquire() 占用的一个请求名额；拿到响应后交给 commit() 补记 token"""
+
+    __slots__ = ("key", "model", "_window", "_event")
+
+    def __init__(self, key: str, model: str, window: UsageWindow, event: _Event):
+        self.key = key
+        self.model = model
+        self._window = window
+        self._event = event
+
+
+class KeyPool:
+    """
+    多 key 限流池
+
+    - acquire(model) 立即占用一个请求名额，返回负载最低、仍有余量的 key 的 KeyLease
+    - commit(lease, tokens) 在拿到响应后把 token 记到该次请求上（并发请求互不串账）
+    - 用量只在内存中更新，后台任务每 flush_interval 秒把快照原子写入磁盘
+    """
+
+    def __init__(
+        self,
+        keys: List[str],
+        limits_for: Callable[[int], Dict[str, Dict[str, int]]],
+        snapshot_file: str = "data/usage.json",
+        flush_interval: float = 30.0,
+    ):
+        # keep the configured order: index decides the tier and breaks ties
+        self.keys = list(dict.fromkeys(k for k in keys if k))
+        self._limits = {key: limits_for(i) for i, key in enumerate(self.keys)}
+        self.snapshot_file = snapshot_file
+        self.flush_interval = flush_interval
+
+        self.date = datetime.now().strftime("%Y-%m-%d")
+        self.windows: Dict[Tuple[str, str], UsageWindow] = {}
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self._load()
+
+    # ---- window bookkeeping ----
+
+    def _window(self, key: str, model: str) -> UsageWindow:
+        w = self.windows.get((key, model))
+        if w is None:
+            w = self.windows[(key, model)] = UsageWindow()
+        return w
+
+    def _roll_day(self):
+        today = datetime.now().strftime("%Y-%m-%d")
+        if today != self.date:
+            self.date = today
+            for w in self.windows.values():
+                w.rpd = 0
+            self._dirty = True
+
+    def _load_ratio(self, key: str, model: str, now: float) -> Optional[float]:
+        """
+        当前负载比例（0 = 空闲，>= 1 = 已触顶），None 表示该模型没有配置限额
+        """
+        limits = self._limits[key].get(model)
+        if not limits:
+            return None
+        w = self._window(key, model)
+        w.prune(now)
+        return max(
+            len(w.events) / limits["rpm"],
+            w.tokens / limits["tpm"],
+            w.rpd / limits["rpd"],
+        )
+
+    # ---- public API ----
+
+    def acquire(self, model: str, exclude: Optional[set] = None) -> Optional[KeyLease]:
+        """
+        选择负载最低的可用 key 并占用一个请求名额
+
+        Args:
+            model: 模型名称
+            exclude: 本次请求中已失败过的 key
+
+        Returns:
+            KeyLease（lease.key 为选中的 key），全部触顶时返回 None
+        """
+        self._ensure_flusher()
+        self._roll_day()
+        now = time.time()
+
+        best_key, best_load = None, None
+        for key in self.keys:
+            if exclude and key in exclude:
+                continue
+            load = self._load_ratio(key, model, now)
+            if load is None:
+                load = 0.0  # no limits defined, always allowed
+            elif load >= 1.0:
+                continue
+            if best_load is None or load < best_load:
+                best_key, best_load = key, load
+                if load == 0.0:
+                    break
+
+        if best_key is None:
+            logger.warning(f"All Gemini keys hit limits for {model}")
+            return None
+
+        window = self._window(best_key, model)
+        event = window.add(now, 0)
+        self._dirty = True
+        return KeyLease(best_key, model, window, event)
+
+    def ranked(self, model: Optional[str] = None, exclude: Optional[set] = None) -> List[str]:
+        """
+        仍有余量的 key，按负载从低到高排列（不占用名额，用于上传文件等不计入模型限额的调用）
+
+        Args:
+            model: 按该模型的负载排序；None 时取各模型中最高的负载
+            exclude: 跳过的 key
+        """
+        self._roll_day()
+        now = time.time()
+        loads = []
+        for i, key in enumerate(self.keys):
+            if exclude and key in exclude:
+                continue
+            models = [model] if model else list(self._limits[key])
+            ratios = [r for r in (self._load_ratio(key, m, now) for m in models) if r is not None]
+            load = max(ratios, default=0.0)
+            if load >= 1.0:
+                continue
+            loads.append((load, i, key))
+        return [key for _, _, key in sorted(loads)]
+
+    def commit(self, lease: KeyLease, tokens: int):
+        """补记这次请求实际消耗的 token"""
+        lease._window.add_tokens(lease._event, int(tokens or 0))
+        self._dirty = True
+
+    def headroom(self, key: Optional[str] = None) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """
+        各 key 在各模型上的剩余额度
+
+        Returns:
+            {"key1(AIza...)": {model: {"rpm": .., "tpm": .., "rpd": ..}}}
+        """
+        self._roll_day()
+        now = time.time()
+        result = {}
+        for i, k in enumerate(self.keys):
+            if key and k != key:
+                continue
+            per_model = {}
+            for model, limits in self._limits.get(k, {}).items():
+                w = self._window(k, model)
+                w.prune(now)
+                per_model[model] = {
+                    "rpm": max(0, limits["rpm"] - len(w.events)),
+                    "tpm": max(0, limits["tpm"] - w.tokens),
+                    "rpd": max(0, limits["rpd"] - w.rpd),
+                }
+            result[f"key{i + 1}({k[:4]}...)"] = per_model
+        return result
+
+    # ---- persistence ----
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        keys = {}
+        for (key, model), w in self.windows.items():
+            w.prune(now)
+            if not w.rpd and not w.events:
+                continue
+            keys.setdefault(key, {})[model] = {
+                "rpd": w.rpd,
+                "window": [[round(e.ts, 3), e.tokens] for e in w.events],
+            }
+        return {"date": self.date, "keys": keys}
+
+    def _load(self):
+        if not os.path.exists(self.snapshot_file):
+            return
+        try:
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load key usage snapshot: {e}")
+            return
+
+        if data.get("date") != self.date:
+            return  # daily counters only; minute windows are long expired anyway
+
+        now = time.time()
+        for key, models in (data.get("keys") or {}).items():
+            if key not in self._limits:
+                continue
+            for model, entry in models.items():
+                if not isinstance(entry, dict):
+                    continue
+                w = self._window(key, model)
+                w.rpd = int(entry.get("rpd", 0))
+                # snapshots written by the old per-request format have no "window"
+                for ts, tok in entry.get("window", []):
+                    if now - ts < WINDOW_SEC:
+                        w.events.append(_Event(ts, tok))
+                        w.tokens += tok
+
+    def flush(self):
+        """把快照原子写入磁盘（仅在有变更时）"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        data = self.snapshot()
+        tmp = f"{self.snapshot_file}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_file) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp, self.snapshot_file)
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"Failed to save key usage snapshot: {e}")
+
+    def _ensure_flusher(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # sync caller (tests / scripts); flush() manually
+        self._flush_task = loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                self.flush()
+        except asyncio.CancelledError:
+            self.flush()
+            raise
+
+    async def close(self):
+        """停止后台落盘任务并写入最后一次快照"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        self.flush()
@@ -0,0 +1,272 @@
+"""
+媒体缓存索引
+按内容哈希存储文件（相同内容只存一份），URL → 内容 的映射和访问时间记录在 SQLite 中，
+内存里按媒体类型维护 LRU，超出容量预算时淘汰最久未访问的文件
+"""
+import os
+import time
+import asyncio
+import sqlite3
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from nonebot.log import logger
+
+MEDIA_TYPES = ("image", "audio", "video")
+
+# files not referenced by the index are only removed after this grace period,
+# so in-flight downloads (.part) and derived files (converted audio) survive
+_ORPHAN_GRACE_SEC = 3600
+
+
+@dataclass
+class CacheEntry:
+    content_hash: str
+    media_type: str
+    path: Path
+    size: int
+    mime: str
+    last_access: float
+
+
+class MediaCache:
+    """内容寻址的媒体缓存（索引常驻内存，SQLite 持久化）"""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        self.expire_hours = int(os.getenv("MEDIA_CACHE_EXPIRE_HOURS", "24"))
+        self.budgets = {
+            "image": int(os.getenv("MEDIA_CACHE_IMAGE_MB", "200")) * 1024 * 1024,
+            "audio": int(os.getenv("MEDIA_CACHE_AUDIO_MB", "100")) * 1024 * 1024,
+            "video": int(os.getenv("MEDIA_CACHE_VIDEO_MB", "500")) * 1024 * 1024,
+        }
+
+        # per media type: content_hash -> entry, least recently used first
+        self._lru: Dict[str, "OrderedDict[str, CacheEntry]"] = {t: OrderedDict() for t in MEDIA_TYPES}
+        self._sizes: Dict[str, int] = {t: 0 for t in MEDIA_TYPES}
+        self._urls: Dict[str, str] = {}  # url_hash -> content_hash
+        self._touched: Dict[str, float] = {}  # content_hash -> last_access not yet persisted
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.cache_dir / "index.db"), check_same_thread=False)
+        self._init_db()
+        self._load()
+
+    def _init_db(self):
+        cursor = self._conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS media_blobs (
+                content_hash TEXT PRIMARY KEY,
+                media_type TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mime TEXT,
+                last_access REAL NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS media_urls (
+                url_hash TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_media_urls_content
+            ON media_urls (content_hash)
+        """)
+        self._conn.commit()
+
+    def _load(self):
+        """启动时把索引读入内存（一次性检查文件是否还在）"""
+        rows = self._conn.execute(
+            "SELECT content_hash, media_type, path, size, mime, last_access "
+            "FROM media_blobs ORDER BY last_access"
+        ).fetchall()
+        missing = []
+        for content_hash, media_type, path, size, mime, last_access in rows:
+            p = Path(path)
+            if media_type not in self._lru or not p.exists():
+                missing.append(content_hash)
+                continue
+            self._lru[media_type][content_hash] = CacheEntry(content_hash, media_type, p, size, mime, last_access)
+            self._sizes[media_type] += size
+
+        for url_hash, content_hash in self._conn.execute("SELECT url_hash, content_hash FROM media_urls"):
+            self._urls[url_hash] = content_hash
+
+        if missing:
+            self._delete_rows(missing)
+        logger.info(
+            f"MediaCache loaded: {sum(len(v) for v in self._lru.values())} files, "
+            + ", ".join(f"{t}={self._sizes[t] / 1024 / 1024:.1f}MB" for t in MEDIA_TYPES)
+        )
+
+    def _delete_rows(self, content_hashes: List[str]):
+        params = [(h,) for h in content_hashes]
+        self._conn.executemany("DELETE FROM media_blobs WHERE content_hash = ?", params)
+        self._conn.executemany("DELETE FROM media_urls WHERE content_hash = ?", params)
+        self._conn.commit()
+
+    def lookup(self, url_hash: str, media_type: str) -> Optional[Path]:
+        """
+        按 URL 查找缓存文件（纯内存查询，不访问文件系统）
+
+        Returns:
+            Optional[Path]: 命中时返回文件路径
+        """
+        content_hash = self._urls.get(url_hash)
+        if content_hash is None:
+            return None
+        entry = self._lru[media_type].get(content_hash)
+        if entry is None:
+            # content was evicted; forget the stale url mapping
+            self._urls.pop(url_hash, None)
+            return None
+
+        entry.last_access = time.time()
+        self._lru[media_type].move_to_end(content_hash)
+        self._touched[content_hash] = entry.last_access
+        return entry.path
+
+    def content_hash(self, url_hash: str) -> Optional[str]:
+        """URL 对应的内容哈希（不更新访问时间）"""
+        return self._urls.get(url_hash)
+
+    def store(
+        self,
+        url_hash: str,
+        media_type: str,
+        tmp_path: Path,
+        content_hash: str,
+        size: int,
+        ext: str,
+        mime: str,
+    ) -> Path:
+        """
+        把下载完成的临时文件放入缓存
+
+        相同内容已存在时直接复用并删除临时文件（不同 QQ URL 指向同一张图的情况）
+
+        Returns:
+            Path: 缓存中的文件路径
+        """
+        lru = self._lru[media_type]
+        now = time.time()
+        entry = lru.get(content_hash)
+
+        if entry is not None:
+            tmp_path.unlink(missing_ok=True)
+            entry.last_access = now
+            lru.move_to_end(content_hash)
+            self._touched[content_hash] = now
+            logger.debug(f"MediaCache dedupe: {url_hash} -> {entry.path.name}")
+        else:
+            final_path = tmp_path.with_name(f"{content_hash}{ext}")
+            os.replace(tmp_path, final_path)
+            entry = CacheEntry(content_hash, media_type, final_path, size, mime, now)
+            lru[content_hash] = entry
+            self._sizes[media_type] += size
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media_blobs (content_hash, media_type, path, size, mime, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, media_type, str(final_path), size, mime, now),
+            )
+
+        self._urls[url_hash] = content_hash
+        self._conn.execute(
+            "INSERT OR REPLACE INTO media_urls (url_hash, content_hash) VALUES (?, ?)",
+            (url_hash, content_hash),
+        )
+        self._conn.commit()
+
+        self._evict(media_type, keep=content_hash)
+        return entry.path
+
+    def _evict(self, media_type: str, keep: Optional[str] = None):
+        """超出容量预算时按 LRU 淘汰"""
+        lru = self._lru[media_type]
+        budget = self.budgets[media_type]
+        evicted = []
+        while self._sizes[media_type] > budget and lru:
+            content_hash, entry = next(iter(lru.items()))
+            if content_hash == keep:
+                break  # a single file larger than the whole budget stays until replaced
+            self._remove(entry)
+            evicted.append(content_hash)
+        if evicted:
+            self._delete_rows(evicted)
+            logger.info(f"MediaCache evicted {len(evicted)} {media_type} files (budget {budget // 1024 // 1024}MB)")
+
+    def _remove(self, entry: CacheEntry):
+        self._lru[entry.media_type].pop(entry.content_hash, None)
+        self._sizes[entry.media_type] -= entry.size
+        self._touched.pop(entry.content_hash, None)
+        try:
+            entry.path.unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"Failed to remove cached file {entry.path}: {e}")
+
+    async def cleanup(self) -> int:
+        """
+        定期维护：持久化访问时间、淘汰超过 expire_hours 未访问的文件、删除索引外的孤立文件
+
+        索引（内存 LRU + SQLite 连接）只在事件循环里修改，这里也不例外；
+        只有不碰索引的孤立文件扫描放到线程中执行
+
+        Returns:
+            int: 删除的文件数
+        """
+        expired = self._expire()
+        known = {e.path for lru in self._lru.values() for e in lru.values()}
+        orphans = await asyncio.to_thread(self._remove_orphans, known)
+
+        logger.info(f"MediaCache cleanup: expired={expired}, orphans={orphans}")
+        return expired + orphans
+
+    def _expire(self) -> int:
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE media_blobs SET last_access = ? WHERE content_hash = ?",
+                [(ts, h) for h, ts in self._touched.items()],
+            )
+            self._conn.commit()
+            self._touched.clear()
+
+        cutoff = time.time() - self.expire_hours * 3600
+        expired = []
+        for lru in self._lru.values():
+            for content_hash, entry in list(lru.items()):
+                if entry.last_access >= cutoff:
+                    break  # LRU order: everything after this is newer
+                self._remove(entry)
+                expired.append(content_hash)
+        if expired:
+            self._delete_rows(expired)
+        live_hashes = {h for lru in self._lru.values() for h in lru}
+        self._urls = {u: h for u, h in self._urls.items() if h in live_hashes}
+        return len(expired)
+
+    def _remove_orphans(self, known: Set[Path]) -> int:
+        """删除宽限期之前就已存在、但不在索引中的文件（线程中执行，只读 known 快照）"""
+        orphan_cutoff = time.time() - _ORPHAN_GRACE_SEC
+        orphans = 0
+        for sub in ("images", "audios", "videos"):
+            d = self.cache_dir / sub
+            if not d.is_dir():
+                continue
+            for p in d.iterdir():
+                try:
+                    if p.is_file() and p not in known and p.stat().st_mtime < orphan_cutoff:
+                        p.unlink()
+                        orphans += 1
+                except Exception as e:
+                    logger.warning(f"Failed to remove orphan file {p}: {e}")
+        return orphans
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            t: {"files": len(self._lru[t]), "bytes": self._sizes[t], "budget": self.budgets[t]}
+            for t in MEDIA_TYPES
+        }
@@ -3,15 +3,40 @@
 下载、缓存和清理多媒体文件
 """
 import os
+import uuid
 import hashlib
 import aiohttp
 import asyncio
 from pathlib import Path
-from typing import Optional
-from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
 from nonebot.log import logger
 import mimetypes
 
+from src.utils.media_cache import MediaCache
+
+_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Referer": "https://im.qq.com/",
+}
+
+# network read size / how much is buffered before one off-loop disk write
+_CHUNK_SIZE = 64 * 1024
+_WRITE_BUFFER_SIZE = 256 * 1024
+
+
+class MediaTooLargeError(ValueError):
+    """下载内容超过大小上限"""
+
+
+class _Inflight:
+    """一次共享的下载任务及正在等待它的调用方数量"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
 
 class MediaDownloader:
     """媒体文件下载和管理"""
@@ -19,7 +44,6 @@ class MediaDownloader:
     def __init__(self):
         # 配置
         self.cache_dir = Path(os.getenv("MEDIA_CACHE_DIR", "data/temp_media"))
-        self.cache_expire_hours = int(os.getenv("MEDIA_CACHE_EXPIRE_HOURS", "24"))
         self.max_download_size_mb = int(os.getenv("MEDIA_MAX_DOWNLOAD_SIZE_MB", "50"))
         
         # 创建目录结构
@@ -27,11 +51,38 @@ class MediaDownloader:
         self.audios_dir = self.cache_dir / "audios"
         self.videos_dir = self.cache_dir / "videos"
         
+        self.type_dirs = {"image": self.images_dir, "audio": self.audios_dir, "video": self.videos_dir}
+        
         for dir_path in [self.images_dir, self.audios_dir, self.videos_dir]:
             dir_path.mkdir(parents=True, exist_ok=True)
         
+        # 内容寻址缓存索引（URL 哈希 / 内容哈希 → 文件）
+        self.cache = MediaCache(self.cache_dir)
+        
+        # 共享连接池（首次下载时创建，绑定到运行中的事件循环）
+        self.pool_size = int(os.getenv("MEDIA_DOWNLOAD_POOL_SIZE", "16"))
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # 正在进行的下载：(media_type, url_hash) -> 下载任务，同一 URL 的并发请求共享一次传输
+        self._inflight: Dict[Tuple[str, str], _Inflight] = {}
+        
         logger.info(f"MediaDownloader initialized: cache_dir={self.cache_dir}")
     
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享的 ClientSession"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=_HEADERS,
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+            )
+        return self._session
+    
+    async def close(self):
+        """关闭共享连接池（bot 关闭时调用）"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
     def _get_url_hash(self, url: str) -> str:
         """
         生成 URL 的哈希值用于缓存文件名
@@ -46,57 +97,31 @@ class MediaDownloader:
     
     def _get_cached_path(self, url: str, media_type: str) -> Optional[Path]:
         """
-        获取缓存文件路径（如果存在且未过期）
+        获取缓存文件路径（查内存索引，不扫描目录）
         
         Args:
             url: 文件 URL
             media_type: 媒体类型 (image/audio/video)
             
         Returns:
-            Optional[Path]: 缓存文件路径，如果不存在或已过期则返回 None
+            Optional[Path]: 缓存文件路径，如果不存在则返回 None
         """
-        url_hash = self._get_url_hash(url)
-        
-        # 选择目录
-        if media_type == "image":
-            base_dir = self.images_dir
-        elif media_type == "audio":
-            base_dir = self.audios_dir
-        elif media_type == "video":
-            base_dir = self.videos_dir
-        else:
+        if media_type not in self.type_dirs:
             return None
         
-        # 查找匹配的文件（可能有不同扩展名）
-        for file_path in base_dir.glob(f"{url_hash}.*"):
-            # 检查是否过期
-            if self._is_expired(file_path):
-                logger.debug(f"Cache expired: {file_path}")
-                file_path.unlink()  # 删除过期文件
-                return None
-            
-            logger.debug(f"Cache hit: {file_path}")
-            return file_path
-        
-        return None
+        cached = self.cache.lookup(self._get_url_hash(url), media_type)
+        if cached:
+            logger.debug(f"Cache hit: {cached}")
+        return cached
     
-    def _is_expired(self, file_path: Path) -> bool:
+    def get_content_hash(self, url: str) -> Optional[str]:
         """
-        检查文件是否过期
+        已缓存 URL 对应的内容哈希（sha256），未缓存时返回 None
         
         Args:
-            file_path: 文件路径
-            
-        Returns:
-            bool: 是否过期
+            url: 文件 URL
         """
-        if not file_path.exists():
-            return True
-        
-        mtime = datetime.fromtimestamp(file_path.stat().st_mtime)
-        expire_time = datetime.now() - timedelta(hours=self.cache_expire_hours)
-        
-        return mtime < expire_time
+        return self.cache.content_hash(self._get_url_hash(url))
     
     def _normalize_url(self, url: str) -> str:
         """
@@ -118,71 +143,149 @@ class MediaDownloader:
         
         return url
     
+    def resolve_url(self, url: str) -> str:
+        """下载时实际访问的 URL（供 ffprobe 等直接读取远端）"""
+        return self._normalize_url(url)
+    
+    def request_headers(self) -> Dict[str, str]:
+        """下载时附带的请求头（直接读取远端时需要同样的 Referer/User-Agent）"""
+        return dict(_HEADERS)
+    
     async def _download_file(
         self, 
         url: str, 
-        save_path: Path,
-        timeout: int = 30
+        media_type: str,
+        ext: str,
+        timeout: int = 30,
+        max_bytes: Optional[int] = None
     ) -> Path:
         """
-        下载文件到指定路径
+        下载文件并放入缓存（按内容哈希命名，相同内容只保留一份）
         
         Args:
             url: 文件 URL
-            save_path: 保存路径
+            media_type: 媒体类型 (image/audio/video)
+            ext: 文件扩展名（带点）
             timeout: 超时时间（秒）
+            max_bytes: 大小上限（默认 MEDIA_MAX_DOWNLOAD_SIZE_MB）
             
         Returns:
-            Path: 下载后的文件路径
+            Path: 缓存中的文件路径
             
         Raises:
             Exception: 下载失败
         """
+        url_hash = self._get_url_hash(url)
+        key = (media_type, url_hash)
+        
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            task = asyncio.ensure_future(self._fetch(url, url_hash, media_type, ext, timeout, max_bytes))
+            inflight = self._inflight[key] = _Inflight(task)
+            task.add_done_callback(lambda t: self._finish_inflight(key, t))
+        else:
+            logger.debug(f"Joining in-flight download: {url[:50]}")
+        
+        # shield: one caller being cancelled must not abort the transfer for the others,
+        # but once every caller has given up the transfer itself is cancelled
+        inflight.waiters += 1
+        try:
+            return await asyncio.shield(inflight.task)
+        finally:
+            inflight.waiters -= 1
+            if inflight.waiters == 0 and not inflight.task.done():
+                logger.debug(f"All waiters left, cancelling download: {url[:50]}")
+                inflight.task.cancel()
+    
+    def _finish_inflight(self, key: Tuple[str, str], task: asyncio.Task):
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight.task is task:
+            del self._inflight[key]
+        # mark the exception as retrieved even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+    
+    async def _fetch(
+        self, url: str, url_hash: str, media_type: str, ext: str, timeout: int, max_bytes: Optional[int]
+    ) -> Path:
+        """实际下载（每个 URL 同一时间只有一个）"""
         # 标准化URL（处理跨容器访问）
         url = self._normalize_url(url)
         
         logger.info(f"Downloading from {url[:50]}...")
         
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Referer": "https://im.qq.com/",
-        }
-        
+        tmp_path = self.type_dirs[media_type] / f"{url_hash}.{uuid.uuid4().hex[:8]}.part"
         for attempt in range(3):
             try:
-                async with aiohttp.ClientSession(headers=headers) as session:
-                    async with session.get(
-                        url,
-                        timeout=aiohttp.ClientTimeout(total=timeout)
-                    ) as response:
-                        response.raise_for_status()
-                        
-                        # 检查文件大小
-                        content_length = response.headers.get('Content-Length')
-                        if content_length:
-                            size_mb = int(content_length) / (1024 * 1024)
-                            if size_mb > self.max_download_size_mb:
-                                raise ValueError(
-                                    f"File too large: {size_mb:.1f}MB > "
-                                    f"{self.max_download_size_mb}MB"
-                                )
-                        
-                        # 下载文件
-                        content = await response.read()
-                        
-                        # 保存文件
-                        save_path.write_bytes(content)
-                        logger.info(f"Downloaded {len(content)} bytes to {save_path}")
-                        
-                        return save_path
-                        
+                content_hash, size = await self._stream_to_file(url, tmp_path, timeout, max_bytes)
+                return self.cache.store(
+                    url_hash, media_type, tmp_path, content_hash, size, ext,
+                    self.get_mime_type(Path(f"x{ext}")),
+                )
             except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                 logger.warning(f"Download attempt {attempt+1}/3 failed: {e}")
                 if attempt == 2:
-                    raise Exception(f"Download failed after 3 attempts: {e}")
+                    raise Exception(f"Download failed after 3 attempts: {e}") from e
                 await asyncio.sleep(1)
+            except MediaTooLargeError:
+                raise  # callers tell "too large" apart from a failed download
             except Exception as e:
-                raise Exception(f"Download error: {e}")
+                tmp_path.unlink(missing_ok=True)
+                raise Exception(f"Download error: {e}") from e
+    
+    async def _stream_to_file(
+        self, url: str, tmp_path: Path, timeout: int, max_bytes: Optional[int] = None
+    ) -> Tuple[str, int]:
+        """
+        分块流式写入临时文件，同时计算内容哈希
+        
+        超过大小上限时立即中断（不依赖 Content-Length），内存占用只有几百 KB
+        
+        Returns:
+            Tuple[str, int]: (sha256, 字节数)
+        """
+        max_bytes = max_bytes or self.max_download_size_mb * 1024 * 1024
+        limit_mb = max_bytes / (1024 * 1024)
+        digest = hashlib.sha256()
+        
+        async with self._get_session().get(
+            url,
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            response.raise_for_status()
+            
+            # 检查文件大小（有 Content-Length 时提前拒绝）
+            content_length = response.headers.get('Content-Length')
+            if content_length and int(content_length) > max_bytes:
+                raise MediaTooLargeError(
+                    f"File too large: {int(content_length) / (1024 * 1024):.1f}MB > {limit_mb:.0f}MB"
+                )
+            
+            f = await asyncio.to_thread(open, tmp_path, "wb")
+            total = 0
+            try:
+                buf = bytearray()
+                async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
+                    total += len(chunk)
+                    if total > max_bytes:
+                        raise MediaTooLargeError(
+                            f"File too large: > {limit_mb:.0f}MB (aborted mid-stream)"
+                        )
+                    digest.update(chunk)
+                    buf += chunk
+                    if len(buf) >= _WRITE_BUFFER_SIZE:
+                        await asyncio.to_thread(f.write, bytes(buf))
+                        buf.clear()
+                if buf:
+                    await asyncio.to_thread(f.write, bytes(buf))
+                await asyncio.to_thread(f.close)
+            except BaseException:
+                f.close()
+                tmp_path.unlink(missing_ok=True)
+                raise
+        
+        logger.info(f"Downloaded {total} bytes from {url[:50]}")
+        return digest.hexdigest(), total
     
     def _guess_extension(self, url: str, content_type: Optional[str] = None) -> str:
         """
@@ -242,9 +345,6 @@ class MediaDownloader:
         if cached:
             return cached
         
-        # 下载
-        url_hash = self._get_url_hash(url)
-        
         # 优先从filename_hint提取扩展名
         ext = ".bin"
         if filename_hint and "." in filename_hint:
@@ -257,9 +357,7 @@ class MediaDownloader:
         if ext == ".bin":
             ext = self._guess_extension(url)
         
-        save_path = self.images_dir / f"{url_hash}{ext}"
-        
-        return await self._download_file(url, save_path)
+        return await self._download_file(url, "image", ext)
     
     async def download_audio(self, url: str) -> Path:
         """
@@ -277,18 +375,17 @@ class MediaDownloader:
             return cached
         
         # 下载
-        url_hash = self._get_url_hash(url)
         ext = self._guess_extension(url)
-        save_path = self.audios_dir / f"{url_hash}{ext}"
-        
-        return await self._download_file(url, save_path)
+        return await self._download_file(url, "audio", ext)
     
-    async def download_video(self, url: str) -> Path:
+    async def download_video(self, url: str, max_bytes: Optional[int] = None, timeout: int = 60) -> Path:
         """
         下载视频
         
         Args:
             url: 视频 URL
+            max_bytes: 大小上限（超过时中途中断）
+            timeout: 超时时间（秒）
             
         Returns:
             Path: 下载后的文件路径
@@ -299,11 +396,8 @@ class MediaDownloader:
             return cached
         
         # 下载
-        url_hash = self._get_url_hash(url)
         ext = self._guess_extension(url)
-        save_path = self.videos_dir / f"{url_hash}{ext}"
-        
-        return await self._download_file(url, save_path)
+        return await self._download_file(url, "video", ext, timeout=timeout, max_bytes=max_bytes)
     
     def get_mime_type(self, file_path: Path) -> str:
         """
@@ -341,16 +435,11 @@ class MediaDownloader:
         
         return ext_map.get(ext, 'application/octet-stream')
     
-    def cleanup_old_files(self):
-        """清理过期的缓存文件"""
+    async def cleanup_old_files(self):
+        """清理过期/超出预算的缓存文件以及索引外的孤立文件（在事件循环中调度，索引不跨线程访问）"""
         logger.info("Cleaning up old cache files...")
         
-        total_removed = 0
-        for dir_path in [self.images_dir, self.audios_dir, self.videos_dir]:
-            for file_path in dir_path.iterdir():
-                if file_path.is_file() and self._is_expired(file_path):
-                    file_path.unlink()
-                    total_removed += 1
+        total_removed = await self.cache.cleanup()
         
         logger.info(f"Removed {total_removed} expired files")
 
@@ -0,0 +1,222 @@
+"""
+多模态媒体处理流水线
+并发下载、转码、编码图片/语音，产出可直接放进一次 OpenAI-compatible 请求的 content parts
+"""
+import os
+import time
+import base64
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from nonebot.log import logger
+
+from src.utils.media_downloader import media_downloader
+from src.utils.video_frames import video_frames
+
+@dataclass
+class MediaResult:
+    """单个附件的处理结果"""
+    kind: str  # image / audio / video
+    index: int
+    part: Optional[Dict[str, Any]] = None
+    extra_parts: List[Dict[str, Any]] = field(default_factory=list)  # video: one part per frame
+    error: Optional[str] = None
+    phash: Optional[int] = None  # images only: dHash of the prepared image
+    timings: Dict[str, float] = field(default_factory=dict)  # stage -> seconds
+
+
+@dataclass
+class MediaBatch:
+    """一条消息所有附件的处理结果（保持原消息中的顺序）"""
+    results: List[MediaResult] = field(default_factory=list)
+    wall_sec: float = 0.0
+
+    @property
+    def parts(self) -> List[Dict[str, Any]]:
+        parts = []
+        for r in self.results:
+            if r.part is not None:
+                parts.append(r.part)
+                parts.extend(r.extra_parts)
+        return parts
+
+    @property
+    def image_hashes(self) -> List[int]:
+        """每张成功处理的图片的 dHash（按消息中的顺序）"""
+        return [r.phash for r in self.results if r.kind == "image" and r.part is not None and r.phash is not None]
+
+    @property
+    def errors(self) -> List[MediaResult]:
+        return [r for r in self.results if r.error]
+
+    def stage_totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for r in self.results:
+            for stage, sec in r.timings.items():
+                totals[stage] = totals.get(stage, 0.0) + sec
+        return totals
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in self.stage_totals().items())
+        return (
+            f"{len(self.parts)}/{len(self.results)} parts in {self.wall_sec * 1000:.0f}ms"
+            + (f" (sum of stages: {stages})" if stages else "")
+        )
+
+
+class MediaPipeline:
+    """多模态附件处理：每个附件独立走 下载 → 转码 → 编码，附件之间并发（有上限）"""
+
+    def __init__(self):
+        self.max_parallel = int(os.getenv("MEDIA_PIPELINE_CONCURRENCY", "4"))
+        self.max_images = int(os.getenv("MAX_IMAGE_COUNT", "3"))
+        self.max_audios = int(os.getenv("MAX_AUDIO_COUNT", "1"))
+        self.max_videos = int(os.getenv("MAX_VIDEO_COUNT", "1"))
+        self.max_px = int(os.getenv("IMAGE_MAX_PX", "1024"))
+        self.quality = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+        self._sem: Optional[asyncio.Semaphore] = None
+
+        logger.info(
+            f"MediaPipeline initialized: concurrency={self.max_parallel}, "
+            f"max_images={self.max_images}, max_audios={self.max_audios}, "
+            f"video_mode={video_frames.mode}"
+        )
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # created lazily so it binds to the running loop
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(max(1, self.max_parallel))
+        return self._sem
+
+    async def process(self, parsed) -> MediaBatch:
+        """
+        处理一条消息中的所有附件
+
+        Args:
+            parsed: message_parser 解析出的 ParsedMessage
+
+        Returns:
+            MediaBatch: 每个附件的 content part / 错误 / 各阶段耗时
+        """
+        jobs = []
+        for idx, img in enumerate((parsed.images or [])[:self.max_images]):
+            jobs.append(self._run("image", idx, self._image, img))
+        for idx, audio in enumerate((parsed.audios or [])[:self.max_audios]):
+            jobs.append(self._run("audio", idx, self._audio, audio))
+        for idx, video in enumerate((parsed.videos or [])[:self.max_videos]):
+            if video_frames.enabled:
+                jobs.append(self._run("video", idx, self._video, video))
+            else:
+                jobs.append(self._unsupported("video", idx))
+
+        t0 = time.monotonic()
+        results = await asyncio.gather(*jobs)
+        batch = MediaBatch(results=list(results), wall_sec=time.monotonic() - t0)
+
+        logger.info(f"Media pipeline: {batch.summary()}")
+        for r in batch.errors:
+            logger.warning(f"Media pipeline: {r.kind} #{r.index + 1} skipped: {r.error}")
+        return batch
+
+    async def _run(self, kind: str, index: int, handler, segment) -> MediaResult:
+        result = MediaResult(kind=kind, index=index)
+        if not getattr(segment, "url", None):
+            result.error = "no url"
+            return result
+        async with self._semaphore():
+            try:
+                result.part = await handler(segment, result)
+            except Exception as e:
+                result.error = f"{type(e).__name__}: {e}"
+        return result
+
+    async def _unsupported(self, kind: str, index: int) -> MediaResult:
+        return MediaResult(kind=kind, index=index, error="unsupported")
+
+    async def _image(self, img, result: MediaResult) -> Dict[str, Any]:
+        from src.utils.image_utils import prepare_image_async
+
+        timings = result.timings
+        t = time.monotonic()
+        file_path = await media_downloader.download_image(img.url, filename_hint=img.file)
+        timings["download"] = time.monotonic() - t
+
+        # single decode (draft mode) + resize + JPEG encode in the image worker pool;
+        # plus the dHash for the vision answer cache; results are cached by (content hash, max_px, quality)
+        t = time.monotonic()
+        prepared = await prepare_image_async(
+            file_path,
+            max_px=self.max_px,
+            quality=self.quality,
+            content_hash=media_downloader.get_content_hash(img.url),
+        )
+        timings["encode"] = time.monotonic() - t
+
+        result.phash = prepared.dhash
+        return {"type": "image_url", "image_url": {"url": prepared.data_url}}
+
+    async def _audio(self, audio, result: MediaResult) -> Dict[str, Any]:
+        from src.utils.audio_converter import audio_converter
+
+        timings = result.timings
+        t = time.monotonic()
+        file_path = await media_downloader.download_audio(audio.url)
+        timings["download"] = time.monotonic() - t
+
+        # QQ voice is amr/silk; backends only accept mp3/wav. ffmpeg runs as an async
+        # subprocess (piped, speech profile by default); results are cached by content hash
+        t = time.monotonic()
+        converted = await audio_converter.convert(
+            file_path, content_hash=media_downloader.get_content_hash(audio.url)
+        )
+        timings["transcode"] = time.monotonic() - t
+
+        t = time.monotonic()
+        b64 = base64.b64encode(converted.data).decode("ascii")
+        timings["encode"] = time.monotonic() - t
+
+        return {"type": "input_audio", "input_audio": {"data": b64, "format": converted.format}}
+
+    async def _video(self, video, result: MediaResult) -> Dict[str, Any]:
+        from src.utils.image_utils import to_data_url
+
+        timings = result.timings
+        t = time.monotonic()
+        # probe the remote container header while the download streams, so an over-long
+        # video is rejected before the transfer finishes; size is capped mid-stream
+        download = asyncio.ensure_future(media_downloader.download_video(
+            video.url, max_bytes=video_frames.max_size_mb * 1024 * 1024
+        ))
+        try:
+            duration = None
+            if media_downloader.get_content_hash(video.url) is None:
+                duration = await video_frames.probe_duration(
+                    media_downloader.resolve_url(video.url), headers=media_downloader.request_headers()
+                )
+                video_frames.check_duration(duration)
+            file_path = await download
+        except BaseException:
+            download.cancel()
+            raise
+        timings["download"] = time.monotonic() - t
+
+        t = time.monotonic()
+        extracted = await video_frames.extract(file_path, duration)
+        timings["transcode"] = time.monotonic() - t
+
+        t = time.monotonic()
+        result.extra_parts = [
+            {"type": "image_url", "image_url": {"url": to_data_url(jpeg)}} for jpeg in extracted.images
+        ]
+        timings["encode"] = time.monotonic() - t
+
+        desc = f"[视频：时长约 {extracted.duration:.0f} 秒" if extracted.duration else "[视频"
+        desc += f"，以下是 {len(extracted.frames)} 张场景关键帧"
+        if extracted.sheet:
+            desc += f"和 1 张按时间顺序的 {video_frames.sheet_cols}x{video_frames.sheet_rows} 缩略拼图"
+        return {"type": "text", "text": desc + "]"}
+
+
+# 全局单例
+media_pipeline = MediaPipeline()
@@ -1,12 +1,21 @@
 """
 消息转发工具模块
 提供长文本消息的合并转发功能，避免群聊刷屏
+
+所有主动发送都经过 OutboundDispatcher：按目标（群/私聊）和全局令牌桶限速、回复优先于推送、
+失败有限次退避重试、合并转发失败降级为普通消息
 """
-from typing import List, Dict, Any, Union
-from nonebot.adapters.onebot.v11 import Bot, GroupMessageEvent, PrivateMessageEvent, MessageEvent
+from typing import List, Dict, Any, Deque, Iterable, Optional, Set, Tuple, Union
+from collections import deque
+from dataclasses import dataclass, field
+from nonebot.adapters.onebot.v11 import Bot, GroupMessageEvent, PrivateMessageEvent, MessageEvent, Message, MessageSegment
+from nonebot.adapters.onebot.v11.exception import ActionFailed, ApiNotAvailable
 from nonebot.log import logger
 import os
 import re
+import time
+import asyncio
+import itertools
 
 
 _CODE_FENCE = re.compile(r"```[\s\S]*?```", re.MULTILINE)
@@ -97,26 +106,565 @@ def create_forward_nodes(
     return nodes
 
 
+# 优先级：数值越小越先发送
+PRIORITY_REPLY = 0  # 对用户消息的回复
+PRIORITY_PUSH = 1  # 定时推送 / 订阅 / 提醒
+
+
+class OutboundQueueFull(RuntimeError):
+    """发送队列已满"""
+
+
+class TokenBucket:
+    """令牌桶：rate 个/秒，最多积攒 burst 个"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: Optional[float] = None) -> float:
+        """距离下一个令牌可用还要等多久（秒）"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(time.monotonic() if now is None else now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+
+
+@dataclass
+class OutboundJob:
+    """一次待发送的消息"""
+    bot: Bot
+    target_type: str  # group / private
+    target_id: int
+    priority: int
+    seq: int
+    message: Union[str, Message]  # plain text or segments (also the fallback when a forward fails)
+    nodes: Optional[List[Dict[str, Any]]] = None  # forward nodes, None = plain send
+    future: Optional[asyncio.Future] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    not_before: float = 0.0  # pushes wait until here so later pushes to the same target can be merged
+    merged: List["OutboundJob"] = field(default_factory=list)  # jobs coalesced into this one
+
+    @property
+    def target_key(self) -> str:
+        return f"{self.target_type}:{self.target_id}"
+
+
+class OutboundDispatcher:
+    """
+    统一发送队列
+
+    每个目标一条 FIFO 通道（同一目标的消息保持顺序、同一时间只发一条），调度器在令牌可用的通道中
+    选优先级最高、入队最早的一条发送；某个群被限速时不会阻塞其他群
+    """
+
+    def __init__(self):
+        self.global_rate = float(os.getenv("OUTBOUND_GLOBAL_RATE", "5"))
+        self.global_burst = float(os.getenv("OUTBOUND_GLOBAL_BURST", "5"))
+        self.target_rate = float(os.getenv("OUTBOUND_TARGET_RATE", "0.5"))
+        self.target_burst = float(os.getenv("OUTBOUND_TARGET_BURST", "3"))
+        self.max_retries = int(os.getenv("OUTBOUND_MAX_RETRIES", "2"))
+        # ActionFailed retcodes meaning the protocol side rejected the send (nothing reached QQ)
+        self.retry_retcodes = {
+            int(c) for c in os.getenv("OUTBOUND_RETRY_RETCODES", "100,200").split(",") if c.strip()
+        }
+        self.retry_base_sec = float(os.getenv("OUTBOUND_RETRY_BASE_SEC", "1.0"))
+        self.max_queue = int(os.getenv("OUTBOUND_QUEUE_MAX", "1000"))
+        # pushes to one target within this window go out as a single forward message (0 = off)
+        self.coalesce_window = float(os.getenv("OUTBOUND_COALESCE_WINDOW_SEC", "3"))
+        self.coalesce_max_nodes = int(os.getenv("OUTBOUND_COALESCE_MAX_NODES", "50"))
+
+        self._global = TokenBucket(self.global_rate, self.global_burst)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lanes: Dict[str, Deque[OutboundJob]] = {}
+        self._busy: Set[str] = set()
+        self._last_push: Dict[str, float] = {}  # target -> when the last push was queued
+        self._current: Optional[OutboundJob] = None  # job being scheduled by _run
+        self._seq = itertools.count()
+        self._queued = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # metrics
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.fallbacks = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self._queue_wait: Deque[float] = deque(maxlen=500)
+        self._send_latency: Deque[float] = deque(maxlen=500)
+
+    def _ensure_running(self):
+        # created lazily so they bind to the running loop
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止调度（bot 关闭时调用），未发送的消息以取消结束"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for lane in self._lanes.values():
+            for job in lane:
+                if job.future is not None and not job.future.done():
+                    job.future.cancel()
+        self._lanes.clear()
+        self._queued = 0
+
+    async def send(
+        self,
+        bot: Bot,
+        target_type: str,
+        target_id: Union[int, str],
+        message: Union[str, Message],
+        nodes: Optional[List[Dict[str, Any]]] = None,
+        priority: int = PRIORITY_PUSH,
+        wait: bool = True,
+    ) -> Any:
+        """
+        排队发送一条消息
+
+        Args:
+            bot: Bot 实例
+            target_type: group / private
+            target_id: 群号或 QQ 号
+            message: 文本（合并转发失败时的降级内容）
+            nodes: 合并转发节点（不传则普通发送）
+            priority: PRIORITY_REPLY / PRIORITY_PUSH
+            wait: 是否等待发送完成（失败时抛出最后一次的异常）
+
+        Raises:
+            OutboundQueueFull: 队列已满
+        """
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise OutboundQueueFull(f"outbound queue full ({self._queued})")
+
+        self._ensure_running()
+        job = OutboundJob(
+            bot=bot,
+            target_type=target_type,
+            target_id=int(target_id),
+            priority=priority,
+            seq=next(self._seq),
+            message=message,
+            nodes=nodes,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        if priority != PRIORITY_REPLY and self.coalesce_window > 0:
+            job.not_before = self._hold_until(job)
+        self._lanes.setdefault(job.target_key, deque()).append(job)
+        self._queued += 1
+        self.max_depth = max(self.max_depth, self._queued)
+        self._wakeup.set()
+
+        if not wait:
+            # nobody awaits it: keep failures from being reported as "never retrieved"
+            job.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            return None
+        return await job.future
+
+    def _hold_until(self, job: OutboundJob) -> float:
+        """
+        推送的最早发送时间：该目标最近 coalesce_window 内没有其他推送时立即发送；
+        否则等到窗口结束，让这一波推送合并成一条（排在同一通道里的推送发送时会一起合并）
+        """
+        key = job.target_key
+        now = job.enqueued_at
+        last = self._last_push.get(key)
+        self._last_push[key] = now
+        if len(self._last_push) > 1024:
+            cutoff = now - self.coalesce_window
+            self._last_push = {k: t for k, t in self._last_push.items() if t > cutoff}
+        if last is not None and now - last < self.coalesce_window:
+            return now + self.coalesce_window
+        return 0.0
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.target_rate, self.target_burst)
+        return bucket
+
+    def _pick(self) -> Tuple[Optional[OutboundJob], Optional[float]]:
+        """选出下一条可发送的消息；都在限速中时返回需要等待的时间"""
+        now = time.monotonic()
+        best: Optional[OutboundJob] = None
+        min_wait: Optional[float] = None
+        for key, lane in self._lanes.items():
+            if not lane or key in self._busy:
+                continue
+            head = lane[0]
+            wait = self._bucket(key).wait_time(now)
+            if head.not_before > now and not any(j.priority == PRIORITY_REPLY for j in lane):
+                # hold a push for the coalescing window (released early if a reply queues behind it)
+                wait = max(wait, head.not_before - now)
+            if wait > 0:
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+            elif best is None or (head.priority, head.seq) < (best.priority, best.seq):
+                best = head
+        return best, min_wait
+
+    async def _run(self):
+        while True:
+            try:
+                await self._step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # one bad job must not stop the whole queue: fail it and keep scheduling
+                job, self._current = self._current, None
+                logger.exception(f"Outbound scheduler error: {e}")
+                if job is not None:
+                    self._discard(job)
+                    self._resolve(job, error=e)
+                await asyncio.sleep(0)
+
+    def _discard(self, job: OutboundJob):
+        """把出错的消息从通道中移除（若还在队列里）"""
+        lane = self._lanes.get(job.target_key)
+        if lane is not None and job in lane:
+            lane.remove(job)
+            self._queued -= 1
+        if lane is not None and not lane:
+            del self._lanes[job.target_key]
+
+    async def _step(self):
+        job, wait = self._pick()
+        if job is None:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        global_wait = self._global.wait_time()
+        if global_wait > 0:
+            # re-pick afterwards: a reply may have arrived meanwhile
+            await asyncio.sleep(global_wait)
+            return
+
+        self._current = job
+        lane = self._lanes[job.target_key]
+        lane.popleft()
+        self._queued -= 1
+        if job.priority != PRIORITY_REPLY and self.coalesce_window > 0:
+            self._current = job = self._coalesce(job, lane)
+        if not lane:
+            del self._lanes[job.target_key]
+        self._current = None
+        if job.future.cancelled():
+            return  # the caller gave up waiting before it was sent
+
+        self._global.take()
+        self._bucket(job.target_key).take()
+        self._busy.add(job.target_key)
+        self._queue_wait.append(time.monotonic() - job.enqueued_at)
+        asyncio.create_task(self._deliver(job))
+
+    def _coalesce(self, head: OutboundJob, lane: Deque[OutboundJob]) -> OutboundJob:
+        """把通道中紧跟在 head 后面的推送合并成一条多节点合并转发"""
+        if not isinstance(head.message, str):
+            return head  # segment messages (e.g. with a reply) are sent as they are
+        jobs = [head] if not head.future.cancelled() else []
+        nodes = len(head.nodes) if head.nodes else 1
+        while (
+            lane
+            and lane[0].priority != PRIORITY_REPLY
+            and lane[0].bot is head.bot
+            and isinstance(lane[0].message, str)
+        ):
+            nxt = lane[0]
+            size = len(nxt.nodes) if nxt.nodes else 1
+            if jobs and nodes + size > self.coalesce_max_nodes:
+                break
+            lane.popleft()
+            self._queued -= 1
+            if not nxt.future.cancelled():
+                jobs.append(nxt)
+                nodes += size
+        if len(jobs) <= 1:
+            return jobs[0] if jobs else head
+
+        bot_uin = str(head.bot.self_id)
+        bot_name = os.getenv("BOT_NICKNAME", "AI 助手")
+        merged_nodes: List[Dict[str, Any]] = []
+        for j in jobs:
+            merged_nodes.extend(j.nodes or create_forward_nodes([j.message], bot_uin, bot_name))
+        first = jobs[0]
+        self.coalesced += len(jobs) - 1
+        logger.info(f"Coalesced {len(jobs)} pushes to {first.target_key} into one forward message")
+        return OutboundJob(
+            bot=first.bot,
+            target_type=first.target_type,
+            target_id=first.target_id,
+            priority=first.priority,
+            seq=first.seq,
+            message="\n\n".join(j.message for j in jobs),
+            nodes=merged_nodes,
+            future=first.future,
+            enqueued_at=first.enqueued_at,
+            merged=jobs[1:],
+        )
+
+    @staticmethod
+    def _resolve(job: OutboundJob, result: Any = None, error: Optional[BaseException] = None):
+        for j in [job, *job.merged]:
+            if j.future is None or j.future.done():
+                continue
+            if error is not None:
+                j.future.set_exception(error)
+            else:
+                j.future.set_result(result)
+
+    async def _call(self, job: OutboundJob, forward: bool) -> Any:
+        if forward:
+            api = "send_group_forward_msg" if job.target_type == "group" else "send_private_forward_msg"
+            id_field = "group_id" if job.target_type == "group" else "user_id"
+            return await job.bot.call_api(api, **{id_field: job.target_id, "messages": job.nodes})
+        if job.target_type == "group":
+            return await job.bot.send_group_msg(group_id=job.target_id, message=job.message)
+        return await job.bot.send_private_msg(user_id=job.target_id, message=job.message)
+
+    def nothing_sent(self, e: Exception) -> bool:
+        """
+        该错误是否保证消息没有发出（只有这种情况才能重试/降级重发）
+
+        队列已满、协议端明确拒绝（retcode 在 OUTBOUND_RETRY_RETCODES 中）或 bot 未连接时才算；
+        超时、网络错误等结果未知的情况一律不重发，宁可丢一条也不重复刷屏
+        """
+        if isinstance(e, (OutboundQueueFull, ApiNotAvailable)):
+            return True
+        if not isinstance(e, ActionFailed):
+            return False
+        info = e.info
+        text = f"{info.get('message', '')} {info.get('wording', '')} {info.get('msg', '')}".lower()
+        if "timeout" in text or "超时" in text:
+            return False
+        try:
+            return int(info.get("retcode")) in self.retry_retcodes
+        except (TypeError, ValueError):
+            return False
+
+    async def _deliver(self, job: OutboundJob):
+        forward = job.nodes is not None
+        t0 = time.monotonic()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = await self._call(job, forward)
+                    self.sent += 1
+                    self._send_latency.append(time.monotonic() - t0)
+                    self._resolve(job, result)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if not self.nothing_sent(e):
+                        raise  # may already be delivered: resending could duplicate it
+                    if forward:
+                        # forward rejected (often risk control): plain send right away, no backoff
+                        logger.warning(f"Forward to {job.target_key} failed ({e}), falling back to plain message")
+                        self.fallbacks += 1
+                        forward = False
+                        continue
+                    if attempt >= self.max_retries:
+                        raise
+                    self.retries += 1
+                    delay = self.retry_base_sec * (2 ** attempt)
+                    logger.warning(f"Send to {job.target_key} failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Failed to send to {job.target_key}: {e}")
+            self._resolve(job, error=e)
+        finally:
+            self._busy.discard(job.target_key)
+            self._wakeup.set()
+
+    @staticmethod
+    def _percentiles(values: Deque[float]) -> Dict[str, float]:
+        if not values:
+            return {"p50_ms": 0.0, "p95_ms": 0.0}
+        ordered = sorted(values)
+        pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return {"p50_ms": round(pick(0.5) * 1000, 1), "p95_ms": round(pick(0.95) * 1000, 1)}
+
+    def stats(self) -> Dict[str, Any]:
+        depth_by_priority: Dict[str, int] = {}
+        for lane in self._lanes.values():
+            for job in lane:
+                name = "reply" if job.priority == PRIORITY_REPLY else "push"
+                depth_by_priority[name] = depth_by_priority.get(name, 0) + 1
+        return {
+            "queued": self._queued,
+            "queued_by_priority": depth_by_priority,
+            "max_depth": self.max_depth,
+            "targets_waiting": len(self._lanes),
+            "in_flight": len(self._busy),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+            "rejected": self.rejected,
+            "coalesced": self.coalesced,
+            "queue_wait": self._percentiles(self._queue_wait),
+            "send_latency": self._percentiles(self._send_latency),
+        }
+
+
+# 全局单例
+outbound = OutboundDispatcher()
+
+
+@dataclass(frozen=True)
+class RenderedMessage:
+    """渲染好的推送内容，可原样发给任意多个目标"""
+    text: str
+    nodes: Optional[List[Dict[str, Any]]] = None  # forward nodes, None = plain send
+
+
+def render_message(bot: Bot, text: str, threshold: Optional[int] = None) -> RenderedMessage:
+    """
+    按阈值决定普通发送还是合并转发，并构建转发节点
+
+    Args:
+        bot: Bot 实例（节点里的 uin）
+        text: 消息内容
+        threshold: 合并转发阈值（默认 FORWARD_THRESHOLD）
+    """
+    if threshold is None:
+        threshold = int(os.getenv("FORWARD_THRESHOLD", "100"))
+    if len(text) <= threshold:
+        return RenderedMessage(text)
+    bot_name = os.getenv("BOT_NICKNAME", "AI 助手")
+    return RenderedMessage(text, create_forward_nodes(split_text_into_paragraphs(text), str(bot.self_id), bot_name))
+
+
+async def push_text(
+    bot: Bot,
+    target_type: str,
+    target_id: Union[int, str],
+    text: Union[str, RenderedMessage],
+    threshold: Optional[int] = None,
+    priority: int = PRIORITY_PUSH,
+    wait: bool = True,
+) -> None:
+    """
+    主动推送文本：超过阈值时按段落合并转发（失败自动降级为普通消息）
+
+    Args:
+        bot: Bot 实例
+        target_type: group / private
+        target_id: 群号或 QQ 号
+        text: 消息内容，或 render_message 的结果
+        threshold: 合并转发阈值（默认 FORWARD_THRESHOLD）
+        priority: 发送优先级
+        wait: 是否等待发送完成
+    """
+    rendered = text if isinstance(text, RenderedMessage) else render_message(bot, text, threshold)
+    await outbound.send(
+        bot, target_type, target_id, rendered.text, nodes=rendered.nodes, priority=priority, wait=wait
+    )
+
+
+async def broadcast(
+    bot: Bot,
+    targets: Iterable[Tuple[str, Union[int, str]]],
+    text: str,
+    threshold: Optional[int] = None,
+    concurrency: int = 8,
+    priority: int = PRIORITY_PUSH,
+) -> Dict[str, int]:
+    """
+    同一条消息推送给多个目标：只渲染一次，最多 concurrency 个目标同时在发送队列中
+
+    各目标的限速由发送队列负责，这里的并发上限只避免一次性占满队列
+
+    Args:
+        bot: Bot 实例
+        targets: [(target_type, target_id), ...]
+        text: 消息内容
+        threshold: 合并转发阈值（默认 FORWARD_THRESHOLD）
+        concurrency: 同时进行的发送数
+        priority: 发送优先级
+
+    Returns:
+        Dict[str, int]: {"sent": 成功数, "failed": 失败数}
+    """
+    rendered = render_message(bot, text, threshold)
+    sem = asyncio.Semaphore(max(1, concurrency))
+    counts = {"sent": 0, "failed": 0}
+
+    async def one(target_type: str, target_id: Union[int, str]):
+        async with sem:
+            try:
+                await push_text(bot, target_type, target_id, rendered, priority=priority)
+                counts["sent"] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                logger.error(f"Failed to push to {target_type} {target_id}: {e}")
+
+    await asyncio.gather(*(one(t, i) for t, i in targets))
+    return counts
+
+
+def _with_reply(text: str, reply_to: Optional[int]) -> Union[str, Message]:
+    """需要引用时在文本前加 reply 消息段"""
+    if reply_to is None:
+        return text
+    return MessageSegment.reply(reply_to) + text
+
+
 async def send_message_smart(
     bot: Bot,
     message: str,
     event: MessageEvent,
-    threshold: int = 100
+    threshold: int = 100,
+    reply_to: Optional[int] = None
 ) -> None:
     """
     智能发送消息：根据消息长度选择普通发送或合并转发
-    同时支持群聊和私聊的合并转发功能
+    同时支持群聊和私聊的合并转发功能（以回复优先级进入发送队列）
     
     Args:
         bot: Bot 实例
         message: 要发送的消息内容
         event: 消息事件对象
         threshold: 触发合并转发的字符数阈值
+        reply_to: 引用回复的消息 ID（仅普通发送生效，合并转发无法引用）
     """
     # 计算消息长度（去除首尾空白）
     message = message.strip()
     message_length = len(message)
     
+    if isinstance(event, GroupMessageEvent):
+        target_type, target_id = "group", event.group_id
+    else:
+        target_type, target_id = "private", event.user_id
+    
     # 获取 Bot 配置
     bot_uin = str(bot.self_id)
     bot_name = os.getenv("BOT_NICKNAME", "AI 助手")    # Code-aware behavior: keep code blocks as normal message ONLY when it does not violate forward threshold
@@ -130,26 +678,16 @@ async def send_message_smart(
         logger.info(f"Message length {message_length} <= threshold {threshold}, sending normally")
 
         # If code-heavy and allowed, try to keep as one message (still bounded by platform normal limit)
-        if disable_forward_for_code and _is_code_heavy(message):
-            if message_length <= max_normal_len:
-                if isinstance(event, GroupMessageEvent):
-                    await bot.send_group_msg(group_id=event.group_id, message=message)
-                else:
-                    await bot.send_private_msg(user_id=event.user_id, message=message)
-                return
-            # chunked normal send (still under threshold, so should rarely happen)
+        if disable_forward_for_code and _is_code_heavy(message) and message_length > max_normal_len:
+            # chunked normal send (still under threshold, so should rarely happen);
+            # chunks share one queue lane, so they arrive in order
             chunks = [message[i:i+max_normal_len] for i in range(0, message_length, max_normal_len)]
             for idx, ch in enumerate(chunks):
                 prefix = "" if len(chunks) == 1 else f"({idx+1}/{len(chunks)})\n"
-                if isinstance(event, GroupMessageEvent):
-                    await bot.send_group_msg(group_id=event.group_id, message=prefix + ch)
-                else:
-                    await bot.send_private_msg(user_id=event.user_id, message=prefix + ch)
+                content = _with_reply(prefix + ch, reply_to if idx == 0 else None)
+                await outbound.send(bot, target_type, target_id, content, priority=PRIORITY_REPLY)
             return
-        if isinstance(event, GroupMessageEvent):
-            await bot.send_group_msg(group_id=event.group_id, message=message)
-        else:
-            await bot.send_private_msg(user_id=event.user_id, message=message)
+        await outbound.send(bot, target_type, target_id, _with_reply(message, reply_to), priority=PRIORITY_REPLY)
     else:
         # 消息超过阈值，使用合并转发
         logger.info(f"Message length {message_length} > threshold {threshold}, using forward message")
@@ -162,37 +700,9 @@ async def send_message_smart(
             chunks = [message[i:i+forward_node_max_len] for i in range(0, message_length, forward_node_max_len)]
             nodes = create_forward_nodes(chunks, bot_uin, bot_name)
         
-        # 根据场景选择接口
-        if isinstance(event, GroupMessageEvent):
-            # 群聊合并转发
-            logger.info(f"Sending {len(nodes)} forward nodes to group {event.group_id}")
-            try:
-                await bot.call_api(
-                    "send_group_forward_msg",
-                    group_id=event.group_id,
-                    messages=nodes
-                )
-                logger.info("Group forward message sent successfully")
-            except Exception as e:
-                logger.error(f"Failed to send group forward message: {e}")
-                logger.warning("Falling back to normal group message sending (possible anti-spam)")
-                # 降级为普通发送（风控兜底）
-                await bot.send_group_msg(group_id=event.group_id, message=message)
-        else:
-            # 私聊合并转发
-            logger.info(f"Sending {len(nodes)} forward nodes to user {event.user_id}")
-            try:
-                await bot.call_api(
-                    "send_private_forward_msg",
-                    user_id=event.user_id,
-                    messages=nodes
-                )
-                logger.info("Private forward message sent successfully")
-            except Exception as e:
-                logger.error(f"Failed to send private forward message: {e}")
-                logger.warning("Falling back to normal private message sending (possible anti-spam)")
-                # 降级为普通发送（风控兜底）
-                await bot.send_private_msg(user_id=event.user_id, message=message)
+        # 合并转发失败时由发送队列降级为普通发送（风控兜底）
+        logger.info(f"Sending {len(nodes)} forward nodes to {target_type} {target_id}")
+        await outbound.send(bot, target_type, target_id, message, nodes=nodes, priority=PRIORITY_REPLY)
 
 
 async def send_group_forward_message(
@@ -202,7 +712,7 @@ async def send_group_forward_message(
     bot_name: str = "AI 助手"
 ) -> None:
     """
-    直接发送群组合并转发消息
+    直接发送群组合并转发消息（推送优先级，失败时降级为普通消息）
     
     Args:
         bot: Bot 实例
@@ -214,11 +724,7 @@ async def send_group_forward_message(
     nodes = create_forward_nodes(paragraphs, bot_uin, bot_name)
     
     try:
-        await bot.call_api(
-            "send_group_forward_msg",
-            group_id=group_id,
-            messages=nodes
-        )
+        await outbound.send(bot, "group", group_id, "\n\n".join(paragraphs), nodes=nodes)
         logger.info(f"Forward message with {len(nodes)} nodes sent to group {group_id}")
     except Exception as e:
         logger.error(f"Failed to send forward message to group {group_id}: {e}")
@@ -232,7 +738,7 @@ async def send_private_forward_message(
     bot_name: str = "AI 助手"
 ) -> None:
     """
-    直接发送私聊合并转发消息
+    直接发送私聊合并转发消息（推送优先级，失败时降级为普通消息）
     
     Args:
         bot: Bot 实例
@@ -244,11 +750,7 @@ async def send_private_forward_message(
     nodes = create_forward_nodes(paragraphs, bot_uin, bot_name)
     
     try:
-        await bot.call_api(
-            "send_private_forward_msg",
-            user_id=user_id,
-            messages=nodes
-        )
+        await outbound.send(bot, "private", user_id, "\n\n".join(paragraphs), nodes=nodes)
         logger.info(f"Forward message with {len(nodes)} nodes sent to user {user_id}")
     except Exception as e:
         logger.error(f"Failed to send forward message to user {user_id}: {e}")
@@ -0,0 +1,144 @@
+"""
+消息接入（ingest）
+每条消息只解析一次成 ParsedMessage，再并发分发给注册的消费者（发言统计、群消息存档、
+最近图片索引...），并记录每个消费者的耗时。聊天处理器通过 parse() 复用同一份解析结果
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from nonebot.adapters.onebot.v11 import GroupMessageEvent, MessageEvent
+from nonebot.log import logger
+
+from src.utils.message_parser import ParsedMessage, message_parser
+
+Consumer = Callable[[MessageEvent, ParsedMessage], Awaitable[None]]
+
+# 同一事件在各 matcher 之间共享解析结果，只需容纳“正在处理中”的事件
+_PARSE_CACHE_MAX = 256
+
+
+@dataclass
+class _Registration:
+    name: str
+    handler: Consumer
+    group_only: bool
+
+
+@dataclass
+class ConsumerStats:
+    calls: int = 0
+    errors: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    def observe(self, elapsed_ms: float, ok: bool):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if not ok:
+            self.errors += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+@dataclass
+class _Counters:
+    events: int = 0
+    parses: int = 0
+    parse_reuses: int = 0
+    parse_ms: float = 0.0
+    consumers: Dict[str, ConsumerStats] = field(default_factory=dict)
+
+
+class MessageIngest:
+    """单次解析 + 多消费者分发"""
+
+    def __init__(self):
+        self._registrations: List[_Registration] = []
+        self._parsed: "OrderedDict[Tuple[int, int], ParsedMessage]" = OrderedDict()
+        self._counters = _Counters()
+
+    def register(self, name: str, handler: Consumer, group_only: bool = True):
+        """
+        注册消费者（插件导入时调用）
+
+        Args:
+            name: 消费者名称（用于统计，重复注册同名消费者会替换旧的）
+            handler: async (event, parsed) -> None，不应修改 parsed
+            group_only: 只接收群消息
+        """
+        self._registrations = [r for r in self._registrations if r.name != name]
+        self._registrations.append(_Registration(name, handler, group_only))
+        self._counters.consumers.setdefault(name, ConsumerStats())
+
+    @property
+    def consumers(self) -> List[str]:
+        return [r.name for r in self._registrations]
+
+    def parse(self, event: MessageEvent) -> ParsedMessage:
+        """解析事件；同一事件重复调用时直接返回已有结果"""
+        key = (id(event), getattr(event, "message_id", 0))
+        parsed = self._parsed.get(key)
+        if parsed is not None:
+            self._counters.parse_reuses += 1
+            return parsed
+
+        start = time.perf_counter()
+        parsed = message_parser.parse_message(event)
+        self._counters.parse_ms += (time.perf_counter() - start) * 1000
+        self._counters.parses += 1
+
+        self._parsed[key] = parsed
+        while len(self._parsed) > _PARSE_CACHE_MAX:
+            self._parsed.popitem(last=False)
+        return parsed
+
+    async def dispatch(self, event: MessageEvent):
+        """解析一次并并发调用所有适用的消费者，单个消费者出错不影响其他消费者"""
+        self._counters.events += 1
+        is_group = isinstance(event, GroupMessageEvent)
+        targets = [r for r in self._registrations if is_group or not r.group_only]
+        if not targets:
+            return
+
+        try:
+            parsed = self.parse(event)
+        except Exception as e:
+            logger.error(f"Message ingest parse failed: {e}")
+            return
+
+        await asyncio.gather(*(self._run(r, event, parsed) for r in targets))
+
+    async def _run(self, registration: _Registration, event: MessageEvent, parsed: ParsedMessage):
+        start = time.perf_counter()
+        ok = True
+        try:
+            await registration.handler(event, parsed)
+        except Exception as e:
+            ok = False
+            logger.error(f"Message consumer '{registration.name}' failed: {e}")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._counters.consumers.setdefault(registration.name, ConsumerStats()).observe(elapsed_ms, ok)
+
+    def stats(self) -> dict:
+        c = self._counters
+        return {
+            "events": c.events,
+            "parses": c.parses,
+            "parse_reuses": c.parse_reuses,
+            "avg_parse_ms": round(c.parse_ms / c.parses, 3) if c.parses else 0.0,
+            "consumers": {name: s.to_dict() for name, s in c.consumers.items()},
+        }
+
+
+# 全局单例
+message_ingest = MessageIngest()
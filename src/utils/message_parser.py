@@ -41,6 +41,7 @@ class ParsedMessage:
     videos: List[VideoSegment]
     has_media: bool
     raw_message: Message
+    plain_text: str = ""  # 仅 text 段拼接，与 event.get_plaintext() 一致
 
 
 class MessageParser:
@@ -48,7 +49,7 @@ class MessageParser:
     
     def parse_message(self, event: MessageEvent) -> ParsedMessage:
         """
-        解析消息事件，提取文本和多媒体内容
+        解析消息事件，提取文本和多媒体内容（一次遍历消息段）
         
         Args:
             event: OneBot 11 消息事件
@@ -58,12 +59,34 @@ class MessageParser:
         """
         message = event.message
         
-        # 提取各类内容
-        text = self.extract_text(message)
-        images = self.extract_images(message)
-        audios = self.extract_audios(message)
-        videos = self.extract_videos(message)
+        text_parts: List[str] = []
+        plain_parts: List[str] = []
+        images: List[ImageSegment] = []
+        audios: List[AudioSegment] = []
+        videos: List[VideoSegment] = []
         
+        for seg in message:
+            kind = seg.type
+            if kind == "image":
+                image = self._image_of(seg)
+                if image:
+                    images.append(image)
+            elif kind == "record":
+                audio = self._audio_of(seg)
+                if audio:
+                    audios.append(audio)
+            elif kind == "video":
+                video = self._video_of(seg)
+                if video:
+                    videos.append(video)
+            else:
+                part = self._text_of(seg)
+                if part is not None:
+                    text_parts.append(part)
+                if kind == "text":
+                    plain_parts.append(seg.data.get("text", ""))
+        
+        text = " ".join(text_parts).strip()
         has_media = bool(images or audios or videos)
         
         logger.info(
@@ -77,7 +100,8 @@ class MessageParser:
             audios=audios,
             videos=videos,
             has_media=has_media,
-            raw_message=message
+            raw_message=message,
+            plain_text="".join(plain_parts),
         )
     
     def extract_text(self, message: Message) -> str:
@@ -90,24 +114,7 @@ class MessageParser:
         Returns:
             str: 拼接后的文本内容
         """
-        text_parts = []
-        
-        for seg in message:
-            if seg.type == "text":
-                text_parts.append(seg.data.get("text", ""))
-            elif seg.type == "at":
-                # 保留 @ 提及（可选）
-                qq = seg.data.get("qq", "")
-                if qq != "all":
-                    text_parts.append(f"@{qq}")
-            elif seg.type == "face":
-                # QQ 系统表情
-                from src.utils.qq_face_map import get_face_description
-                face_id = seg.data.get("id", 0)
-                face_desc = get_face_description(face_id)
-                text_parts.append(f"[{face_desc}]")
-                logger.debug(f"Extracted face: {face_id} -> {face_desc}")
-        
+        text_parts = [part for part in map(self._text_of, message) if part is not None]
         return " ".join(text_parts).strip()
     
     def extract_images(self, message: Message) -> List[ImageSegment]:
@@ -120,28 +127,7 @@ class MessageParser:
         Returns:
             List[ImageSegment]: 图片列表
         """
-        images = []
-        
-        for seg in message:
-            if seg.type == "image":
-                data = seg.data
-                
-                # 优先使用 url，其次 file
-                url = data.get("url") or data.get("file")
-                file = data.get("file", "")
-                file_id = data.get("file_id")
-                subtype = data.get("subtype")
-                
-                if url:
-                    images.append(ImageSegment(
-                        url=url,
-                        file=file,
-                        file_id=file_id,
-                        subtype=subtype
-                    ))
-                    logger.debug(f"Extracted image: {url[:50]}...")
-        
-        return images
+        return [img for img in (self._image_of(seg) for seg in message if seg.type == "image") if img]
     
     def extract_audios(self, message: Message) -> List[AudioSegment]:
         """
@@ -153,30 +139,7 @@ class MessageParser:
         Returns:
             List[AudioSegment]: 语音列表
         """
-        audios = []
-        
-        for seg in message:
-            if seg.type == "record":
-                data = seg.data
-                
-                file = data.get("file", "")
-                url = data.get("url")
-                magic = data.get("magic")
-                
-                # 如果没有 url，尝试从 file 构造
-                if not url and file:
-                    # NapCatQQ 通常会提供完整URL或路径
-                    url = file if file.startswith("http") else None
-                
-                if file or url:
-                    audios.append(AudioSegment(
-                        file=file,
-                        url=url,
-                        magic=magic
-                    ))
-                    logger.debug(f"Extracted audio: {file}")
-        
-        return audios
+        return [a for a in (self._audio_of(seg) for seg in message if seg.type == "record") if a]
     
     def extract_videos(self, message: Message) -> List[VideoSegment]:
         """
@@ -188,27 +151,65 @@ class MessageParser:
         Returns:
             List[VideoSegment]: 视频列表
         """
-        videos = []
-        
-        for seg in message:
-            if seg.type == "video":
-                data = seg.data
-                
-                file = data.get("file", "")
-                url = data.get("url")
-                
-                # 如果没有 url，尝试从 file 构造
-                if not url and file:
-                    url = file if file.startswith("http") else None
-                
-                if file or url:
-                    videos.append(VideoSegment(
-                        file=file,
-                        url=url
-                    ))
-                    logger.debug(f"Extracted video: {file}")
-        
-        return videos
+        return [v for v in (self._video_of(seg) for seg in message if seg.type == "video") if v]
+    
+    # ---- 单个消息段的解析（parse_message 与 extract_* 共用） ----
+    
+    def _text_of(self, seg: MessageSegment) -> Optional[str]:
+        """文本类消息段转成文本，非文本段返回 None"""
+        if seg.type == "text":
+            return seg.data.get("text", "")
+        if seg.type == "at":
+            # 保留 @ 提及（可选）
+            qq = seg.data.get("qq", "")
+            return f"@{qq}" if qq != "all" else None
+        if seg.type == "face":
+            # QQ 系统表情
+            from src.utils.qq_face_map import get_face_description
+            face_id = seg.data.get("id", 0)
+            face_desc = get_face_description(face_id)
+            logger.debug(f"Extracted face: {face_id} -> {face_desc}")
+            return f"[{face_desc}]"
+        return None
+    
+    def _image_of(self, seg: MessageSegment) -> Optional[ImageSegment]:
+        data = seg.data
+        # 优先使用 url，其次 file
+        url = data.get("url") or data.get("file")
+        if not url:
+            return None
+        logger.debug(f"Extracted image: {url[:50]}...")
+        return ImageSegment(
+            url=url,
+            file=data.get("file", ""),
+            file_id=data.get("file_id"),
+            subtype=data.get("subtype")
+        )
+    
+    def _audio_of(self, seg: MessageSegment) -> Optional[AudioSegment]:
+        data = seg.data
+        file = data.get("file", "")
+        url = data.get("url")
+        # 如果没有 url，尝试从 file 构造
+        if not url and file:
+            # NapCatQQ 通常会提供完整URL或路径
+            url = file if file.startswith("http") else None
+        if not (file or url):
+            return None
+        logger.debug(f"Extracted audio: {file}")
+        return AudioSegment(file=file, url=url, magic=data.get("magic"))
+    
+    def _video_of(self, seg: MessageSegment) -> Optional[VideoSegment]:
+        data = seg.data
+        file = data.get("file", "")
+        url = data.get("url")
+        # 如果没有 url，尝试从 file 构造
+        if not url and file:
+            url = file if file.startswith("http") else None
+        if not (file or url):
+            return None
+        logger.debug(f"Extracted video: {file}")
+        return VideoSegment(file=file, url=url)
     
     def is_multimodal(self, message: Message) -> bool:
         """
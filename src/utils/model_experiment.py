@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import hashlib
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+from nonebot.log import logger
+
+
+@dataclass
+class ExperimentArm:
+    name: str
+    weight: int
+    # overrides for _get_models_cfg keys (chat_short/chat_long/summary/thinking/image)
+    models: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class ArmStats:
+    requests: int = 0
+    errors: int = 0
+    latency_sum: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reply_chars: int = 0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=2000))
+
+    def summary(self) -> Dict[str, Any]:
+        ok = self.requests - self.errors
+        lat = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else 0.0,
+            "latency_avg_ms": round(self.latency_sum / self.requests * 1000, 1) if self.requests else 0.0,
+            "latency_p50_ms": round(_percentile(lat, 0.50) * 1000, 1),
+            "latency_p95_ms": round(_percentile(lat, 0.95) * 1000, 1),
+            "avg_prompt_tokens": round(self.prompt_tokens / ok, 1) if ok else 0.0,
+            "avg_completion_tokens": round(self.completion_tokens / ok, 1) if ok else 0.0,
+            "avg_reply_chars": round(self.reply_chars / ok, 1) if ok else 0.0,
+        }
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def bucket(name: str, user_key: str, total_weight: int) -> int:
+    """Deterministic bucket in [0, total_weight) for a user_key.
+
+    Salted by experiment name so that different experiments split users independently.
+    """
+    digest = hashlib.sha256(f"{name}:{user_key}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % max(1, total_weight)
+
+
+class ModelExperiment:
+    """Traffic-splitting experiment on top of choose_model.
+
+    Configure via MODEL_EXPERIMENT_JSON, e.g.
+    {
+      "name": "chat_short_flash_vs_pro",
+      "arms": [
+        {"name": "control", "weight": 50},
+        {"name": "pro", "weight": 50, "models": {"chat_short": "gemini-3-pro-high"}}
+      ]
+    }
+
+    The first arm is treated as the control arm in reports.
+    """
+
+    def __init__(self):
+        self.name = ""
+        self.arms: List[ExperimentArm] = []
+        self.total_weight = 0
+        self.started_at = time.time()
+        self.stats: Dict[str, ArmStats] = {}
+        self._load_config(os.getenv("MODEL_EXPERIMENT_JSON", "").strip())
+
+    def _load_config(self, raw: str):
+        if not raw:
+            return
+        try:
+            data = json.loads(raw)
+            arms = []
+            for a in data.get("arms") or []:
+                weight = int(a.get("weight", 0))
+                if weight <= 0 or not a.get("name"):
+                    continue
+                models = {k: str(v) for k, v in (a.get("models") or {}).items() if v}
+                arms.append(ExperimentArm(name=str(a["name"]), weight=weight, models=models))
+        except Exception as e:
+            logger.error(f"[experiment] invalid MODEL_EXPERIMENT_JSON: {e}")
+            return
+
+        if len(arms) < 2:
+            logger.warning("[experiment] need at least 2 arms with positive weight, experiment disabled")
+            return
+
+        self.name = str(data.get("name") or "experiment")
+        self.arms = arms
+        self.total_weight = sum(a.weight for a in arms)
+        self.stats = {a.name: ArmStats() for a in arms}
+        logger.info(
+            f"[experiment] {self.name} enabled: "
+            + ", ".join(f"{a.name}={a.weight}" for a in arms)
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.arms)
+
+    def assign(self, user_key: Optional[str]) -> Optional[ExperimentArm]:
+        """Return the arm for user_key (stable across restarts), or None if disabled."""
+        if not self.enabled or not user_key:
+            return None
+        b = bucket(self.name, user_key, self.total_weight)
+        for arm in self.arms:
+            if b < arm.weight:
+                return arm
+            b -= arm.weight
+        return self.arms[-1]
+
+    def record(
+        self,
+        arm: ExperimentArm,
+        latency_sec: float,
+        reply: str,
+        usage: Optional[Dict[str, Any]] = None,
+        error: bool = False,
+    ):
+        st = self.stats.get(arm.name)
+        if st is None:
+            return
+        st.requests += 1
+        st.latency_sum += latency_sec
+        st.latencies.append(latency_sec)
+        if error:
+            st.errors += 1
+            return
+        usage = usage or {}
+        st.prompt_tokens += int(usage.get("prompt_tokens") or 0)
+        st.completion_tokens += int(usage.get("completion_tokens") or 0)
+        st.reply_chars += len(reply or "")
+
+    def report(self) -> Dict[str, Any]:
+        """Per-arm metrics plus relative deltas against the control (first) arm."""
+        if not self.enabled:
+            return {"enabled": False}
+
+        arms = {}
+        for a in self.arms:
+            arms[a.name] = {"weight": a.weight, "models": a.models, **self.stats[a.name].summary()}
+
+        control = self.arms[0].name
+        base = arms[control]
+        comparison = {}
+        for a in self.arms[1:]:
+            cur = arms[a.name]
+            comparison[a.name] = {
+                k: _rel_delta(cur[k], base[k])
+                for k in ("latency_p50_ms", "latency_p95_ms", "error_rate", "avg_completion_tokens", "avg_reply_chars")
+            }
+
+        return {
+            "enabled": True,
+            "name": self.name,
+            "control": control,
+            "since": int(self.started_at),
+            "arms": arms,
+            "vs_control": comparison,
+        }
+
+    def reset(self):
+        self.started_at = time.time()
+        self.stats = {a.name: ArmStats() for a in self.arms}
+
+
+def _rel_delta(value: float, base: float) -> Optional[float]:
+    """Relative change of value against base, e.g. 0.12 == +12%."""
+    if not base:
+        return None
+    return round((value - base) / base, 4)
+
+
+model_experiment = ModelExperiment()
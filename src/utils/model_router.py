@@ -2,6 +2,7 @@ import os
 import json
 import re
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
@@ -10,9 +11,11 @@ class ModelChoice:
     reason: str
 
 
-def _get_models_cfg() -> dict:
+def _get_models_cfg(overrides: Optional[dict] = None) -> dict:
     """Model configuration.
 
+    `overrides` (e.g. from an experiment arm) takes precedence over env config.
+
     Override via OPENAI_MODELS_JSON, e.g.
     {
       "chat_short": "gemini-3-flash",
@@ -22,6 +25,13 @@ def _get_models_cfg() -> dict:
       "thinking": "claude-sonnet-4.5-thinking"
     }
     """
+    cfg = _load_models_cfg()
+    if overrides:
+        cfg = {**cfg, **overrides}
+    return cfg
+
+
+def _load_models_cfg() -> dict:
     raw = os.getenv("OPENAI_MODELS_JSON", "").strip()
     if raw:
         try:
@@ -49,8 +59,13 @@ _REASONING_KEYWORDS = re.compile(
 _SUMMARY_KEYWORDS = re.compile(r"(总结|summary|tl;dr|要点|梳理|概括)", re.IGNORECASE)
 
 
-def choose_model(prompt: str, task_type: str = "chat", has_media: bool = False) -> ModelChoice:
-    cfg = _get_models_cfg()
+def choose_model(
+    prompt: str,
+    task_type: str = "chat",
+    has_media: bool = False,
+    overrides: Optional[dict] = None,
+) -> ModelChoice:
+    cfg = _get_models_cfg(overrides)
 
     if has_media:
         return ModelChoice(cfg.get("image") or cfg.get("chat_long"), "has_media")
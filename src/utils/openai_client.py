@@ -1,9 +1,12 @@
 import os
 import json
+import time
 import asyncio
 import aiohttp
 from nonebot.log import logger
 from src.utils.model_router import choose_model, _get_models_cfg, ModelChoice
+from src.utils.model_experiment import model_experiment
+from src.utils.deadline import Deadline
 from typing import List, Dict, Optional, Any
 
 
@@ -65,7 +68,20 @@ class OpenAIClient:
         self._acquire_timeout = float(os.getenv("CONCURRENCY_ACQUIRE_TIMEOUT_SEC", "0.2"))
 
 
-    async def chat_completions(self, messages: List[Dict[str, str]], model: Optional[str] = None) -> str:
+    async def chat_completions(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None,
+        usage: Optional[Dict[str, Any]] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> str:
+        """POST /chat/completions.
+
+        usage: optional dict filled with the backend `usage` block (prompt/completion tokens).
+        deadline: request budget; each attempt's HTTP timeout is clamped to what is
+        left at that moment, and retries stop once less than DEADLINE_NO_RETRY_SEC
+        (or less than the next backoff delay) remains.
+        """
         if not self.base_url:
             return "[Error] OPENAI_BASE_URL 未配置（例如：https://anti.freeapp.tech/v1）"
         if not self.api_key:
@@ -83,8 +99,6 @@ class OpenAIClient:
             "Content-Type": "application/json",
         }
 
-        timeout = aiohttp.ClientTimeout(total=self.timeout_sec)
-
         # lightweight retry: network errors + 429/5xx
         max_attempts = int(os.getenv("OPENAI_MAX_RETRIES", "2")) + 1
         base_sleep = float(os.getenv("OPENAI_RETRY_BASE_SEC", "0.6"))
@@ -92,7 +106,20 @@ class OpenAIClient:
         last_status = None
         last_body = ""
 
+        def can_retry(delay: float) -> bool:
+            if deadline is None:
+                return True
+            # sleeping past the deadline only to time out right away helps no one
+            return not deadline.should("no_retry") and deadline.remaining() > delay
+
         for attempt in range(1, max_attempts + 1):
+            timeout_sec = self.timeout_sec
+            if deadline is not None:
+                if deadline.expired:
+                    return "[Error] 回复超时，请稍后再试"
+                timeout_sec = max(1.0, min(timeout_sec, deadline.remaining()))
+            timeout = aiohttp.ClientTimeout(total=timeout_sec)
+
             acquired = False
             try:
                 try:
@@ -110,8 +137,9 @@ class OpenAIClient:
                             logger.warning(
                                 f"OpenAI API transient error: status={resp.status} attempt={attempt}/{max_attempts} body={last_body[:200]}"
                             )
-                            if attempt < max_attempts:
-                                await asyncio.sleep(base_sleep * (2 ** (attempt - 1)))
+                            delay = base_sleep * (2 ** (attempt - 1))
+                            if attempt < max_attempts and can_retry(delay):
+                                await asyncio.sleep(delay)
                                 continue
 
                         if resp.status >= 400:
@@ -128,6 +156,9 @@ class OpenAIClient:
                             logger.error(f"OpenAI API invalid JSON: {last_body[:500]}")
                             return "[Error] API 返回格式异常"
 
+                        if usage is not None and isinstance(data.get("usage"), dict):
+                            usage.update(data["usage"])
+
                         try:
                             return (data["choices"][0]["message"]["content"] or "").strip()
                         except Exception:
@@ -147,9 +178,10 @@ class OpenAIClient:
                     except Exception:
                         pass
 
-            if attempt < max_attempts:
-                await asyncio.sleep(base_sleep * (2 ** (attempt - 1)))
-                continue
+            delay = base_sleep * (2 ** (attempt - 1))
+            if attempt >= max_attempts or not can_retry(delay):
+                break
+            await asyncio.sleep(delay)
 
         # final fallback
         if last_status is not None:
@@ -162,56 +194,41 @@ class OpenAIClient:
 
         image_data_urls: list of data:image/...;base64,...
         """
-        if not self.base_url:
-            return "[Error] OPENAI_BASE_URL 未配置"
-        if not self.api_key:
-            return "[Error] OPENAI_API_KEY 未配置"
-
-        content = [{"type": "text", "text": text_prompt or "请描述这张图片"}]
-        for u in image_data_urls:
-            content.append({"type": "image_url", "image_url": {"url": u}})
-
-        messages = [{"role": "user", "content": content}]
-
-        url = f"{self.base_url}/chat/completions"
-        payload = {
-            "model": model,
-            "messages": messages,
-            "temperature": 0.7,
-        }
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+        parts = [{"type": "image_url", "image_url": {"url": u}} for u in image_data_urls]
+        return await self.generate_multimodal(text_prompt or "请描述这张图片", parts, model=model)
+
+    async def generate_multimodal(
+        self,
+        text: str,
+        parts: List[Dict[str, Any]],
+        model: str = "auto",
+        history=None,
+        user_key: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> str:
+        """One multimodal request: history + [text, image_url/input_audio parts...].
+
+        parts: OpenAI content parts, e.g. produced by media_pipeline.
+        model 'auto' uses the chat_long model (the image model is for generation only),
+        or chat_short when the deadline is close.
+        """
+        messages = _history_to_openai_messages(history)
+        max_hist = int(os.getenv("OPENAI_MAX_HISTORY_MESSAGES", "20"))
+        if len(messages) > max_hist:
+            messages = messages[-max_hist:]
 
-        timeout = aiohttp.ClientTimeout(total=self.timeout_sec)
-        try:
-            await asyncio.wait_for(self._sem.acquire(), timeout=self._acquire_timeout)
-        except asyncio.TimeoutError:
-            return "[Error] 系统繁忙（并发过高），请稍后再试"
-        try:
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(url, headers=headers, json=payload) as resp:
-                    body = await resp.text()
-                    if resp.status >= 400:
-                        logger.error(f"OpenAI vision API error: status={resp.status} body={body[:500]}")
-                        if resp.status == 401:
-                            return "[Error] 后端鉴权失败（401）"
-                        if resp.status == 429:
-                            return "[Error] 后端限流（429），请稍后再试"
-                        return f"[Error] API 调用失败（HTTP {resp.status}）"
-                    data = json.loads(body)
-        finally:
-            try:
-                self._sem.release()
-            except Exception:
-                pass
+        content: List[Dict[str, Any]] = [{"type": "text", "text": text}]
+        content.extend(parts)
+        messages.append({"role": "user", "content": content})
 
-        try:
-            return (data["choices"][0]["message"]["content"] or "").strip()
-        except Exception:
-            logger.error(f"OpenAI vision API unexpected response: {str(data)[:500]}")
-            return "[Error] API 返回缺少 choices/message"
+        if not model or model == "auto":
+            arm = model_experiment.assign(user_key)
+            cfg = _get_models_cfg(arm.models if arm else None)
+            model = cfg.get("chat_long") or self.model
+            if deadline is not None and cfg.get("chat_short") and deadline.should("flash_model"):
+                model = cfg["chat_short"]
+        logger.info(f"[multimodal] model={model} parts={len(parts)} history={len(messages) - 1}")
+        return await self.chat_completions(messages, model=model, deadline=deadline)
 
     async def _chat_completions_raw(self, messages: List[Dict[str, Any]], model: str) -> str:
         """Call /chat/completions with explicit model and minimal processing."""
@@ -263,11 +280,17 @@ class OpenAIClient:
             return None
         return None
 
-    async def generate_content(self, model: str, prompt: str, task_type: str = "chat", auto_select: bool = True, history=None, has_media: bool = False):
+    async def generate_content(self, model: str, prompt: str, task_type: str = "chat", auto_select: bool = True, history=None, has_media: bool = False, user_key: Optional[str] = None, deadline: Optional[Deadline] = None):
         """Gemini-like interface used by existing plugins.
 
         If model is 'auto' (recommended), it will route to an appropriate backend model
         (e.g. gemini-3-flash / gemini-3-pro-high / claude-sonnet-4.5-thinking / gemini-3-pro-image).
+
+        user_key: when a model experiment is configured, auto-routed requests are bucketed
+        by user_key and the arm's model overrides are applied (see model_experiment).
+
+        deadline: request budget (see src/utils/deadline.py). When it runs low the smart
+        router is skipped and auto routing falls back to the chat_short model.
         """
         messages = _history_to_openai_messages(history)
 
@@ -281,9 +304,16 @@ class OpenAIClient:
         messages.append({"role": "user", "content": prompt})
 
         chosen_model = model
+        arm = None
         if not chosen_model or chosen_model == "auto":
-            # two-stage smart router (optional)
-            routed = await self._smart_route(prompt=prompt, history_messages=messages[:-1])
+            arm = model_experiment.assign(user_key)
+            overrides = arm.models if arm else None
+            cfg = _get_models_cfg(overrides)
+            # two-stage smart router (optional; skipped when the deadline is close)
+            if deadline is not None and deadline.should("skip_router"):
+                routed = None
+            else:
+                routed = await self._smart_route(prompt=prompt, history_messages=messages[:-1])
             if routed and isinstance(routed, dict):
                 cfg_choice = None
                 task = str(routed.get("task") or "").lower()
@@ -292,34 +322,53 @@ class OpenAIClient:
 
                 # Map classifier output -> model
                 if has_media:
-                    cfg_choice = choose_model(prompt=prompt, task_type=task_type, has_media=True)
+                    cfg_choice = choose_model(prompt=prompt, task_type=task_type, has_media=True, overrides=overrides)
                 elif task in ("summary",):
-                    cfg_choice = choose_model(prompt=prompt, task_type="summary", has_media=False)
+                    cfg_choice = choose_model(prompt=prompt, task_type="summary", has_media=False, overrides=overrides)
                 elif task in ("code", "debug"):
                     # prefer thinking model for code/debug when high complexity
                     if complexity == "high" or need_long:
-                        cfg_choice = ModelChoice(_get_models_cfg().get("thinking") or _get_models_cfg().get("chat_long"), "smart_router code/debug high")
+                        cfg_choice = ModelChoice(cfg.get("thinking") or cfg.get("chat_long"), "smart_router code/debug high")
                     else:
-                        cfg_choice = ModelChoice(_get_models_cfg().get("chat_long"), "smart_router code/debug")
+                        cfg_choice = ModelChoice(cfg.get("chat_long"), "smart_router code/debug")
                 elif task in ("translation", "rewrite"):
-                    cfg_choice = ModelChoice(_get_models_cfg().get("chat_long"), f"smart_router {task}")
+                    cfg_choice = ModelChoice(cfg.get("chat_long"), f"smart_router {task}")
                 else:
                     # chat
-                    cfg_choice = ModelChoice(_get_models_cfg().get("chat_long") if (need_long or len((prompt or ''))>=150) else _get_models_cfg().get("chat_short"), "smart_router chat")
+                    cfg_choice = ModelChoice(cfg.get("chat_long") if (need_long or len((prompt or ''))>=150) else cfg.get("chat_short"), "smart_router chat")
 
                 if cfg_choice and cfg_choice.model:
                     chosen_model = cfg_choice.model
                     logger.info(f"[smart_router] model={chosen_model} routed={routed}")
                 else:
-                    choice = choose_model(prompt=prompt, task_type=task_type, has_media=has_media)
+                    choice = choose_model(prompt=prompt, task_type=task_type, has_media=has_media, overrides=overrides)
                     chosen_model = choice.model
                     logger.info(f"[model_router] choose model={chosen_model} reason={choice.reason}")
             else:
-                choice = choose_model(prompt=prompt, task_type=task_type, has_media=has_media)
+                choice = choose_model(prompt=prompt, task_type=task_type, has_media=has_media, overrides=overrides)
                 chosen_model = choice.model
                 logger.info(f"[model_router] choose model={chosen_model} reason={choice.reason}")
 
-        return await self.chat_completions(messages, model=chosen_model)
+            if deadline is not None and cfg.get("chat_short") and chosen_model != cfg["chat_short"] \
+                    and deadline.should("flash_model"):
+                chosen_model = cfg["chat_short"]
+                logger.info(f"[deadline] {deadline.remaining():.1f}s left, using fast model={chosen_model}")
+
+        if arm is None:
+            return await self.chat_completions(messages, model=chosen_model, deadline=deadline)
+
+        logger.info(f"[experiment] {model_experiment.name} arm={arm.name} model={chosen_model}")
+        usage: Dict[str, Any] = {}
+        t0 = time.monotonic()
+        reply = await self.chat_completions(messages, model=chosen_model, usage=usage, deadline=deadline)
+        model_experiment.record(
+            arm,
+            latency_sec=time.monotonic() - t0,
+            reply=reply,
+            usage=usage,
+            error=reply.startswith("[Error]"),
+        )
+        return reply
 
 
     async def image_generations(self, prompt: str, model: str) -> str:
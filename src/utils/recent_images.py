@@ -0,0 +1,102 @@
+"""
+群内最近图片索引
+消息记录器顺手记下图片消息段的 URL（不下载），用户随后 @bot 追问“这张图什么意思”时，
+聊天处理器再按需下载并识别被引用的图片
+"""
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Deque, List, Optional
+
+from src.utils.message_parser import ImageSegment
+
+# 追问图片的说法：这张图 / 这图 / 上面的图 / 刚才那张 / 图里 / 这个表情包 ...
+_FOLLOW_UP_RE = re.compile(
+    r"(这|那|上|刚才|刚刚|上面|前面)(一)?(张|个|幅)?(的)?(图|图片|照片|截图|表情|表情包|梗图)"
+    r"|(?<![地画插试蓝构意])图(里|中|上)|(看|识别|描述|解释)(一下)?(图|图片)"
+)
+
+
+def is_image_follow_up(text: str) -> bool:
+    """文本是否在追问之前发过的图片"""
+    return bool(text) and _FOLLOW_UP_RE.search(text) is not None
+
+
+@dataclass
+class RecentImage:
+    image: ImageSegment
+    user_id: str
+    message_id: int
+    ts: float
+
+
+class RecentImageIndex:
+    """每个群保留最近几条图片消息段（只存 URL，内存占用很小）"""
+
+    def __init__(self):
+        self.per_group = int(os.getenv("RECENT_IMAGES_PER_GROUP", "10"))
+        self.ttl_sec = int(os.getenv("RECENT_IMAGES_TTL_SEC", "600"))
+        self.max_groups = int(os.getenv("RECENT_IMAGES_MAX_GROUPS", "500"))
+        # group_id -> newest images last; groups ordered by last activity
+        self._groups: "OrderedDict[str, Deque[RecentImage]]" = OrderedDict()
+
+    def record(self, group_id: str, user_id: str, message_id: int, images: List[ImageSegment]):
+        """记录一条消息中的图片（消息记录器调用，不触发下载）"""
+        if not images:
+            return
+        group_id = str(group_id)
+        bucket = self._groups.get(group_id)
+        if bucket is None:
+            bucket = self._groups[group_id] = deque(maxlen=self.per_group)
+            while len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+        else:
+            self._groups.move_to_end(group_id)
+
+        now = time.time()
+        for img in images:
+            bucket.append(RecentImage(img, str(user_id), message_id, now))
+
+    def find(
+        self,
+        group_id: str,
+        user_id: Optional[str] = None,
+        message_id: Optional[int] = None,
+        limit: int = 1,
+    ) -> List[ImageSegment]:
+        """
+        查找被追问的图片
+
+        Args:
+            group_id: 群号
+            user_id: 提问者，优先返回他本人最近发的图
+            message_id: 被回复的消息 ID（精确匹配，忽略 TTL）
+            limit: 最多返回几张（同一条消息里的多张图一起返回）
+
+        Returns:
+            List[ImageSegment]: 按原消息顺序排列，找不到时为空
+        """
+        bucket = self._groups.get(str(group_id))
+        if not bucket:
+            return []
+
+        if message_id is not None:
+            return [r.image for r in bucket if r.message_id == message_id][:limit]
+
+        cutoff = time.time() - self.ttl_sec
+        fresh = [r for r in bucket if r.ts >= cutoff]
+        if not fresh:
+            return []
+        own = [r for r in fresh if r.user_id == str(user_id)] if user_id is not None else []
+        newest = (own or fresh)[-1]
+        same_message = [r.image for r in fresh if r.message_id == newest.message_id]
+        return same_message[-limit:]
+
+    def stats(self) -> dict:
+        return {"groups": len(self._groups), "images": sum(len(b) for b in self._groups.values())}
+
+
+# 全局单例
+recent_images = RecentImageIndex()
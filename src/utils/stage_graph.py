@@ -0,0 +1,86 @@
+"""
+小型阶段依赖图
+聊天流程里互不依赖的阶段（上下文加载、媒体下载转码...）并发执行，有依赖的阶段等依赖完成后再开始；
+每个阶段的实际耗时记入请求的 Deadline
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+from src.utils.deadline import Deadline
+
+# 阶段函数：接收已完成依赖的结果 {name: result}
+StageFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class StageError(RuntimeError):
+    """阶段图定义错误（未知依赖、环）"""
+
+
+@dataclass
+class _Stage:
+    name: str
+    fn: StageFn
+    after: Sequence[str]
+
+
+class StageGraph:
+    """按依赖关系并发执行的阶段集合（每次请求新建一个）"""
+
+    def __init__(self, deadline: Optional[Deadline] = None):
+        self._stages: Dict[str, _Stage] = {}
+        self._deadline = deadline
+
+    def add(self, name: str, fn: StageFn, after: Sequence[str] = ()) -> "StageGraph":
+        self._stages[name] = _Stage(name, fn, tuple(after))
+        return self
+
+    def _check(self):
+        visiting, done = set(), set()
+
+        def visit(name: str):
+            if name in done:
+                return
+            if name not in self._stages:
+                raise StageError(f"unknown stage: {name}")
+            if name in visiting:
+                raise StageError(f"dependency cycle at stage: {name}")
+            visiting.add(name)
+            for dep in self._stages[name].after:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self._stages:
+            visit(name)
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        执行全部阶段，返回 {阶段名: 结果}
+
+        某个阶段抛出异常时，依赖它的阶段不会执行，异常向上抛出（其余已开始的阶段被取消）
+        """
+        self._check()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: _Stage) -> Any:
+            if stage.after:
+                await asyncio.gather(*(tasks[dep] for dep in stage.after))
+            deps = {dep: tasks[dep].result() for dep in stage.after}
+            start = time.monotonic()
+            try:
+                return await stage.fn(deps)
+            finally:
+                if self._deadline is not None:
+                    self._deadline.add_stage(stage.name, time.monotonic() - start)
+
+        for stage in self._stages.values():
+            tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return {name: task.result() for name, task in tasks.items()}
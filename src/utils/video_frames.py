@@ -0,0 +1,172 @@
+"""
+视频关键帧提取
+用 ffmpeg（异步、受 FFMPEG_CONCURRENCY 限制）按场景切换抽取少量关键帧，再生成一张低分辨率缩略拼图，
+以图片形式送入识图请求，上游负载只有原视频的一小部分
+"""
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from nonebot.log import logger
+
+from src.utils.ffmpeg_runner import ffmpeg_runner
+
+_SOI = b"\xff\xd8"
+_EOI = b"\xff\xd9"
+
+
+class VideoRejectedError(ValueError):
+    """视频超过时长上限或无法解析"""
+
+
+def split_jpeg_stream(data: bytes) -> List[bytes]:
+    """
+    拆分 image2pipe 输出的连续 JPEG
+
+    entropy-coded data byte-stuffs 0xFF, so EOI immediately followed by SOI only
+    occurs at a frame boundary
+    """
+    frames = []
+    start = data.find(_SOI)
+    while start != -1:
+        end = data.find(_EOI + _SOI, start + 2)
+        if end == -1:
+            tail = data[start:]
+            if tail.endswith(_EOI):
+                frames.append(tail)
+            break
+        frames.append(data[start:end + 2])
+        start = end + 2
+    return frames
+
+
+@dataclass
+class VideoFrames:
+    """一段视频的抽帧结果"""
+    frames: List[bytes] = field(default_factory=list)  # scene-change keyframes, JPEG
+    sheet: Optional[bytes] = None  # contact sheet, JPEG
+    duration: Optional[float] = None
+
+    @property
+    def images(self) -> List[bytes]:
+        return self.frames + ([self.sheet] if self.sheet else [])
+
+
+class VideoFrameExtractor:
+    """场景关键帧 + 缩略拼图"""
+
+    def __init__(self):
+        self.mode = os.getenv("VIDEO_MODE", "keyframes").lower()  # keyframes / off
+        self.max_frames = int(os.getenv("VIDEO_KEYFRAMES", "4"))
+        self.scene_threshold = float(os.getenv("VIDEO_SCENE_THRESHOLD", "0.3"))
+        self.frame_max_px = int(os.getenv("VIDEO_FRAME_MAX_PX", "768"))
+        self.sheet_cols, self.sheet_rows = (int(x) for x in os.getenv("VIDEO_SHEET_GRID", "4x3").lower().split("x"))
+        self.sheet_tile_px = int(os.getenv("VIDEO_SHEET_TILE_PX", "192"))
+        self.max_duration = float(os.getenv("VIDEO_MAX_DURATION_SEC", "180"))
+        self.max_size_mb = int(os.getenv("VIDEO_MAX_SIZE_MB", "30"))
+        self.timeout = float(os.getenv("VIDEO_FFMPEG_TIMEOUT_SEC", "60"))
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode == "keyframes" and ffmpeg_runner.available
+
+    async def probe_duration(
+        self, source: Union[str, Path], timeout: float = 10, headers: Optional[Dict[str, str]] = None
+    ) -> Optional[float]:
+        """
+        读取时长（秒）
+
+        source 可以是 URL：ffprobe 只读取容器头部，用于在下载完成前检查时长；
+        headers 传入与下载相同的 Referer/User-Agent，否则 QQ 的媒体服务器会拒绝请求
+
+        Returns:
+            Optional[float]: 无法获取时返回 None
+        """
+        try:
+            info = await ffmpeg_runner.probe(str(source), timeout=timeout, headers=headers)
+        except Exception as e:
+            logger.debug(f"ffprobe failed for {str(source)[:50]}: {e}")
+            return None
+        duration = (info.get("format") or {}).get("duration")
+        if duration is None:
+            for stream in info.get("streams") or []:
+                if stream.get("codec_type") == "video" and stream.get("duration"):
+                    duration = stream["duration"]
+                    break
+        try:
+            return float(duration) if duration is not None else None
+        except ValueError:
+            return None
+
+    def check_duration(self, duration: Optional[float]):
+        """超过 VIDEO_MAX_DURATION_SEC 时抛出 VideoRejectedError（时长未知时放行）"""
+        if duration is not None and duration > self.max_duration:
+            raise VideoRejectedError(f"video too long: {duration:.0f}s > {self.max_duration:.0f}s")
+
+    async def keyframes(self, path: Path) -> List[bytes]:
+        """第一帧 + 场景切换帧，最多 VIDEO_KEYFRAMES 张"""
+        px = self.frame_max_px
+        vf = (
+            f"select='eq(n\\,0)+gt(scene\\,{self.scene_threshold})',"
+            f"scale={px}:{px}:force_original_aspect_ratio=decrease"
+        )
+        out = await ffmpeg_runner.run(
+            ["-i", str(path), "-an", "-vf", vf, "-vsync", "vfr", "-frames:v", str(self.max_frames),
+             "-q:v", "5", "-f", "image2pipe", "-c:v", "mjpeg", "pipe:1"],
+            timeout=self.timeout,
+        )
+        return split_jpeg_stream(out)
+
+    async def contact_sheet(self, path: Path, duration: Optional[float]) -> Optional[bytes]:
+        """整段视频均匀采样拼成一张 cols x rows 的缩略图"""
+        tiles = self.sheet_cols * self.sheet_rows
+        if not duration or duration <= 0 or tiles <= 1:
+            return None
+        px = self.sheet_tile_px
+        vf = (
+            f"fps={tiles / duration:.6f},"
+            f"scale={px}:{px}:force_original_aspect_ratio=decrease,"
+            f"pad={px}:{px}:(ow-iw)/2:(oh-ih)/2,"
+            f"tile={self.sheet_cols}x{self.sheet_rows}"
+        )
+        out = await ffmpeg_runner.run(
+            ["-i", str(path), "-an", "-vf", vf, "-frames:v", "1",
+             "-q:v", "6", "-f", "image2pipe", "-c:v", "mjpeg", "pipe:1"],
+            timeout=self.timeout,
+        )
+        frames = split_jpeg_stream(out)
+        return frames[0] if frames else None
+
+    async def extract(self, path: Path, duration: Optional[float] = None) -> VideoFrames:
+        """
+        抽取关键帧和缩略拼图
+
+        Args:
+            path: 已下载的视频文件
+            duration: 已知时长（下载前探测到的），None 时从文件读取
+
+        Raises:
+            VideoRejectedError: 超过时长上限或没有可用画面
+            FFmpegError: ffmpeg 不可用或执行失败
+        """
+        if duration is None:
+            duration = await self.probe_duration(path)
+        self.check_duration(duration)
+
+        result = VideoFrames(duration=duration)
+        result.frames = await self.keyframes(path)
+        result.sheet = await self.contact_sheet(path, duration)
+        if not result.images:
+            raise VideoRejectedError("no decodable video frames")
+
+        size = sum(len(b) for b in result.images)
+        logger.info(
+            f"Video frames: {len(result.frames)} keyframes + {'1' if result.sheet else 'no'} sheet, "
+            f"{size / 1024:.0f}KB (video {path.stat().st_size / 1024:.0f}KB, {duration or 0:.0f}s)"
+        )
+        return result
+
+
+# 全局单例
+video_frames = VideoFrameExtractor()
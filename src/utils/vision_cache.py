@@ -0,0 +1,149 @@
+"""
+识图结果缓存
+群里反复转发的表情包/截图（哪怕被重新压缩过）按 会话范围 + 感知哈希（dHash）+ 归一化提问 复用之前的回答，
+汉明距离在阈值内即视为同一张图；条目有 TTL 和数量上限。
+范围是群号（私聊为 user_key），一个群里的回答不会出现在另一个群或别人的私聊里
+"""
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Set, Tuple
+
+from nonebot.log import logger
+
+from src.utils.image_utils import hamming
+
+_WS_RE = re.compile(r"\s+")
+# trailing punctuation / particles do not change what is being asked
+_TRAILING_RE = re.compile(r"[\s?？!！。.,，~～]+$")
+
+_Key = Tuple[str, str, Tuple[int, ...]]  # (scope, prompt, hashes)
+
+
+def normalize_prompt(text: str) -> str:
+    """大小写、空白、结尾标点不同的提问视为同一个"""
+    t = _WS_RE.sub(" ", (text or "").strip().lower())
+    return _TRAILING_RE.sub("", t)
+
+
+@dataclass
+class VisionCacheEntry:
+    reply: str
+    created_at: float
+    hits: int = 0
+
+
+class VisionCache:
+    """感知哈希 → 识图回答 的有界 LRU 缓存"""
+
+    def __init__(self):
+        self.enabled = os.getenv("VISION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+        self.ttl_sec = int(os.getenv("VISION_CACHE_TTL_SEC", "21600"))
+        self.max_entries = int(os.getenv("VISION_CACHE_MAX", "2048"))
+        self.max_distance = int(os.getenv("VISION_CACHE_HAMMING", "6"))
+
+        # (scope, prompt, hashes) -> entry, least recently used first
+        self._entries: "OrderedDict[_Key, VisionCacheEntry]" = OrderedDict()
+        # (scope, prompt, image count) -> keys, so a near-match only scans candidates for the same question
+        self._buckets: Dict[Tuple[str, str, int], Set[_Key]] = {}
+
+        self.lookups = 0
+        self.hits = 0
+        self.near_hits = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expired = 0
+
+        logger.info(
+            f"VisionCache initialized: enabled={self.enabled}, ttl={self.ttl_sec}s, "
+            f"max={self.max_entries}, hamming<={self.max_distance}"
+        )
+
+    def _drop(self, key: _Key):
+        self._entries.pop(key, None)
+        bucket_key = (key[0], key[1], len(key[2]))
+        bucket = self._buckets.get(bucket_key)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[bucket_key]
+
+    def _match(self, key: _Key) -> Optional[_Key]:
+        if key in self._entries:
+            return key
+        scope, prompt, hashes = key
+        for cand in self._buckets.get((scope, prompt, len(hashes)), ()):
+            if all(hamming(a, b) <= self.max_distance for a, b in zip(hashes, cand[2])):
+                return cand
+        return None
+
+    def get(self, scope: str, prompt: str, hashes: Sequence[int]) -> Optional[str]:
+        """
+        查找同一范围、同一提问下感知哈希相近的图片的已有回答
+
+        Args:
+            scope: 会话范围（群聊为 group_<群号>，私聊为 user_key）
+            prompt: 用户提问（未归一化）
+            hashes: 按消息中顺序排列的每张图片 dHash
+
+        Returns:
+            Optional[str]: 命中时返回之前的回答
+        """
+        if not self.enabled or not hashes:
+            return None
+        self.lookups += 1
+        now = time.time()
+        key = (scope, normalize_prompt(prompt), tuple(hashes))
+
+        found = self._match(key)
+        while found is not None and now - self._entries[found].created_at > self.ttl_sec:
+            self._drop(found)
+            self.expired += 1
+            found = self._match(key)
+        if found is None:
+            return None
+
+        entry = self._entries[found]
+        entry.hits += 1
+        self._entries.move_to_end(found)
+        self.hits += 1
+        if found != key:
+            self.near_hits += 1
+        return entry.reply
+
+    def put(self, scope: str, prompt: str, hashes: Sequence[int], reply: str):
+        """记录一次识图回答（同一 key 覆盖旧值并刷新 TTL）"""
+        if not self.enabled or not hashes or not reply:
+            return
+        key = (scope, normalize_prompt(prompt), tuple(hashes))
+        self._drop(key)
+        self._entries[key] = VisionCacheEntry(reply=reply, created_at=time.time())
+        self._buckets.setdefault((key[0], key[1], len(key[2])), set()).add(key)
+        self.stores += 1
+
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_sec": self.ttl_sec,
+            "max_distance": self.max_distance,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.lookups - self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+
+# 全局单例
+vision_cache = VisionCache()
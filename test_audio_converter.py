@@ -0,0 +1,99 @@
+"""
+音频转换测试
+验证 ffmpeg 异步执行器的管道/超时/并发上限，以及转换结果按内容哈希缓存
+（用 Python 解释器代替 ffmpeg 可执行文件，测试环境不需要安装 ffmpeg）
+"""
+import sys
+import asyncio
+
+import pytest
+
+from src.utils import audio_converter as ac
+from src.utils.ffmpeg_runner import FFmpegError, FFmpegRunner
+
+
+def _runner(**env) -> FFmpegRunner:
+    runner = FFmpegRunner(binary=sys.executable)
+    runner._available = True
+    for k, v in env.items():
+        setattr(runner, k, v)
+    return runner
+
+
+def test_runner_pipes_stdin_to_stdout():
+    runner = _runner()
+    script = "import sys; sys.stdout.buffer.write(sys.stdin.buffer.read()[::-1])"
+    out = asyncio.run(runner._exec([sys.executable, "-c", script], b"abc", None))
+    assert out == b"cba"
+
+    with pytest.raises(FFmpegError, match="exited 3"):
+        asyncio.run(runner._exec([sys.executable, "-c", "import sys; sys.exit(3)"], None, None))
+
+
+def test_runner_timeout_kills_and_caps_concurrency():
+    runner = _runner(max_parallel=2)
+    peak = 0
+
+    async def sleeper():
+        return await runner._exec([sys.executable, "-c", "import time; time.sleep(0.3)"], None, 5)
+
+    async def watch():
+        nonlocal peak
+        while True:
+            peak = max(peak, runner.running)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        w = asyncio.create_task(watch())
+        await asyncio.gather(*(sleeper() for _ in range(4)))
+        w.cancel()
+        with pytest.raises(FFmpegError, match="timeout"):
+            await runner._exec([sys.executable, "-c", "import time; time.sleep(30)"], None, 0.2)
+
+    asyncio.run(main())
+    assert peak == 2
+    assert runner.running == 0
+
+
+def test_convert_is_cached_by_content_hash(monkeypatch, tmp_path):
+    calls = []
+
+    async def fake_run(args, input_data=None, timeout=None):
+        calls.append(args)
+        return b"ID3" + input_data[:4]
+
+    fake = _runner()
+    monkeypatch.setattr(fake, "run", fake_run)
+    monkeypatch.setattr(ac, "ffmpeg_runner", fake)
+
+    src = tmp_path / "voice.amr"
+    src.write_bytes(b"#!AMR\n" + b"\0" * 100)
+    conv = ac.AudioConverter()
+
+    async def main():
+        first = await conv.convert(src, content_hash="h1")
+        second = await conv.convert(src, content_hash="h1")
+        wav = await conv.convert(src, profile="speech_wav", content_hash="h1")
+        return first, second, wav
+
+    first, second, wav = asyncio.run(main())
+    assert first == second and first.format == "mp3"
+    assert wav.format == "wav"
+    assert len(calls) == 2
+    assert calls[0][:2] == ["-i", "pipe:0"] and "16000" in calls[0] and calls[0][-1] == "pipe:1"
+    assert conv.stats()["cache_hits"] == 1
+
+
+def test_convert_without_ffmpeg_passes_through_supported_formats(monkeypatch, tmp_path):
+    missing = FFmpegRunner(binary="definitely-not-ffmpeg")
+    monkeypatch.setattr(ac, "ffmpeg_runner", missing)
+    conv = ac.AudioConverter()
+
+    wav = tmp_path / "a.wav"
+    wav.write_bytes(b"RIFF")
+    amr = tmp_path / "a.amr"
+    amr.write_bytes(b"#!AMR")
+
+    assert asyncio.run(conv.convert(wav)).format == "wav"
+    with pytest.raises(FFmpegError):
+        asyncio.run(conv.convert(amr))
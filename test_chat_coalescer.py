@@ -0,0 +1,75 @@
+"""
+连发消息合并测试
+验证窗口内的消息并入同一批次、不同用户互不影响、条数上限提前结束以及合并后的内容
+"""
+import asyncio
+import time
+
+from nonebot.adapters.onebot.v11 import Message
+
+from src.utils.chat_coalescer import ChatCoalescer, merge_parsed
+from src.utils.message_parser import ImageSegment, ParsedMessage
+
+
+def _coalescer(monkeypatch, **env) -> ChatCoalescer:
+    for k, v in {"CHAT_COALESCE_MS": "100", **env}.items():
+        monkeypatch.setenv(k, v)
+    return ChatCoalescer()
+
+
+def _parsed(text: str, images=()) -> ParsedMessage:
+    return ParsedMessage(text=text, images=list(images), audios=[], videos=[],
+                         has_media=bool(images), raw_message=Message(text), plain_text=text)
+
+
+def test_disabled_passes_through(monkeypatch):
+    c = _coalescer(monkeypatch, CHAT_COALESCE_MS="0")
+    assert asyncio.run(c.submit("u", 1)) == [1]
+
+
+def test_burst_is_merged_per_user(monkeypatch):
+    c = _coalescer(monkeypatch)
+
+    async def main():
+        async def later(key, item, delay):
+            await asyncio.sleep(delay)
+            return await c.submit(key, item)
+
+        return await asyncio.gather(
+            c.submit("alice", "a1"),
+            later("alice", "a2", 0.05),
+            later("bob", "b1", 0.02),
+            later("alice", "a3", 0.12),  # window slid with a2, so still inside
+        )
+
+    a1, a2, b1, a3 = asyncio.run(main())
+    assert a1 == ["a1", "a2", "a3"]
+    assert a2 is None and a3 is None
+    assert b1 == ["b1"]
+    assert c.stats()["merged"] == 2 and c.stats()["pending"] == 0
+
+
+def test_max_messages_and_max_wait(monkeypatch):
+    c = _coalescer(monkeypatch, CHAT_COALESCE_MS="1000", CHAT_COALESCE_MAX_MESSAGES="2")
+
+    async def main():
+        t0 = time.monotonic()
+        leader = asyncio.ensure_future(c.submit("u", 1))
+        await asyncio.sleep(0)
+        await c.submit("u", 2)
+        return await leader, time.monotonic() - t0
+
+    batch, elapsed = asyncio.run(main())
+    assert batch == [1, 2] and elapsed < 0.5  # flushed as soon as the batch is full
+
+    c = _coalescer(monkeypatch, CHAT_COALESCE_MS="1000", CHAT_COALESCE_MAX_WAIT_MS="50")
+    t0 = time.monotonic()
+    assert asyncio.run(c.submit("u", 1)) == [1]
+    assert time.monotonic() - t0 < 0.5
+
+
+def test_merge_parsed():
+    img = ImageSegment(url="http://img/1", file="1")
+    merged = merge_parsed([_parsed("我想问"), _parsed("", [img]), _parsed("这是哪里")])
+    assert merged.text == "我想问\n这是哪里"
+    assert merged.images == [img] and merged.has_media
@@ -0,0 +1,121 @@
+"""
+水群榜统计测试
+验证增量维护的前 K 名与全量排序一致、消息总数、快照读写与旧格式兼容、崩溃后重放事件日志以及跨天重置
+"""
+import importlib.util
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def stats_module(tmp_path, monkeypatch):
+    monkeypatch.setenv("STATS_FILE", str(tmp_path / "chat_stats.json"))
+    monkeypatch.setenv("STATS_TOP_COUNT", "3")
+    # load the module file directly: the plugin package __init__ needs a running NoneBot
+    path = Path(__file__).parent / "src" / "plugins" / "chat_stats" / "stats_manager.py"
+    spec = importlib.util.spec_from_file_location("stats_manager_under_test", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_incremental_top_k_matches_full_sort(stats_module):
+    manager = stats_module.chat_stats_manager
+    rng = random.Random(7)
+    counts = {}
+    for _ in range(500):
+        uid = str(rng.choice(range(12)) if rng.random() < 0.8 else rng.choice(range(3)))
+        counts[uid] = counts.get(uid, 0) + 1
+        manager.record_message(1, uid, f"u{uid}", "hi")
+
+        top = [e["count"] for e in manager.get_ranking(1)]
+        assert top == sorted(counts.values(), reverse=True)[:3]
+
+    assert manager.get_group_stats(1)["total_messages"] == 500
+    assert manager.get_group_stats(1)["active_users"] == len(counts)
+    full = manager.get_ranking(1, limit=50)
+    assert [e["count"] for e in full] == sorted(counts.values(), reverse=True)
+
+
+def test_recent_messages_and_round_trip(stats_module):
+    manager = stats_module.chat_stats_manager
+    for i in range(7):
+        manager.record_message("g", "alice", "Alice", f"msg {i}")
+    manager.record_message("g", "bob", "Bob")
+    manager.update_push_time("g")
+
+    assert [m["text"] for m in manager.get_user_recent_messages("g", "alice")] == [f"msg {i}" for i in range(2, 7)]
+
+    manager.force_save()
+    saved = json.loads(manager.stats_file.read_text(encoding="utf-8"))
+    assert saved["state"]["groups"]["g"]["users"]["alice"]["count"] == 7
+
+    reloaded = stats_module.ChatStatsManager()
+    assert reloaded.get_ranking("g") == manager.get_ranking("g")
+    assert reloaded.get_last_push_time("g") == manager.get_last_push_time("g")
+    reloaded.record_message("g", "bob", "Bob")
+    assert reloaded.get_group_stats("g")["total_messages"] == 9
+
+
+def test_new_day_resets(stats_module):
+    manager = stats_module.chat_stats_manager
+    manager.record_message("g", "alice", "Alice")
+    manager.date = "2000-01-01"
+    assert manager.get_ranking("g") == []
+    assert manager.get_all_active_groups() == []
+
+
+def test_restart_without_shutdown_replays_log(stats_module):
+    manager = stats_module.chat_stats_manager
+    for i in range(25):
+        manager.record_message("g", str(i % 4), f"u{i % 4}", f"m{i}")
+    manager.update_push_time("g")
+    # no close(): simulates a crash, nothing was snapshotted
+    assert not manager.stats_file.exists()
+
+    reloaded = stats_module.ChatStatsManager()
+    assert reloaded.get_group_stats("g") == manager.get_group_stats("g")
+    assert reloaded.get_ranking("g") == manager.get_ranking("g")
+    assert reloaded.get_user_recent_messages("g", "1") == manager.get_user_recent_messages("g", "1")
+
+
+def test_compaction_and_legacy_snapshot(stats_module, monkeypatch):
+    monkeypatch.setenv("STATS_COMPACT_EVERY", "10")
+    manager = stats_module.ChatStatsManager()
+    for _ in range(23):
+        manager.record_message("g", "alice", "Alice")
+    log_lines = manager._log.log_path.read_text(encoding="utf-8").splitlines()
+    assert len(log_lines) == 3  # compacted twice, log holds only the tail
+
+    manager.close()
+    legacy = {"date": manager.date, "groups": json.loads(manager.stats_file.read_text(encoding="utf-8"))["state"]["groups"]}
+    manager.stats_file.write_text(json.dumps(legacy, indent=2), encoding="utf-8")
+    manager._log.log_path.unlink()
+    assert stats_module.ChatStatsManager().get_group_stats("g")["total_messages"] == 23
+
+
+def test_event_log_crash_points(tmp_path):
+    from src.utils.event_log import EventLog
+
+    snap, log = tmp_path / "s.json", tmp_path / "s.log.jsonl"
+    el = EventLog(snap, log)
+    for i in range(3):
+        el.append({"i": i})
+    el.close()
+    stale_log = log.read_text(encoding="utf-8")
+    el.compact({"n": 3})
+    log.write_text(stale_log, encoding="utf-8")  # crash between snapshot write and log truncate
+
+    el = EventLog(snap, log)
+    state, events = el.load()
+    assert state == {"n": 3} and list(events) == []
+
+    with open(log, "a", encoding="utf-8") as f:
+        f.write('{"s":4,"i":')  # torn write
+    el.append({"i": 4})
+    el.close()
+    state, events = EventLog(snap, log).load()
+    assert list(events) == [{"i": 4}]
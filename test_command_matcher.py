@@ -0,0 +1,45 @@
+"""
+命令前缀匹配测试
+验证从 matcher 规则收集命令名、别名和多段命令，以及前缀/整词匹配
+"""
+from types import SimpleNamespace
+
+from nonebot.rule import CommandRule, Rule, ToMeRule
+
+from src.utils.command_matcher import CommandMatcher, collect_commands
+
+
+def _matcher(*cmds):
+    return SimpleNamespace(rule=Rule(CommandRule([tuple(c.split(".")) for c in cmds])))
+
+
+MATCHERS = [
+    _matcher("rss", "订阅列表"),
+    _matcher("rss_digest", "今日摘要", "RSS摘要"),
+    _matcher("draw", "画"),
+    _matcher("task.add"),
+    SimpleNamespace(rule=Rule(ToMeRule())),  # plain on_message: no commands
+]
+
+
+def test_collect_commands():
+    assert collect_commands(MATCHERS) == {"rss", "订阅列表", "rss_digest", "今日摘要", "RSS摘要", "draw", "画", "task.add"}
+
+
+def test_match():
+    matcher = CommandMatcher()
+    assert matcher.build(MATCHERS, starts={"/", ""}) == 8
+    assert matcher.match("rss_digest") == "rss_digest"
+    assert matcher.match("RSS 列表") == "RSS"
+    assert matcher.match("画 一只猫") == "画"
+    assert matcher.match("task.add 10点开会") == "task.add"
+    assert matcher.match("/随便什么") == "/"
+    assert matcher.match("画画真好玩") is None  # needs whitespace or end after the command
+    assert matcher.match("rssfeed 是什么") is None
+    assert matcher.match("今天天气不错") is None
+
+
+def test_empty_registry():
+    matcher = CommandMatcher()
+    matcher.build([], starts=set())
+    assert matcher.match("anything") is None
@@ -0,0 +1,89 @@
+"""
+会话串行处理测试
+验证同一会话按顺序处理、不同会话并行、排队轮次复用上下文快照以及信箱上限
+"""
+import asyncio
+import time
+
+import pytest
+
+from src.utils.conversation_actor import ConversationActors, MailboxFull
+
+
+def _actors(monkeypatch, **env) -> ConversationActors:
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+    return ConversationActors()
+
+
+def test_turns_are_serialized_per_user(monkeypatch):
+    actors = _actors(monkeypatch)
+    log = []
+
+    async def handle(user, n):
+        turn = await actors.enter(user)
+        try:
+            log.append((user, n, "start"))
+            await asyncio.sleep(0.05)
+            log.append((user, n, "end"))
+        finally:
+            turn.release()
+
+    async def main():
+        t0 = time.monotonic()
+        await asyncio.gather(handle("a", 1), handle("a", 2), handle("b", 1))
+        return time.monotonic() - t0
+
+    elapsed = asyncio.run(main())
+    a = [e for e in log if e[0] == "a"]
+    assert a == [("a", 1, "start"), ("a", 1, "end"), ("a", 2, "start"), ("a", 2, "end")]
+    assert elapsed < 0.14  # "b" ran alongside "a"
+    assert actors.stats()["active"] == 0
+
+
+def test_queued_turn_reuses_snapshot(monkeypatch):
+    actors = _actors(monkeypatch, CHAT_CONTEXT_HISTORY_KEEP="4")
+    builds = []
+
+    def build():
+        builds.append(1)
+        return [{"role": "user", "parts": [{"text": "old"}]}], "ctx"
+
+    async def handle(question):
+        turn = await actors.enter("u")
+        try:
+            history, ctx = turn.context(build)
+            await asyncio.sleep(0.01)
+            turn.record(question, f"answer to {question}")
+            return [h["parts"][0]["text"] for h in history], ctx
+        finally:
+            turn.release()
+
+    async def main():
+        results = await asyncio.gather(handle("q1"), handle("q2"), handle("q3"))
+        after_idle = await handle("q4")
+        return results, after_idle
+
+    (first, second, third), after_idle = asyncio.run(main())
+    assert first == (["old"], "ctx")
+    assert second == (["old", "q1", "answer to q1"], "ctx")
+    assert third[0] == ["q1", "answer to q1", "q2", "answer to q2"]  # trimmed to 4
+    assert after_idle == (["old"], "ctx")  # idle actor dropped: fresh build
+    assert len(builds) == 2
+    assert actors.stats()["context_reused"] == 2
+
+
+def test_mailbox_bound(monkeypatch):
+    actors = _actors(monkeypatch, CHAT_MAILBOX_MAX="1")
+
+    async def main():
+        running = await actors.enter("u")
+        waiting = asyncio.ensure_future(actors.enter("u"))
+        await asyncio.sleep(0)
+        with pytest.raises(MailboxFull):
+            await actors.enter("u")
+        running.release()
+        (await waiting).release()
+
+    asyncio.run(main())
+    assert actors.stats()["rejected"] == 1
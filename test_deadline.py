@@ -0,0 +1,104 @@
+"""
+请求时间预算测试
+验证剩余时间、按阈值降级、阶段耗时统计，以及 LLM 客户端在预算不足时跳过路由并改用快速模型
+"""
+import asyncio
+import time
+
+from src.utils.deadline import Deadline, LatencyBudget
+
+
+def test_should_degrade_below_threshold():
+    d = Deadline(10, {"skip_router": 5, "flash_model": 12})
+    assert not d.should("skip_router")
+    assert d.should("flash_model")
+    assert not d.should("unknown")
+    assert d.degraded == ["flash_model"]
+    assert 9.5 < d.remaining() <= 10 and not d.expired
+
+
+def test_stage_histogram(monkeypatch):
+    monkeypatch.setenv("CHAT_DEADLINE_SEC", "0.05")
+    budget = LatencyBudget()
+    d = budget.start()
+    time.sleep(0.02)
+    d.lap("context")
+    time.sleep(0.04)
+    d.lap("llm")
+    d.degrade("ack")
+    d.finish()
+    d.finish()  # counted once
+
+    stats = budget.stats()
+    assert stats["requests"] == 1 and stats["over_budget"] == 1
+    assert stats["stages"]["context"]["buckets"]["<=50ms"] == 1
+    assert stats["stages"]["llm"]["count"] == 1
+    assert stats["degraded"] == {"ack": 1}
+
+
+def test_client_skips_router_and_uses_fast_model(monkeypatch):
+    from src.utils.openai_client import OpenAIClient
+
+    monkeypatch.setenv("ENABLE_SMART_ROUTER", "true")
+    monkeypatch.setenv("ROUTER_MODEL", "router")
+    monkeypatch.setenv("OPENAI_MODELS_JSON", '{"chat_short": "fast", "chat_long": "slow"}')
+    client = OpenAIClient()
+    calls = []
+
+    async def fake_completions(messages, model=None, usage=None, deadline=None):
+        calls.append(model)
+        return "ok"
+
+    monkeypatch.setattr(client, "chat_completions", fake_completions)
+    long_prompt = "解释一下" * 60  # would route to chat_long
+
+    relaxed = Deadline(100, {"skip_router": 30, "flash_model": 20})
+    asyncio.run(client.generate_content("auto", long_prompt, deadline=relaxed))
+    assert calls == ["router", "slow"]  # router call + answer
+
+    calls.clear()
+    tight = Deadline(10, {"skip_router": 30, "flash_model": 20})
+    assert asyncio.run(client.generate_content("auto", long_prompt, deadline=tight)) == "ok"
+    assert calls == ["fast"]
+    assert tight.degraded == ["skip_router", "flash_model"]
+
+
+def test_retries_recompute_timeout_and_respect_backoff(monkeypatch):
+    from aiohttp import web
+    import src.utils.openai_client as oc
+
+    monkeypatch.setenv("OPENAI_MAX_RETRIES", "3")
+    monkeypatch.setenv("OPENAI_RETRY_BASE_SEC", "0.3")
+    hits = []
+    timeouts = []
+    real_timeout = oc.aiohttp.ClientTimeout
+    monkeypatch.setattr(oc.aiohttp, "ClientTimeout", lambda total=None: timeouts.append(total) or real_timeout(total=total))
+
+    async def handler(request):
+        hits.append(time.monotonic())
+        return web.Response(status=503, text="busy")
+
+    async def main():
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{port}/v1")
+            monkeypatch.setenv("OPENAI_API_KEY", "k")
+            client = oc.OpenAIClient()
+            client.timeout_sec = 60
+            deadline = Deadline(2.0, {"no_retry": 0})
+            return await client.chat_completions([{"role": "user", "content": "hi"}], deadline=deadline)
+        finally:
+            await runner.cleanup()
+
+    reply = asyncio.run(main())
+    assert reply.startswith("[Error]")
+    # backoffs 0.3s and 0.6s fit in the 2s budget, the next 1.2s would not
+    assert len(hits) == 3
+    # every attempt gets a timeout clamped to what is left at that moment
+    assert len(timeouts) == 3 and timeouts[0] <= 2.0 and timeouts[0] > timeouts[1] > timeouts[2]
@@ -0,0 +1,149 @@
+"""
+Gemini 客户端测试
+验证上传缓存按 (key, 内容哈希) 复用、缓存过期，以及多模态请求固定使用上传文件的 key
+（SDK 客户端用假实现代替，不访问网络）
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("google.genai")
+
+from src.utils import gemini_client as gc  # noqa: E402
+from src.utils.key_pool import KeyPool  # noqa: E402
+
+
+class FakeSDK:
+    """一个 key 对应的 genai.Client：记录上传和生成调用"""
+
+    def __init__(self, key):
+        self.key = key
+        self.uploads = []
+        self.generations = []
+        self.files = SimpleNamespace(upload=self._upload)
+        self.models = SimpleNamespace(generate_content=self._generate)
+
+    def _upload(self, file):
+        self.uploads.append(file)
+        n = len(self.uploads)
+        return SimpleNamespace(
+            name=f"files/{self.key}-{n}",
+            uri=f"https://files/{self.key}/{n}",
+            mime_type="image/png",
+            expiration_time=None,
+        )
+
+    def _generate(self, model, contents):
+        self.generations.append((model, contents))
+        return SimpleNamespace(
+            candidates=[],
+            usage_metadata=SimpleNamespace(total_token_count=10),
+            text=f"answer from {self.key}",
+        )
+
+
+def _client(tmp_path, monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEYS", '["key_a", "key_b"]')
+    client = gc.GeminiClient()
+    client.key_pool = KeyPool(client.api_keys, client._get_limits, snapshot_file=str(tmp_path / "usage.json"))
+    sdks = {k: FakeSDK(k) for k in client.api_keys}
+    monkeypatch.setattr(client, "_client", lambda key: sdks[key])
+    return client, sdks
+
+
+def _file(tmp_path, name="meme.png", data=b"same bytes"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def test_upload_cache_is_per_key_and_content(tmp_path, monkeypatch):
+    client, sdks = _client(tmp_path, monkeypatch)
+    a = _file(tmp_path, "a.png")
+    b = _file(tmp_path, "b.png")  # same content, different file
+
+    async def main():
+        first = await client.upload_file(a, key="key_a")
+        again = await client.upload_file(b, key="key_a")
+        other_key = await client.upload_file(a, key="key_b")
+        return first, again, other_key
+
+    first, again, other_key = asyncio.run(main())
+    assert again is first  # same content on the same key: reused
+    assert other_key is not first  # another key cannot see key_a's file
+    assert len(sdks["key_a"].uploads) == 1 and len(sdks["key_b"].uploads) == 1
+    assert client.key_for_file(first) == "key_a"
+    assert client.key_for_file(other_key) == "key_b"
+
+
+def test_unpinned_upload_reuses_any_cached_key(tmp_path, monkeypatch):
+    client, sdks = _client(tmp_path, monkeypatch)
+    path = _file(tmp_path)
+
+    async def main():
+        first = await client.upload_file(path, key="key_b")
+        return first, await client.upload_file(path, model="gemini-2.5-flash")
+
+    first, reused = asyncio.run(main())
+    assert reused is first
+    assert not sdks["key_a"].uploads
+
+
+def test_upload_cache_expires(tmp_path, monkeypatch):
+    client, sdks = _client(tmp_path, monkeypatch)
+    path = _file(tmp_path)
+    now = [1_000_000.0]
+    monkeypatch.setattr(gc.time, "time", lambda: now[0])
+
+    async def upload():
+        return await client.upload_file(path, key="key_a")
+
+    first = asyncio.run(upload())
+    now[0] += gc.UPLOAD_TTL_SEC - 60
+    assert asyncio.run(upload()) is first
+    now[0] += 120  # past the reuse window
+    assert asyncio.run(upload()) is not first
+    assert len(sdks["key_a"].uploads) == 2
+
+
+def test_expiration_time_from_api_shortens_reuse(tmp_path, monkeypatch):
+    client, _ = _client(tmp_path, monkeypatch)
+    now = 1_000_000.0
+    monkeypatch.setattr(gc.time, "time", lambda: now)
+    uploaded = SimpleNamespace(
+        name="files/x", uri="u", mime_type="image/png",
+        expiration_time=SimpleNamespace(timestamp=lambda: now + 2 * 3600),
+    )
+    client._remember_upload("key_a", "hash", uploaded)
+    # reuse stops an hour before the API deletes the file
+    assert client._upload_cache[("key_a", "hash")][1] == now + 3600
+
+
+def test_multimodal_request_pinned_to_uploading_key(tmp_path, monkeypatch):
+    client, sdks = _client(tmp_path, monkeypatch)
+    path = _file(tmp_path)
+
+    async def main():
+        # key_b uploads; key_a is the least loaded key and would be picked otherwise
+        uploaded = await client.upload_file(path, key="key_b")
+        reply = await client.generate_multimodal_content("gemini-2.5-flash", "这是什么", files=[uploaded])
+        return reply
+
+    assert asyncio.run(main()) == "answer from key_b"
+    assert not sdks["key_a"].generations
+    assert len(sdks["key_b"].generations) == 1
+    contents = sdks["key_b"].generations[0][1]
+    assert contents[0]["parts"][1]["file_data"]["file_uri"] == "https://files/key_b/1"
+
+
+def test_files_from_different_keys_are_rejected(tmp_path, monkeypatch):
+    client, sdks = _client(tmp_path, monkeypatch)
+
+    async def main():
+        a = await client.upload_file(_file(tmp_path, "a.png", b"aaa"), key="key_a")
+        b = await client.upload_file(_file(tmp_path, "b.png", b"bbb"), key="key_b")
+        return await client.generate_multimodal_content("gemini-2.5-flash", "比较", files=[a, b])
+
+    assert asyncio.run(main()).startswith("[Error]")
+    assert not sdks["key_a"].generations and not sdks["key_b"].generations
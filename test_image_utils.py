@@ -0,0 +1,83 @@
+"""
+图片处理测试
+验证单次解码缩放、透明背景处理和处理结果缓存
+"""
+import asyncio
+from io import BytesIO
+
+from PIL import Image
+
+from src.utils import image_utils
+from src.utils.image_utils import PreparedImageCache, encode_image
+
+
+def test_encode_image_downscales_and_flattens_alpha(tmp_path):
+    src = tmp_path / "sticker.png"
+    Image.new("RGBA", (3000, 1500), (0, 0, 0, 0)).save(src)
+
+    out = Image.open(BytesIO(encode_image(src, max_px=1024, quality=85)))
+    assert out.format == "JPEG"
+    assert out.size == (1024, 512)
+    assert out.getpixel((10, 10)) == (255, 255, 255)
+
+
+def test_encode_image_accepts_bytes():
+    buf = BytesIO()
+    Image.new("RGB", (4000, 3000), (10, 200, 10)).save(buf, format="JPEG")
+    out = Image.open(BytesIO(encode_image(buf.getvalue(), max_px=800)))
+    assert max(out.size) == 800
+
+
+def test_prepared_cache_lru_by_bytes():
+    cache = PreparedImageCache(max_bytes=10)
+    cache.put(("a", 1, 1), "aaaa")
+    cache.put(("b", 1, 1), "bbbb")
+    assert cache.get(("a", 1, 1)) == "aaaa"
+    cache.put(("c", 1, 1), "cccc")  # evicts b (least recently used)
+    assert cache.get(("b", 1, 1)) is None
+    assert cache.stats()["entries"] == 2
+
+
+def test_repeated_image_skips_work(tmp_path, monkeypatch):
+    src = tmp_path / "photo.jpg"
+    Image.new("RGB", (2000, 1000), (1, 2, 3)).save(src)
+    calls = []
+
+    async def fake_pool(func, *args):
+        calls.append(args)
+        return func(*args)
+
+    monkeypatch.setattr(image_utils, "run_in_image_pool", fake_pool)
+    monkeypatch.setattr(image_utils, "prepared_cache", PreparedImageCache(1 << 20))
+
+    async def run():
+        first = await image_utils.image_file_to_data_url_async(src, 512, 80, content_hash="h1")
+        second = await image_utils.image_file_to_data_url_async(src, 512, 80, content_hash="h1")
+        other_size = await image_utils.image_file_to_data_url_async(src, 256, 80, content_hash="h1")
+        return first, second, other_size
+
+    first, second, other_size = asyncio.run(run())
+    assert first == second and first.startswith("data:image/jpeg;base64,")
+    assert other_size != first
+    assert len(calls) == 2
+
+
+def test_start_pool_forks_all_workers_up_front(monkeypatch):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return
+    monkeypatch.setenv("IMAGE_WORKERS", "2")
+    image_utils.shutdown_pool()
+    image_utils.start_pool()
+    try:
+        pool = image_utils._pool
+        assert isinstance(pool, ProcessPoolExecutor)
+        assert len(pool._processes) == 2
+        buf = BytesIO()
+        Image.new("RGB", (64, 64)).save(buf, format="PNG")
+        out = asyncio.run(image_utils.run_in_image_pool(encode_image, buf.getvalue(), 32))
+        assert Image.open(BytesIO(out)).size == (32, 32)
+    finally:
+        image_utils.shutdown_pool()
@@ -0,0 +1,112 @@
+"""
+Gemini Key 池测试
+验证滑动窗口、最低负载选择和快照持久化
+"""
+import json
+
+from src.utils.key_pool import KeyPool
+
+LIMITS = {"m": {"rpm": 2, "tpm": 1000, "rpd": 100}}
+
+
+def _pool(tmp_path, keys=("key_a", "key_b")):
+    return KeyPool(list(keys), lambda i: LIMITS, snapshot_file=str(tmp_path / "usage.json"))
+
+
+def test_picks_least_loaded_key(tmp_path):
+    pool = _pool(tmp_path)
+    assert pool.acquire("m").key == "key_a"
+    assert pool.acquire("m").key == "key_b"
+    assert pool.acquire("m").key in ("key_a", "key_b")
+    assert pool.acquire("m").key in ("key_a", "key_b")
+    # both keys at rpm=2
+    assert pool.acquire("m") is None
+
+
+def test_exclude_and_token_limit(tmp_path):
+    pool = _pool(tmp_path)
+    lease = pool.acquire("m")
+    assert lease.key == "key_a"
+    pool.commit(lease, 1000)
+    assert pool.acquire("m", exclude={"key_b"}) is None
+    headroom = pool.headroom()
+    assert headroom["key1(key_...)"]["m"] == {"rpm": 1, "tpm": 0, "rpd": 99}
+    assert headroom["key2(key_...)"]["m"]["tpm"] == 1000
+
+
+def test_window_expires(tmp_path, monkeypatch):
+    import src.utils.key_pool as kp
+    now = [1000.0]
+    monkeypatch.setattr(kp.time, "time", lambda: now[0])
+    pool = _pool(tmp_path, keys=("key_a",))
+    pool.acquire("m")
+    pool.acquire("m")
+    assert pool.acquire("m") is None
+    now[0] += 61
+    assert pool.acquire("m").key == "key_a"
+
+
+def test_snapshot_roundtrip(tmp_path):
+    pool = _pool(tmp_path)
+    lease = pool.acquire("m")
+    key = lease.key
+    pool.commit(lease, 50)
+    pool.flush()
+    data = json.loads((tmp_path / "usage.json").read_text())
+    assert data["keys"][key]["m"]["rpd"] == 1
+
+    restored = _pool(tmp_path)
+    assert restored.windows[(key, "m")].rpd == 1
+    assert restored.windows[(key, "m")].tokens == 50
+
+
+def test_commit_charges_own_request(tmp_path, monkeypatch):
+    import src.utils.key_pool as kp
+    now = [1000.0]
+    monkeypatch.setattr(kp.time, "time", lambda: now[0])
+    pool = _pool(tmp_path, keys=("key_a",))
+    first = pool.acquire("m")
+    now[0] += 30
+    second = pool.acquire("m")
+    # responses come back out of order
+    pool.commit(second, 200)
+    pool.commit(first, 700)
+    window = pool.windows[("key_a", "m")]
+    assert [e.tokens for e in window.events] == [700, 200]
+    # the first request leaves the window together with its own tokens
+    now[0] += 31
+    assert pool.headroom()["key1(key_...)"]["m"]["tpm"] == 800
+
+
+def test_commit_after_prune_keeps_window_sum(tmp_path, monkeypatch):
+    import src.utils.key_pool as kp
+    now = [1000.0]
+    monkeypatch.setattr(kp.time, "time", lambda: now[0])
+    pool = _pool(tmp_path, keys=("key_a",))
+    slow = pool.acquire("m")
+    now[0] += 61
+    pool.acquire("m")  # prunes the slow request's event
+    pool.commit(slow, 500)
+    assert pool.windows[("key_a", "m")].tokens == 0
+
+
+def test_close_flushes(tmp_path):
+    import asyncio
+
+    async def run():
+        pool = _pool(tmp_path)
+        pool.commit(pool.acquire("m"), 10)
+        await pool.close()
+
+    asyncio.run(run())
+    data = json.loads((tmp_path / "usage.json").read_text())
+    assert data["keys"]["key_a"]["m"]["window"][0][1] == 10
+
+
+def test_ranked_orders_by_load_without_reserving(tmp_path):
+    pool = _pool(tmp_path)
+    pool.acquire("m")  # key_a now has one request
+    assert pool.ranked("m") == ["key_b", "key_a"]
+    assert pool.ranked() == ["key_b", "key_a"]
+    assert pool.ranked("m", exclude={"key_b"}) == ["key_a"]
+    assert pool.windows[("key_b", "m")].rpd == 0
@@ -0,0 +1,77 @@
+"""
+媒体缓存索引测试
+验证内容去重、按容量预算的 LRU 淘汰和索引持久化
+"""
+import asyncio
+import hashlib
+import os
+import time
+
+from src.utils.media_cache import MediaCache
+
+
+def _put(cache, tmp_path, url_hash, data, media_type="image"):
+    d = tmp_path / "images"
+    d.mkdir(exist_ok=True)
+    tmp = d / f"{url_hash}.part"
+    tmp.write_bytes(data)
+    content_hash = hashlib.sha256(data).hexdigest()
+    return cache.store(url_hash, media_type, tmp, content_hash, len(data), ".jpg", "image/jpeg")
+
+
+def test_same_bytes_under_different_urls_stored_once(tmp_path):
+    cache = MediaCache(tmp_path)
+    p1 = _put(cache, tmp_path, "url1", b"meme")
+    p2 = _put(cache, tmp_path, "url2", b"meme")
+    assert p1 == p2
+    assert cache.lookup("url2", "image") == p1
+    assert cache.stats()["image"]["files"] == 1
+    assert not list((tmp_path / "images").glob("*.part"))
+
+
+def test_lru_eviction_respects_budget(tmp_path, monkeypatch):
+    monkeypatch.setenv("MEDIA_CACHE_IMAGE_MB", "1")
+    cache = MediaCache(tmp_path)
+    block = 400 * 1024
+    a = _put(cache, tmp_path, "a", b"a" * block)
+    _put(cache, tmp_path, "b", b"b" * block)
+    cache.lookup("a", "image")  # a becomes most recently used
+    _put(cache, tmp_path, "c", b"c" * block)
+
+    assert cache.lookup("b", "image") is None
+    assert cache.lookup("a", "image") == a
+    assert cache.stats()["image"]["bytes"] <= 1024 * 1024
+
+
+def test_index_survives_restart(tmp_path):
+    cache = MediaCache(tmp_path)
+    path = _put(cache, tmp_path, "url1", b"png")
+    cache._conn.close()
+
+    reopened = MediaCache(tmp_path)
+    assert reopened.lookup("url1", "image") == path
+
+
+def test_cleanup_expires_unused_entries(tmp_path, monkeypatch):
+    cache = MediaCache(tmp_path)
+    path = _put(cache, tmp_path, "url1", b"old")
+    cache._lru["image"][next(iter(cache._lru["image"]))].last_access -= 48 * 3600
+    assert asyncio.run(cache.cleanup()) >= 1
+    assert not path.exists()
+    assert cache.lookup("url1", "image") is None
+
+
+def test_cleanup_removes_only_old_orphans(tmp_path):
+    cache = MediaCache(tmp_path)
+    kept = _put(cache, tmp_path, "url1", b"indexed")
+    old_orphan = tmp_path / "images" / "stale.jpg"
+    old_orphan.write_bytes(b"x")
+    past = time.time() - 2 * 3600
+    os.utime(old_orphan, (past, past))
+    os.utime(kept, (past, past))
+    fresh_part = tmp_path / "images" / "inflight.part"
+    fresh_part.write_bytes(b"y")
+
+    assert asyncio.run(cache.cleanup()) == 1
+    assert not old_orphan.exists()
+    assert kept.exists() and fresh_part.exists()
@@ -0,0 +1,257 @@
+"""
+媒体下载器测试
+验证同一 URL 并发下载只传输一次，以及失败时的清理
+"""
+import asyncio
+
+from aiohttp import web
+
+from src.utils.media_downloader import MediaDownloader
+
+
+async def _serve(handler):
+    app = web.Application()
+    app.router.add_get("/{name}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+def _downloader(tmp_path, monkeypatch):
+    monkeypatch.setenv("MEDIA_CACHE_DIR", str(tmp_path))
+    md = MediaDownloader()
+    md._normalize_url = lambda url: url  # keep 127.0.0.1 (no napcat container here)
+    return md
+
+
+def test_concurrent_downloads_share_one_transfer(tmp_path, monkeypatch):
+    md = _downloader(tmp_path, monkeypatch)
+    hits = []
+
+    async def handler(request):
+        hits.append(request.path)
+        await asyncio.sleep(0.1)
+        return web.Response(body=b"x" * 1000)
+
+    async def run():
+        runner, port = await _serve(handler)
+        url = f"http://127.0.0.1:{port}/meme.jpg"
+        try:
+            paths = await asyncio.gather(*(md.download_image(url) for _ in range(5)))
+        finally:
+            await md.close()
+            await runner.cleanup()
+        return paths
+
+    paths = asyncio.run(run())
+    assert len(hits) == 1
+    assert len(set(paths)) == 1 and paths[0].read_bytes() == b"x" * 1000
+    assert not md._inflight
+
+
+def test_failed_download_is_shared_and_cleaned_up(tmp_path, monkeypatch):
+    md = _downloader(tmp_path, monkeypatch)
+
+    async def handler(request):
+        await asyncio.sleep(0.05)
+        return web.Response(status=404)
+
+    async def run():
+        runner, port = await _serve(handler)
+        url = f"http://127.0.0.1:{port}/gone.jpg"
+        try:
+            return await asyncio.gather(*(md.download_image(url) for _ in range(3)), return_exceptions=True)
+        finally:
+            await md.close()
+            await runner.cleanup()
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, Exception) for r in results)
+    assert not md._inflight
+    assert not list((tmp_path / "images").glob("*.part"))
+
+
+def test_transfer_cancelled_only_when_every_waiter_leaves(tmp_path, monkeypatch):
+    md = _downloader(tmp_path, monkeypatch)
+    release = asyncio.Event()
+
+    async def handler(request):
+        await release.wait()
+        return web.Response(body=b"v" * 1000)
+
+    async def run():
+        runner, port = await _serve(handler)
+        try:
+            # two waiters, one gives up: the other still gets the file
+            url = f"http://127.0.0.1:{port}/shared.mp4"
+            first = asyncio.ensure_future(md.download_video(url))
+            second = asyncio.ensure_future(md.download_video(url))
+            await asyncio.sleep(0.05)
+            first.cancel()
+            await asyncio.sleep(0.05)
+            assert not md._inflight[("video", md._get_url_hash(url))].task.done()
+            release.set()
+            path = await second
+
+            # the only waiter gives up: the transfer itself stops
+            release.clear()
+            url = f"http://127.0.0.1:{port}/alone.mp4"
+            alone = asyncio.ensure_future(md.download_video(url))
+            await asyncio.sleep(0.05)
+            task = md._inflight[("video", md._get_url_hash(url))].task
+            alone.cancel()
+            await asyncio.sleep(0.05)
+            cancelled = task.cancelled()
+            release.set()
+        finally:
+            await md.close()
+            await runner.cleanup()
+        return path, cancelled
+
+    path, cancelled = asyncio.run(run())
+    assert path.read_bytes() == b"v" * 1000
+    assert cancelled
+    assert not md._inflight
+    assert not list((tmp_path / "videos").glob("*.part"))
+
+
+def _streaming_handler(chunks, delay=0.02, length=None):
+    async def handler(request):
+        resp = web.StreamResponse()
+        if length is not None:
+            resp.content_length = length
+        await resp.prepare(request)
+        for chunk in chunks:
+            await resp.write(chunk)
+            await asyncio.sleep(delay)
+        await resp.write_eof()
+        return resp
+    return handler
+
+
+def test_streams_through_part_file_into_cache(tmp_path, monkeypatch):
+    import hashlib
+
+    md = _downloader(tmp_path, monkeypatch)
+    chunks = [bytes([i]) * 100_000 for i in range(5)]
+    seen_part = []
+
+    async def run():
+        runner, port = await _serve(_streaming_handler(chunks))
+        try:
+            task = asyncio.ensure_future(md.download_video(f"http://127.0.0.1:{port}/clip.mp4"))
+            await asyncio.sleep(0.05)
+            seen_part.extend((tmp_path / "videos").glob("*.part"))
+            return await task
+        finally:
+            await md.close()
+            await runner.cleanup()
+
+    path = asyncio.run(run())
+    body = b"".join(chunks)
+    assert seen_part  # written incrementally, not buffered in memory first
+    assert path.read_bytes() == body
+    assert path.stem == hashlib.sha256(body).hexdigest()
+    assert not list((tmp_path / "videos").glob("*.part"))
+
+
+def test_size_limit_enforced_mid_stream(tmp_path, monkeypatch):
+    from src.utils.media_downloader import MediaTooLargeError
+
+    md = _downloader(tmp_path, monkeypatch)
+    hits = []
+    stream = _streaming_handler([b"x" * 64 * 1024] * 10, delay=0)
+
+    async def handler(request):
+        hits.append(request.path)
+        return await stream(request)
+
+    async def run():
+        runner, port = await _serve(handler)
+        try:
+            return await asyncio.gather(
+                md.download_video(f"http://127.0.0.1:{port}/big.mp4", max_bytes=200 * 1024),
+                return_exceptions=True,
+            )
+        finally:
+            await md.close()
+            await runner.cleanup()
+
+    [error] = asyncio.run(run())
+    assert isinstance(error, MediaTooLargeError)  # not wrapped into a generic download error
+    assert len(hits) == 1  # not retried
+    assert not list((tmp_path / "videos").iterdir())
+
+
+def test_declared_length_over_limit_rejected_up_front(tmp_path, monkeypatch):
+    from src.utils.media_downloader import MediaTooLargeError
+
+    md = _downloader(tmp_path, monkeypatch)
+
+    async def handler(request):
+        return web.Response(body=b"x" * 300 * 1024)
+
+    async def run():
+        runner, port = await _serve(handler)
+        try:
+            return await asyncio.gather(
+                md.download_video(f"http://127.0.0.1:{port}/big.mp4", max_bytes=100 * 1024),
+                return_exceptions=True,
+            )
+        finally:
+            await md.close()
+            await runner.cleanup()
+
+    [error] = asyncio.run(run())
+    assert isinstance(error, MediaTooLargeError) and "File too large" in str(error)
+
+
+def test_failed_or_cancelled_stream_leaves_no_part_file(tmp_path, monkeypatch):
+    md = _downloader(tmp_path, monkeypatch)
+
+    async def broken(request):
+        resp = web.StreamResponse()
+        resp.content_length = 1_000_000
+        await resp.prepare(request)
+        await resp.write(b"x" * 1000)
+        request.transport.close()  # connection dies mid-body
+        return resp
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/broken.mp4", broken)
+        app.router.add_get("/slow.mp4", _streaming_handler([b"y" * 1000] * 50, delay=0.05))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(asyncio, "sleep", _fast_sleep)
+        try:
+            failed = await asyncio.gather(md.download_video(f"http://127.0.0.1:{port}/broken.mp4"),
+                                          return_exceptions=True)
+            slow = asyncio.ensure_future(md.download_video(f"http://127.0.0.1:{port}/slow.mp4"))
+            await _real_sleep(0.1)
+            parts_mid_stream = list((tmp_path / "videos").glob("*.part"))
+            slow.cancel()
+            await _real_sleep(0.05)
+        finally:
+            await md.close()
+            await runner.cleanup()
+        return failed[0], parts_mid_stream
+
+    error, parts_mid_stream = asyncio.run(run())
+    assert "Download failed after 3 attempts" in str(error)
+    assert error.__cause__ is not None  # original aiohttp error kept in the chain
+    assert parts_mid_stream
+    assert not list((tmp_path / "videos").glob("*.part"))
+
+
+_real_sleep = asyncio.sleep
+
+
+async def _fast_sleep(delay, *args, **kwargs):
+    # skip the 1s retry backoff in _fetch; short sleeps (streaming handlers) still happen
+    return await _real_sleep(min(delay, 0.05), *args, **kwargs)
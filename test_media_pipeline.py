@@ -0,0 +1,141 @@
+"""
+媒体处理流水线测试
+验证结果顺序与消息中一致、并发上限、单个附件失败不影响其他附件，以及图片/语音产出的 content parts
+（下载和转码用假实现代替，不访问网络、不需要 ffmpeg）
+"""
+import asyncio
+import base64
+from io import BytesIO
+from types import SimpleNamespace
+
+from PIL import Image
+
+from src.utils import media_pipeline as mp
+from src.utils.audio_converter import ConvertedAudio, audio_converter
+
+
+def _image_file(tmp_path, name, color):
+    path = tmp_path / f"{name}.png"
+    Image.new("RGB", (2000, 1000), color).save(path)
+    return path
+
+
+def _parsed(images=(), audios=()):
+    return SimpleNamespace(
+        images=[SimpleNamespace(url=u, file=u.rsplit("/", 1)[-1]) for u in images],
+        audios=[SimpleNamespace(url=u) for u in audios],
+        videos=[],
+    )
+
+
+class FakeDownloader:
+    """按 URL 返回本地文件，可设置每个 URL 的耗时和失败"""
+
+    def __init__(self, files, delays=None, fail=()):
+        self.files = files
+        self.delays = delays or {}
+        self.fail = set(fail)
+        self.active = 0
+        self.max_active = 0
+
+    async def _get(self, url):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delays.get(url, 0.01))
+            if url in self.fail:
+                raise Exception("Download failed after 3 attempts: 404")
+            return self.files[url]
+        finally:
+            self.active -= 1
+
+    async def download_image(self, url, filename_hint=None):
+        return await self._get(url)
+
+    async def download_audio(self, url):
+        return await self._get(url)
+
+    def get_content_hash(self, url):
+        return None
+
+
+def _pipeline(monkeypatch, downloader, **env):
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+    monkeypatch.setattr(mp, "media_downloader", downloader)
+    return mp.MediaPipeline()
+
+
+def test_results_keep_message_order(tmp_path, monkeypatch):
+    urls = [f"http://x/{i}.png" for i in range(3)]
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+    files = {u: _image_file(tmp_path, str(i), c) for i, (u, c) in enumerate(zip(urls, colors))}
+    # the first image finishes last
+    downloader = FakeDownloader(files, delays={urls[0]: 0.15, urls[1]: 0.05, urls[2]: 0.01})
+    pipeline = _pipeline(monkeypatch, downloader, MAX_IMAGE_COUNT="3")
+
+    batch = asyncio.run(pipeline.process(_parsed(images=urls)))
+
+    assert [r.index for r in batch.results] == [0, 1, 2]
+    decoded = []
+    for part in batch.parts:
+        assert part["type"] == "image_url"
+        data = base64.b64decode(part["image_url"]["url"].split(",", 1)[1])
+        img = Image.open(BytesIO(data))
+        assert max(img.size) == 1024  # downscaled to IMAGE_MAX_PX
+        decoded.append(img.convert("RGB").getpixel((10, 10)))
+    assert [max(range(3), key=lambda c: px[c]) for px in decoded] == [0, 1, 2]
+    assert len(batch.image_hashes) == 3
+
+
+def test_concurrency_limit(tmp_path, monkeypatch):
+    urls = [f"http://x/{i}.png" for i in range(5)]
+    path = _image_file(tmp_path, "same", (9, 9, 9))
+    downloader = FakeDownloader({u: path for u in urls}, delays={u: 0.05 for u in urls})
+    pipeline = _pipeline(monkeypatch, downloader, MAX_IMAGE_COUNT="5", MEDIA_PIPELINE_CONCURRENCY="2")
+
+    batch = asyncio.run(pipeline.process(_parsed(images=urls)))
+
+    assert len(batch.parts) == 5
+    assert downloader.max_active == 2
+
+
+def test_failing_item_does_not_break_others(tmp_path, monkeypatch):
+    urls = [f"http://x/{i}.png" for i in range(3)]
+    files = {u: _image_file(tmp_path, str(i), (i * 50, 0, 0)) for i, u in enumerate(urls)}
+    downloader = FakeDownloader(files, fail={urls[1]})
+    pipeline = _pipeline(monkeypatch, downloader, MAX_IMAGE_COUNT="3")
+
+    batch = asyncio.run(pipeline.process(_parsed(images=urls)))
+
+    assert [r.part is not None for r in batch.results] == [True, False, True]
+    assert len(batch.parts) == 2
+    [error] = batch.errors
+    assert error.index == 1 and "Download failed" in error.error
+
+
+def test_audio_becomes_input_audio_part(tmp_path, monkeypatch):
+    voice = tmp_path / "voice.amr"
+    voice.write_bytes(b"#!AMR\n" + b"\0" * 32)
+    img = _image_file(tmp_path, "pic", (1, 2, 3))
+    downloader = FakeDownloader({"http://x/voice.amr": voice, "http://x/pic.png": img})
+    converted = []
+
+    async def fake_convert(file_path, content_hash=None, **kwargs):
+        converted.append(file_path)
+        return ConvertedAudio(data=b"ID3fake-mp3", format="mp3")
+
+    monkeypatch.setattr(audio_converter, "convert", fake_convert)
+    pipeline = _pipeline(monkeypatch, downloader)
+
+    batch = asyncio.run(pipeline.process(_parsed(images=["http://x/pic.png"], audios=["http://x/voice.amr"])))
+
+    assert converted == [voice]
+    image_part, audio_part = batch.parts
+    assert image_part["type"] == "image_url"
+    assert image_part["image_url"]["url"].startswith("data:image/jpeg;base64,")
+    assert audio_part == {
+        "type": "input_audio",
+        "input_audio": {"data": base64.b64encode(b"ID3fake-mp3").decode("ascii"), "format": "mp3"},
+    }
+    assert set(batch.stage_totals()) >= {"download", "encode", "transcode"}
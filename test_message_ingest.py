@@ -0,0 +1,84 @@
+"""
+消息接入测试
+验证单次遍历解析结果与逐项提取一致、同一事件只解析一次、消费者并发执行且互不影响
+"""
+import asyncio
+import time
+
+from nonebot.adapters.onebot.v11 import Message, MessageSegment
+
+from src.utils.message_ingest import MessageIngest
+from src.utils.message_parser import message_parser
+
+
+class FakeEvent:
+    def __init__(self, message: Message, message_id: int = 1):
+        self.message = message
+        self.message_id = message_id
+
+
+def _message() -> Message:
+    return Message([
+        MessageSegment.at(123),
+        MessageSegment.text("看看"),
+        MessageSegment.image("http://img/a.jpg"),
+        MessageSegment.text(" 这个"),
+        MessageSegment("record", {"file": "http://voice/1.amr"}),
+        MessageSegment("video", {"file": "local.mp4"}),
+        MessageSegment.at("all"),
+    ])
+
+
+def test_single_pass_matches_extractors():
+    msg = _message()
+    parsed = message_parser.parse_message(FakeEvent(msg))
+    assert parsed.text == message_parser.extract_text(msg) == "@123 看看  这个"
+    assert parsed.images == message_parser.extract_images(msg)
+    assert parsed.audios == message_parser.extract_audios(msg)
+    assert [v.url for v in parsed.videos] == [None]
+    assert parsed.plain_text == msg.extract_plain_text()
+    assert parsed.has_media
+
+
+def test_parse_is_shared_between_consumers_and_chat():
+    ingest = MessageIngest()
+    seen = []
+
+    async def consumer(event, parsed):
+        seen.append(parsed)
+
+    ingest.register("a", consumer, group_only=False)
+    ingest.register("b", consumer, group_only=False)
+    event = FakeEvent(_message())
+
+    asyncio.run(ingest.dispatch(event))
+    assert seen[0] is seen[1] is ingest.parse(event)
+    stats = ingest.stats()
+    assert (stats["parses"], stats["parse_reuses"]) == (1, 1)
+
+
+def test_consumers_run_concurrently_and_fail_independently():
+    ingest = MessageIngest()
+    done = []
+
+    async def slow(event, parsed):
+        await asyncio.sleep(0.1)
+        done.append("slow")
+
+    async def broken(event, parsed):
+        raise RuntimeError("db locked")
+
+    ingest.register("slow1", slow, group_only=False)
+    ingest.register("slow2", slow, group_only=False)
+    ingest.register("broken", broken, group_only=False)
+    ingest.register("group", slow)  # private-style event: skipped
+
+    t0 = time.monotonic()
+    asyncio.run(ingest.dispatch(FakeEvent(_message())))
+    assert time.monotonic() - t0 < 0.18
+    assert done == ["slow", "slow"]
+
+    consumers = ingest.stats()["consumers"]
+    assert consumers["broken"]["errors"] == 1
+    assert consumers["slow1"]["calls"] == 1 and consumers["slow1"]["avg_ms"] >= 90
+    assert consumers["group"]["calls"] == 0
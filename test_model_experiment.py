@@ -0,0 +1,59 @@
+"""
+模型路由 A/B 实验测试
+验证分桶稳定性、权重分布和报告对比
+"""
+import json
+
+from src.utils.model_experiment import ModelExperiment, bucket
+
+
+def _make_experiment(monkeypatch, arms):
+    monkeypatch.setenv("MODEL_EXPERIMENT_JSON", json.dumps({"name": "t", "arms": arms}))
+    return ModelExperiment()
+
+
+def test_disabled_without_config(monkeypatch):
+    monkeypatch.delenv("MODEL_EXPERIMENT_JSON", raising=False)
+    exp = ModelExperiment()
+    assert not exp.enabled
+    assert exp.assign("user_1") is None
+    assert exp.report() == {"enabled": False}
+
+
+def test_assignment_is_deterministic(monkeypatch):
+    exp = _make_experiment(monkeypatch, [
+        {"name": "control", "weight": 50},
+        {"name": "pro", "weight": 50, "models": {"chat_short": "gemini-3-pro-high"}},
+    ])
+    first = [exp.assign(f"group_1_user_{i}").name for i in range(200)]
+    second = [exp.assign(f"group_1_user_{i}").name for i in range(200)]
+    assert first == second
+    assert bucket("t", "user_1", 100) == bucket("t", "user_1", 100)
+
+
+def test_weights_are_respected(monkeypatch):
+    exp = _make_experiment(monkeypatch, [
+        {"name": "control", "weight": 90},
+        {"name": "pro", "weight": 10},
+    ])
+    names = [exp.assign(f"user_{i}").name for i in range(5000)]
+    share = names.count("pro") / len(names)
+    assert 0.07 < share < 0.13
+
+
+def test_report_compares_against_control(monkeypatch):
+    exp = _make_experiment(monkeypatch, [
+        {"name": "control", "weight": 1},
+        {"name": "pro", "weight": 1},
+    ])
+    control, pro = exp.arms
+    exp.record(control, 1.0, "a" * 10, {"prompt_tokens": 100, "completion_tokens": 20})
+    exp.record(pro, 2.0, "a" * 20, {"prompt_tokens": 100, "completion_tokens": 40})
+    exp.record(pro, 0.5, "[Error] API 调用失败（HTTP 500）", error=True)
+
+    report = exp.report()
+    assert report["control"] == "control"
+    assert report["arms"]["pro"]["requests"] == 2
+    assert report["arms"]["pro"]["error_rate"] == 0.5
+    assert report["arms"]["pro"]["avg_reply_chars"] == 20
+    assert report["vs_control"]["pro"]["avg_completion_tokens"] == 1.0
@@ -0,0 +1,283 @@
+"""
+发送队列测试
+验证按目标限速、回复优先、同目标保持顺序、退避重试、合并转发降级和同时段推送合并
+"""
+import asyncio
+import time
+
+import pytest
+from nonebot.adapters.onebot.v11.exception import ActionFailed, NetworkError
+
+from src.utils.message_forwarder import (
+    PRIORITY_PUSH,
+    PRIORITY_REPLY,
+    OutboundDispatcher,
+    OutboundQueueFull,
+    TokenBucket,
+)
+
+
+class FakeBot:
+    self_id = "10000"
+
+    def __init__(self, fail_times: int = 0, fail_forward: bool = False, delay: float = 0.0, error=None):
+        self.sent = []  # (api, target, content, t)
+        self.fail_times = fail_times
+        self.fail_forward = fail_forward
+        self.delay = delay
+        self.error = error or (lambda: ActionFailed(status="failed", retcode=100, message="发送失败"))
+        self.attempts = 0
+
+    async def _record(self, api, target, content):
+        self.attempts += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise self.error()
+        self.sent.append((api, target, content, time.monotonic()))
+        return {"message_id": len(self.sent)}
+
+    async def send_group_msg(self, group_id, message):
+        return await self._record("group", group_id, message)
+
+    async def send_private_msg(self, user_id, message):
+        return await self._record("private", user_id, message)
+
+    async def call_api(self, api, **kwargs):
+        if self.fail_forward:
+            raise ActionFailed(status="failed", retcode=100, message="风控")
+        target = kwargs.get("group_id") or kwargs.get("user_id")
+        return await self._record(api, target, kwargs["messages"])
+
+
+def _dispatcher(monkeypatch, **env) -> OutboundDispatcher:
+    defaults = {
+        "OUTBOUND_GLOBAL_RATE": "0",
+        "OUTBOUND_TARGET_RATE": "0",
+        "OUTBOUND_RETRY_BASE_SEC": "0.01",
+        "OUTBOUND_COALESCE_WINDOW_SEC": "0",
+    }
+    for k, v in {**defaults, **env}.items():
+        monkeypatch.setenv(k, v)
+    return OutboundDispatcher()
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    bucket.take()
+    bucket.take()
+    assert 0.05 < bucket.wait_time() <= 0.1
+
+
+def test_per_target_rate_limit_does_not_block_other_targets(monkeypatch):
+    d = _dispatcher(monkeypatch, OUTBOUND_TARGET_RATE="10", OUTBOUND_TARGET_BURST="1")
+    bot = FakeBot()
+
+    async def main():
+        t0 = time.monotonic()
+        await asyncio.gather(
+            *(d.send(bot, "group", 1, f"g1-{i}") for i in range(3)),
+            d.send(bot, "group", 2, "g2-0"),
+        )
+        await d.close()
+        return t0
+
+    t0 = asyncio.run(main())
+    g1 = [(c, t - t0) for api, target, c, t in bot.sent if target == 1]
+    g2 = [t - t0 for api, target, c, t in bot.sent if target == 2]
+    assert [c for c, _ in g1] == ["g1-0", "g1-1", "g1-2"]  # order kept within a target
+    assert g1[-1][1] >= 0.18  # 3 sends at 10/s with burst 1
+    assert g2[0] < 0.05  # group 2 not stuck behind group 1
+
+
+def test_replies_jump_ahead_of_pushes(monkeypatch):
+    d = _dispatcher(monkeypatch, OUTBOUND_GLOBAL_RATE="20", OUTBOUND_GLOBAL_BURST="1")
+    bot = FakeBot()
+
+    async def main():
+        pushes = [asyncio.ensure_future(d.send(bot, "group", 100 + i, "push", priority=PRIORITY_PUSH))
+                  for i in range(5)]
+        await asyncio.sleep(0)
+        reply = d.send(bot, "group", 999, "reply", priority=PRIORITY_REPLY)
+        await asyncio.gather(reply, *pushes)
+        await d.close()
+
+    asyncio.run(main())
+    order = [c for _, _, c, _ in bot.sent]
+    assert order.index("reply") <= 1
+    assert d.stats()["sent"] == 6
+
+
+def test_retry_then_forward_fallback(monkeypatch):
+    d = _dispatcher(monkeypatch, OUTBOUND_MAX_RETRIES="2")
+    flaky = FakeBot(fail_times=2)
+    blocked = FakeBot(fail_forward=True)
+    dead = FakeBot(fail_times=10)
+
+    async def main():
+        await d.send(flaky, "group", 1, "hello")
+        await d.send(blocked, "private", 2, "long text", nodes=[{"type": "node"}])
+        with pytest.raises(ActionFailed):
+            await d.send(dead, "group", 3, "never")
+        await d.close()
+
+    asyncio.run(main())
+    assert [c for _, _, c, _ in flaky.sent] == ["hello"]
+    assert blocked.sent[0][:3] == ("private", 2, "long text")  # plain send after forward failed
+    stats = d.stats()
+    assert (stats["sent"], stats["failed"], stats["fallbacks"]) == (2, 1, 1)
+    assert stats["retries"] == 4
+
+
+def test_queue_bound(monkeypatch):
+    d = _dispatcher(monkeypatch, OUTBOUND_QUEUE_MAX="2")
+    bot = FakeBot(delay=0.05)
+
+    async def main():
+        await d.send(bot, "group", 1, "a", wait=False)
+        await d.send(bot, "group", 1, "b", wait=False)
+        with pytest.raises(OutboundQueueFull):
+            await d.send(bot, "group", 1, "c", wait=False)
+        while d.stats()["sent"] < 2:
+            await asyncio.sleep(0.01)
+        await d.close()
+
+    asyncio.run(main())
+    assert d.stats()["rejected"] == 1
+
+
+def test_broadcast_renders_once_and_fans_out(monkeypatch):
+    import src.utils.message_forwarder as mf
+
+    d = _dispatcher(monkeypatch, OUTBOUND_GLOBAL_RATE="0")
+    monkeypatch.setattr(mf, "outbound", d)
+    renders = []
+    real_split = mf.split_text_into_paragraphs
+    monkeypatch.setattr(mf, "split_text_into_paragraphs", lambda text: renders.append(text) or real_split(text))
+    bot = FakeBot(delay=0.05)
+
+    async def main():
+        t0 = time.monotonic()
+        result = await mf.broadcast(bot, [("group", g) for g in range(30)], "x" * 300, threshold=100, concurrency=10)
+        await d.close()
+        return result, time.monotonic() - t0
+
+    result, elapsed = asyncio.run(main())
+    assert result == {"sent": 30, "failed": 0}
+    assert len(renders) == 1
+    assert {api for api, *_ in bot.sent} == {"send_group_forward_msg"}
+    assert elapsed < 0.05 * 30 / 2  # concurrent, not one after another
+
+
+def test_pushes_to_same_group_are_coalesced(monkeypatch):
+    d = _dispatcher(monkeypatch, OUTBOUND_COALESCE_WINDOW_SEC="0.1")
+    bot = FakeBot()
+
+    async def main():
+        ranking = d.send(bot, "group", 1, "水群榜")
+        summary = d.send(bot, "group", 1, "夜间总结", nodes=[{"type": "node", "data": {"content": "a"}},
+                                                        {"type": "node", "data": {"content": "b"}}])
+        other = d.send(bot, "group", 2, "别的群")
+        results = await asyncio.gather(ranking, summary, other)
+        await d.close()
+        return results
+
+    results = asyncio.run(main())
+    to_group_1 = [s for s in bot.sent if s[1] == 1]
+    assert len(to_group_1) == 1 and to_group_1[0][0] == "send_group_forward_msg"
+    assert [n["data"]["content"] for n in to_group_1[0][2]] == ["水群榜", "a", "b"]
+    assert results[0] == results[1]  # both callers see the merged send
+    assert [s[0] for s in bot.sent if s[1] == 2] == ["group"]  # a single push stays a plain message
+    assert d.stats()["coalesced"] == 1
+
+
+def test_reply_is_not_held_by_coalescing(monkeypatch):
+    d = _dispatcher(monkeypatch, OUTBOUND_COALESCE_WINDOW_SEC="5")
+    bot = FakeBot()
+
+    async def main():
+        push = asyncio.ensure_future(d.send(bot, "group", 1, "push"))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(d.send(bot, "group", 1, "reply", priority=PRIORITY_REPLY), 1)
+        await asyncio.wait_for(push, 1)
+        await d.close()
+
+    asyncio.run(main())
+    assert [s[2] for s in bot.sent] == ["push", "reply"]
+
+
+def test_ambiguous_failures_are_never_resent(monkeypatch):
+    d = _dispatcher(monkeypatch, OUTBOUND_MAX_RETRIES="3")
+    timed_out = FakeBot(fail_times=1, error=lambda: NetworkError("WebSocket call api send_group_msg timeout"))
+    napcat_timeout = FakeBot(fail_times=1, error=lambda: ActionFailed(retcode=200, message="发送消息超时"))
+    unknown_code = FakeBot(fail_times=1, error=lambda: ActionFailed(retcode=1400, message="bad request"))
+    forward_timeout = FakeBot(fail_times=1, error=lambda: NetworkError("timeout"))
+
+    async def main():
+        for bot in (timed_out, napcat_timeout, unknown_code):
+            with pytest.raises((NetworkError, ActionFailed)):
+                await d.send(bot, "group", 1, "once")
+        with pytest.raises(NetworkError):
+            await d.send(forward_timeout, "group", 2, "long", nodes=[{"type": "node"}])
+        await d.close()
+
+    asyncio.run(main())
+    for bot in (timed_out, napcat_timeout, unknown_code, forward_timeout):
+        assert bot.attempts == 1 and not bot.sent
+    stats = d.stats()
+    assert (stats["retries"], stats["fallbacks"], stats["failed"]) == (0, 0, 4)
+
+
+def test_scheduler_survives_a_failing_job(monkeypatch):
+    d = _dispatcher(monkeypatch, OUTBOUND_COALESCE_WINDOW_SEC="0.01")
+    bot = FakeBot()
+    real_coalesce = d._coalesce
+    calls = []
+
+    def flaky_coalesce(head, lane):
+        calls.append(head.message)
+        if head.message == "boom":
+            raise ValueError("bad job")
+        return real_coalesce(head, lane)
+
+    monkeypatch.setattr(d, "_coalesce", flaky_coalesce)
+
+    async def main():
+        with pytest.raises(ValueError):
+            await asyncio.wait_for(d.send(bot, "group", 1, "boom"), 1)
+        await asyncio.wait_for(d.send(bot, "group", 2, "still works"), 1)
+        await d.close()
+
+    asyncio.run(main())
+    assert [s[2] for s in bot.sent] == ["still works"]
+    assert d.stats()["queued"] == 0
+
+
+def test_lone_push_is_not_held(monkeypatch):
+    d = _dispatcher(monkeypatch, OUTBOUND_COALESCE_WINDOW_SEC="5")
+    bot = FakeBot()
+
+    async def main():
+        await asyncio.wait_for(d.send(bot, "group", 1, "first"), 1)
+        # a second push to the same group shortly after is held for the window
+        second = asyncio.ensure_future(d.send(bot, "group", 1, "second"))
+        await asyncio.sleep(0.1)
+        held = not second.done()
+        # other groups are unaffected
+        await asyncio.wait_for(d.send(bot, "group", 2, "elsewhere"), 1)
+        await d.close()
+        return held
+
+    held = asyncio.run(main())
+    assert held
+    assert [s[2] for s in bot.sent] == ["first", "elsewhere"]
+
+
+def test_nothing_sent_classification(monkeypatch):
+    d = _dispatcher(monkeypatch)
+    assert d.nothing_sent(OutboundQueueFull("full"))
+    assert d.nothing_sent(ActionFailed(retcode=100, message="发送失败"))
+    assert not d.nothing_sent(ActionFailed(retcode=200, message="发送消息超时"))
+    assert not d.nothing_sent(NetworkError("WebSocket call api send_group_msg timeout"))
+    assert not d.nothing_sent(RuntimeError("unknown"))
@@ -0,0 +1,45 @@
+"""
+最近图片索引测试
+验证追问识别、按提问者/被回复消息查找、TTL 与容量上限
+"""
+from src.utils.message_parser import ImageSegment
+from src.utils.recent_images import RecentImageIndex, is_image_follow_up
+
+
+def _img(name: str) -> ImageSegment:
+    return ImageSegment(url=f"http://img/{name}", file=name)
+
+
+def test_follow_up_detection():
+    for text in ("这张图什么意思", "@123 这图啥意思", "上面的截图是什么", "图里是谁", "帮我看一下图"):
+        assert is_image_follow_up(text), text
+    for text in ("今天天气怎么样", "帮我画一张猫", "地图上这是哪", ""):
+        assert not is_image_follow_up(text), text
+
+
+def test_find_prefers_asker_and_whole_message():
+    index = RecentImageIndex()
+    index.record("g1", "alice", 1, [_img("a1"), _img("a2")])
+    index.record("g1", "bob", 2, [_img("b1")])
+
+    assert [i.file for i in index.find("g1", user_id="carol")] == ["b1"]
+    assert [i.file for i in index.find("g1", user_id="alice", limit=3)] == ["a1", "a2"]
+    assert [i.file for i in index.find("g1", message_id=1, limit=3)] == ["a1", "a2"]
+    assert index.find("g2") == []
+
+
+def test_ttl_and_bounds(monkeypatch):
+    monkeypatch.setenv("RECENT_IMAGES_PER_GROUP", "2")
+    monkeypatch.setenv("RECENT_IMAGES_MAX_GROUPS", "2")
+    index = RecentImageIndex()
+    index.record("g1", "u", 1, [_img("1"), _img("2"), _img("3")])
+    assert [i.file for i in index.find("g1", limit=5)] == ["2", "3"]
+
+    index.record("g2", "u", 1, [_img("x")])
+    index.record("g3", "u", 1, [_img("y")])
+    assert index.find("g1") == []  # least recently active group dropped
+    assert index.stats() == {"groups": 2, "images": 2}
+
+    index.ttl_sec = -1
+    assert index.find("g3") == []
+    assert [i.file for i in index.find("g3", message_id=1)] == ["y"]  # explicit reply ignores TTL
@@ -0,0 +1,70 @@
+"""
+阶段依赖图测试
+验证无依赖的阶段并发执行、依赖结果传递、阶段耗时记录、错误传播，以及群上下文读取
+"""
+import asyncio
+import time
+
+import pytest
+
+from src.utils.deadline import Deadline
+from src.utils.stage_graph import StageError, StageGraph
+
+
+def test_independent_stages_overlap():
+    deadline = Deadline(10, {})
+
+    async def context(_):
+        await asyncio.sleep(0.1)
+        return ["history"]
+
+    async def media(_):
+        await asyncio.sleep(0.1)
+        return ["image"]
+
+    async def llm(deps):
+        return deps["context"] + deps["media"]
+
+    graph = StageGraph(deadline).add("context", context).add("media", media).add("llm", llm, after=["context", "media"])
+    t0 = time.monotonic()
+    results = asyncio.run(graph.run())
+    assert time.monotonic() - t0 < 0.18
+    assert results["llm"] == ["history", "image"]
+    assert set(deadline.stages) == {"context", "media", "llm"}
+    assert deadline.stages["context"] >= 0.09
+
+
+def test_failure_skips_dependents():
+    ran = []
+
+    async def broken(_):
+        raise ValueError("download failed")
+
+    async def after(_):
+        ran.append("after")
+
+    graph = StageGraph().add("media", broken).add("llm", after, after=["media"])
+    with pytest.raises(ValueError):
+        asyncio.run(graph.run())
+    assert ran == []
+
+
+def test_invalid_graph():
+    async def noop(_):
+        return None
+
+    with pytest.raises(StageError):
+        asyncio.run(StageGraph().add("a", noop, after=["missing"]).run())
+    with pytest.raises(StageError):
+        asyncio.run(StageGraph().add("a", noop, after=["b"]).add("b", noop, after=["a"]).run())
+
+
+def test_group_context_rows(tmp_path):
+    from src.utils.database import Database
+
+    db = Database(str(tmp_path / "ctx.db"))
+    db.add_group_context("g1", "42", "alice", "hello")
+    db.add_group_context("g1", None, "bot", "hi")
+    rows = db.get_group_context("g1")
+    # same-second rows have no defined order
+    assert sorted((name, uid, msg) for _, uid, name, msg in rows) == [("alice", "42", "hello"), ("bot", None, "hi")]
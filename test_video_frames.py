@@ -0,0 +1,80 @@
+"""
+视频抽帧测试
+验证 image2pipe 输出拆分、时长上限，以及流水线把关键帧转成图片 parts
+（ffmpeg 调用用假实现代替，测试环境不需要安装 ffmpeg）
+"""
+import asyncio
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from src.utils import media_pipeline as mp
+from src.utils.video_frames import VideoFrameExtractor, VideoRejectedError, split_jpeg_stream
+
+
+def _jpeg(color) -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", (64, 48), color).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def test_split_jpeg_stream():
+    frames = [_jpeg((255, 0, 0)), _jpeg((0, 255, 0)), _jpeg((0, 0, 255))]
+    parts = split_jpeg_stream(b"".join(frames))
+    assert parts == frames
+    assert Image.open(BytesIO(parts[1])).getpixel((5, 5))[1] > 200
+    assert split_jpeg_stream(frames[0][:-10]) == []  # truncated frame is dropped
+
+
+def test_duration_cap(monkeypatch):
+    monkeypatch.setenv("VIDEO_MAX_DURATION_SEC", "60")
+    ex = VideoFrameExtractor()
+    ex.check_duration(None)
+    ex.check_duration(59.5)
+    with pytest.raises(VideoRejectedError):
+        ex.check_duration(61)
+
+
+def test_pipeline_sends_keyframes_as_images(monkeypatch, tmp_path):
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"\0" * 1000)
+    ex = VideoFrameExtractor()
+    monkeypatch.setattr(VideoFrameExtractor, "enabled", property(lambda self: True))
+
+    async def probe(source, timeout=10, headers=None):
+        assert headers and headers["Referer"]
+        return 12.0
+
+    async def keyframes(path):
+        return [_jpeg((1, 1, 1)), _jpeg((2, 2, 2))]
+
+    async def sheet(path, duration):
+        return _jpeg((3, 3, 3))
+
+    async def download_video(url, max_bytes=None, timeout=60):
+        return video
+
+    monkeypatch.setattr(ex, "probe_duration", probe)
+    monkeypatch.setattr(ex, "keyframes", keyframes)
+    monkeypatch.setattr(ex, "contact_sheet", sheet)
+    monkeypatch.setattr(mp, "video_frames", ex)
+    monkeypatch.setattr(mp.media_downloader, "download_video", download_video)
+
+    parsed = SimpleNamespace(images=[], audios=[], videos=[SimpleNamespace(url="http://x/clip.mp4", file="clip.mp4")])
+    batch = asyncio.run(mp.MediaPipeline().process(parsed))
+
+    assert not batch.errors
+    parts = batch.parts
+    assert parts[0]["type"] == "text" and "12 秒" in parts[0]["text"]
+    assert [p["type"] for p in parts[1:]] == ["image_url"] * 3
+    assert batch.image_hashes == []  # video frames never hit the vision answer cache
+
+    # too long: rejected from the probe, before frames are extracted
+    async def long_probe(source, timeout=10, headers=None):
+        return 3600.0
+
+    monkeypatch.setattr(ex, "probe_duration", long_probe)
+    batch = asyncio.run(mp.MediaPipeline().process(parsed))
+    assert batch.parts == [] and "too long" in batch.errors[0].error
@@ -0,0 +1,70 @@
+"""
+识图缓存测试
+验证重新压缩后的图片感知哈希相近、近似命中、TTL 与容量淘汰
+"""
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from src.utils.image_utils import dhash, encode_image_with_dhash, hamming
+from src.utils.vision_cache import VisionCache
+
+
+def _meme(size=(800, 600)) -> Image.Image:
+    img = Image.new("RGB", size, (240, 240, 240))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((100, 100, 500, 500), fill=(200, 30, 30))
+    draw.rectangle((450, 50, 750, 300), fill=(20, 20, 160))
+    return img
+
+
+def test_dhash_survives_recompression_and_resize():
+    original = _meme()
+    buf = BytesIO()
+    original.resize((400, 300)).save(buf, format="JPEG", quality=40)
+    data, repost_hash = encode_image_with_dhash(buf.getvalue(), max_px=256)
+
+    assert data[:2] == b"\xff\xd8"
+    assert hamming(dhash(original), repost_hash) <= 6
+    assert hamming(dhash(original), dhash(original.transpose(Image.Transpose.FLIP_LEFT_RIGHT))) > 6
+
+
+def test_near_duplicate_hits_same_prompt_only(monkeypatch):
+    monkeypatch.setenv("VISION_CACHE_HAMMING", "4")
+    cache = VisionCache()
+    cache.put("group_1", "这是什么？", [0b1111], "一只猫")
+
+    assert cache.get("group_1", "这是什么", [0b1111]) == "一只猫"  # trailing punctuation ignored
+    assert cache.get("group_1", "这是什么", [0b1110]) == "一只猫"  # 1 bit away
+    assert cache.get("group_1", "这是谁", [0b1111]) is None
+    assert cache.get("group_1", "这是什么", [0b1111, 0b1111]) is None  # different image count
+    assert cache.get("group_1", "这是什么", [(1 << 64) - 1]) is None
+
+    stats = cache.stats()
+    assert (stats["lookups"], stats["hits"], stats["near_hits"]) == (5, 2, 1)
+    assert stats["hit_rate"] == 0.4
+
+
+def test_answers_stay_in_their_group():
+    cache = VisionCache()
+    cache.put("group_1", "这是什么", [0b1111], "群1的回答")
+
+    assert cache.get("group_2", "这是什么", [0b1111]) is None
+    assert cache.get("user_42", "这是什么", [0b1111]) is None
+    assert cache.get("group_1", "这是什么", [0b1111]) == "群1的回答"
+
+
+def test_ttl_and_capacity(monkeypatch):
+    monkeypatch.setenv("VISION_CACHE_MAX", "2")
+    cache = VisionCache()
+    ones = (1 << 64) - 1
+    cache.put("g", "q", [0], "a")
+    cache.put("g", "q", [ones], "b")
+    cache.put("g", "q", [0xFFFFFFFF00000000], "c")  # 32 bits from both
+    assert cache.stats()["evictions"] == 1
+    assert cache.get("g", "q", [0]) is None
+
+    cache.ttl_sec = 0
+    cache._entries[next(iter(cache._entries))].created_at -= 10
+    assert cache.get("g", "q", [ones]) is None
+    assert cache.stats()["expired"] == 1